@@ -15,3 +15,13 @@ class ServiceUnavailable(APIException):
     status_code = 503
     default_detail = "Service temporarily unavailable, try again later."
     default_code = "service_unavailable"
+
+
+class InvalidTokenListException(APIException):
+    status_code = 400
+    default_detail = "You should send a JSON array of tokens"
+
+
+class TooManyTokensException(APIException):
+    status_code = 413
+    default_detail = "Too many tokens in a single request"
@@ -1,13 +1,61 @@
+import time
+
+from django.http import HttpResponse
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.decorators import permission_classes
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import AllowAny
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
-from b2c_auth_playground.support.utils import is_internet_available
+from b2c_auth_playground.apps.core.services.health import health_prober
+from b2c_auth_playground.apps.core.services.metrics import render_metrics
+from b2c_auth_playground.apps.core.services.profiler import profile_store
+from b2c_auth_playground.settings import B2C_METRICS_PUBLIC
 
 
 @api_view(["GET"])
 def health_check(request):
-    if is_internet_available():
-        return Response({"internetAvailable": True}, status=status.HTTP_200_OK)
+    # Dependencies are probed in the background; here we only read what the prober last saw. Server processes start
+    # the prober when they boot (see `startup.start_background_work`), this only covers the ones that did not
+    health_prober.ensure_started()
+    now = time.monotonic()
+    statuses = health_prober.snapshot()
+    starting = health_prober.starting
+    healthy = not starting and all(dependency.healthy for dependency in statuses.values() if dependency.critical)
+    body = {
+        "healthy": healthy,
+        "status": "starting" if starting else "healthy" if healthy else "unhealthy",
+        "dependencies": {name: dependency.as_dict(now) for name, dependency in statuses.items()},
+    }
+    if healthy:
+        return Response(body, status=status.HTTP_200_OK)
     else:
-        return Response({"internetAvailable": False}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(body, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny] if B2C_METRICS_PUBLIC else [IsAdminUser])
+def metrics(request):
+    # Prometheus text format rather than something DRF renders
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def profiles(request):
+    # Only the profiles of the worker process that answers
+    return Response([profile.summary() for profile in profile_store.all()])
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def download_profile(request, profile_id):
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise NotFound
+    response = HttpResponse(profile.collapsed(), content_type="text/plain; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{profile.id}.folded"'
+    return response
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+
+from typing import Optional
+
+import jwt
+import requests
+
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.authentication import get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from b2c_auth_playground.apps.core.api.api_exception import ServiceUnavailable
+from b2c_auth_playground.apps.core.services.authority_registry import UnknownUserFlowError
+from b2c_auth_playground.apps.core.services.introspection import introspection_executor
+from b2c_auth_playground.apps.core.services.introspection import verify_registered_token
+
+logger = logging.getLogger(__name__)
+
+
+class B2CUser:
+    """
+    Who sent a bearer token. Nothing is stored: it only exposes the claims of the token.
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+    is_staff = False
+    is_superuser = False
+
+    def __init__(self, claims: dict):
+        self.claims = claims
+        self.pk = self.id = claims.get("oid") or claims.get("sub")
+        self.username = claims.get("name") or self.id
+
+    def __str__(self):
+        return str(self.username)
+
+
+def bearer_token(request) -> Optional[str]:
+    header = get_authorization_header(request).split()
+    if not header or header[0].lower() != b"bearer":
+        return None
+    if len(header) != 2:
+        raise AuthenticationFailed("Invalid Authorization header, it should be `Bearer <token>`")
+    return header[1].decode("latin-1")
+
+
+def verify_bearer_token(token: str) -> dict:
+    try:
+        _, claims = verify_registered_token(token)
+    except (jwt.InvalidTokenError, UnknownUserFlowError) as e:
+        raise AuthenticationFailed(f"Invalid bearer token: {e}")
+    except requests.RequestException as e:
+        logger.warning("Could not load the signing keys to verify a bearer token: %s", e)
+        raise ServiceUnavailable
+    return claims
+
+
+def home_account_id(claims: dict) -> str:
+    """
+    The account MSAL files the tokens of this user under: `<oid>-<user flow>.<tenant id>`, the tenant id being part of
+    the issuer (https://xptoorg.b2clogin.com/03f16fb5-12d8-4a0b-a65e-d325ea25ed2a/v2.0/).
+    """
+    subject = claims.get("oid") or claims["sub"]
+    user_flow = claims.get("tfp") or claims.get("acr")
+    tenant_id = claims.get("tid") or claims["iss"].rstrip("/").split("/")[-2]
+    return f"{subject}-{user_flow.lower()}.{tenant_id}"
+
+
+class B2CBearerAuthentication(BaseAuthentication):
+    """
+    `Authorization: Bearer <token>` with a token issued by one of the registered user flows. It is verified with the
+    cached signing keys, so requests authenticated this way never touch the session. `request.auth` has the claims.
+    """
+
+    keyword = "Bearer"
+
+    def authenticate(self, request):
+        token = bearer_token(request)
+        if token is None:
+            return None
+        claims = verify_bearer_token(token)
+        return B2CUser(claims), claims
+
+    def authenticate_header(self, request):
+        return f'{self.keyword} realm="api"'
+
+
+async def authenticate_bearer_async(request) -> Optional[dict]:
+    """
+    Claims of the bearer token of the request, if it has one, for views of the async stack. Raises like
+    `B2CBearerAuthentication` does.
+    """
+    token = bearer_token(request)
+    if token is None:
+        return None
+    # Verifying is CPU work (and a key fetch the first time), so it stays off the event loop
+    return await asyncio.get_running_loop().run_in_executor(introspection_executor, verify_bearer_token, token)
@@ -0,0 +1,13 @@
+from rest_framework.throttling import UserRateThrottle
+
+from b2c_auth_playground.settings import B2C_INTROSPECTION_RATE
+
+
+class IntrospectionRateThrottle(UserRateThrottle):
+    """
+    Requests to the introspection endpoint, per user (a bearer token caller is its subject). Each request can make us
+    verify B2C_INTROSPECTION_MAX_TOKENS signatures.
+    """
+
+    scope = "introspection"
+    rate = B2C_INTROSPECTION_RATE
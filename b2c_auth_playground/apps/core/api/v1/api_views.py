@@ -1,38 +1,76 @@
 import logging
 
+import jwt
 import msal
 
 from django.shortcuts import redirect
 from django.urls import reverse
 from rest_framework.decorators import api_view
+from rest_framework.decorators import permission_classes
+from rest_framework.decorators import throttle_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
 
 from b2c_auth_playground.apps.core.api.api_exception import B2CContractNotRespectedException
+from b2c_auth_playground.apps.core.api.api_exception import InvalidTokenListException
 from b2c_auth_playground.apps.core.api.api_exception import ServiceUnavailable
+from b2c_auth_playground.apps.core.api.api_exception import TooManyTokensException
+from b2c_auth_playground.apps.core.api.authentication import B2CUser
+from b2c_auth_playground.apps.core.api.authentication import home_account_id
+from b2c_auth_playground.apps.core.api.throttling import IntrospectionRateThrottle
+from b2c_auth_playground.apps.core.services.authority_registry import UnknownUserFlowError
+from b2c_auth_playground.apps.core.services.flow_state import consume_flow
+from b2c_auth_playground.apps.core.services.flow_state import forgetting_flow
+from b2c_auth_playground.apps.core.services.introspection import introspect_tokens
+from b2c_auth_playground.apps.core.services.metrics import timed
 from b2c_auth_playground.apps.core.services.microsoft_b2c import obtain_access_token
 from b2c_auth_playground.apps.core.services.microsoft_b2c import verify_flow
+from b2c_auth_playground.apps.core.services.resilience import UpstreamUnavailable
+from b2c_auth_playground.apps.core.services.token_cache_codec import dumps_cache
+from b2c_auth_playground.apps.core.services.token_cache_codec import loads_cache
+from b2c_auth_playground.apps.core.services.token_cache_store import PartitionedTokenCache
+from b2c_auth_playground.apps.core.services.token_cache_store import new_session_partition
+from b2c_auth_playground.apps.core.services.token_cache_store import token_cache_store
 from b2c_auth_playground.settings import B2C_AUTHORITY_SIGN_UP_SIGN_IN
+from b2c_auth_playground.settings import B2C_FLOW_STATE_STORE
+from b2c_auth_playground.settings import B2C_INTROSPECTION_MAX_TOKENS
 from b2c_auth_playground.settings import B2C_SCOPES
+from b2c_auth_playground.settings import B2C_TOKEN_CACHE_BACKEND
+from b2c_auth_playground.settings import B2C_TOKEN_CACHE_CODEC
 
 logger = logging.getLogger(__name__)
 
 
+@forgetting_flow
 @api_view(["GET"])
 def handle_response_oidc(request: Request) -> Response:
     current_referer = request.headers.get("referer")
     logger.info("It came from %s", current_referer)
 
     code_from_user_flow = request.query_params.get("code")
-    auth_flow_details = request.session.pop("flow", {})
-    auth_flow_details = auth_flow_details if auth_flow_details else request.session.pop("flow-edit", {})
+    if B2C_FLOW_STATE_STORE == "cookie":
+        auth_flow_details = consume_flow(request)
+    else:
+        auth_flow_details = request.session.pop("flow", {})
+        auth_flow_details = auth_flow_details if auth_flow_details else request.session.pop("flow-edit", {})
     if not code_from_user_flow or not auth_flow_details:
         # I got this error after cancelling my PROFILE EDIT flow: error=access_denied&error_description=AADB2C90091: The user has cancelled entering self-asserted information.
         raise B2CContractNotRespectedException
 
     logger.debug("Trying to finish the flow")
     cache = _load_cache(request)
-    acquire_token_details = verify_flow(auth_flow_details, request.query_params, cache)
+    try:
+        acquire_token_details = verify_flow(auth_flow_details, request.query_params, cache)
+    except jwt.InvalidTokenError as e:
+        logger.warning("The id_token we received is not valid: %s", e)
+        raise B2CContractNotRespectedException
+    except UnknownUserFlowError as e:
+        logger.warning("The flow did not start from a user flow we know: %s", e)
+        raise B2CContractNotRespectedException
+    except UpstreamUnavailable as e:
+        logger.warning("Could not redeem the authorization code: %s", e)
+        raise ServiceUnavailable
     if acquire_token_details.error:
         logger.error(
             "We got %s! Its description: %s",
@@ -52,7 +90,11 @@ def handle_response_oidc(request: Request) -> Response:
 def consult_user_data(request):
     cache = _load_cache(request)
     hard_coded_scopes = B2C_SCOPES
-    result = obtain_access_token(hard_coded_scopes, cache, B2C_AUTHORITY_SIGN_UP_SIGN_IN)
+    try:
+        result = obtain_access_token(hard_coded_scopes, cache, B2C_AUTHORITY_SIGN_UP_SIGN_IN)
+    except UpstreamUnavailable as e:
+        logger.warning("Could not refresh the access token: %s", e)
+        raise ServiceUnavailable
     _save_cache(request, cache)
 
     try:
@@ -69,21 +111,69 @@ def consult_user_data(request):
 
 @api_view(["GET"])
 def what_do_i_have(request):
+    if isinstance(request.user, B2CUser):
+        # Authenticated with a bearer token, whose claims are all we know
+        return Response(data=request.auth)
     id_token_claims = request.session["user"]
     return Response(data=id_token_claims)
 
 
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+@throttle_classes([IntrospectionRateThrottle])
+def introspect(request):
+    # Body: ["eyJ0eXAiOiJKV1Qi...", "eyJ0eXAiOiJKV1Qi..."]; the answer has one result per token, in the same order
+    tokens = request.data
+    if not isinstance(tokens, list) or not all(isinstance(token, str) for token in tokens):
+        raise InvalidTokenListException
+    if len(tokens) > B2C_INTROSPECTION_MAX_TOKENS:
+        raise TooManyTokensException
+    return Response(data=introspect_tokens(tokens))
+
+
+@timed("cache_load")
 def _load_cache(request):
+    if B2C_TOKEN_CACHE_BACKEND == "partitioned":
+        # The session only holds a pointer; partitions are loaded when MSAL needs them
+        return PartitionedTokenCache(token_cache_store(), *_token_cache_pointer(request))
     cache = msal.SerializableTokenCache()
     token_cache = request.session.get("token_cache")
     if token_cache:
-        cache.deserialize(token_cache)
+        loads_cache(cache, token_cache)
     return cache
 
 
+def _token_cache_pointer(request):
+    """
+    The account and session partition of the caller's token cache.
+    """
+    # Bearer token callers have no session: the account comes from the token and its cache is shared
+    if isinstance(request.user, B2CUser):
+        return home_account_id(request.auth), None
+    account = request.session.get("token_cache_account")
+    partition = request.session.get("token_cache_partition")
+    # Sessions from before partitions were per session keep reading the account's shared one
+    if not partition and not account:
+        partition = new_session_partition()
+    return account, partition
+
+
+@timed("cache_save")
 def _save_cache(request, cache):
+    if isinstance(cache, PartitionedTokenCache):
+        if cache.has_state_changed:
+            cache.flush()
+            if isinstance(request.user, B2CUser):
+                return
+            if request.session.get("token_cache_account") != cache.home_account_id:
+                request.session["token_cache_account"] = cache.home_account_id
+                request.session["token_cache_partition"] = cache.session_partition
+        return
     if cache.has_state_changed:
-        request.session["token_cache"] = cache.serialize()
+        if B2C_TOKEN_CACHE_CODEC == "compact":
+            request.session["token_cache"] = dumps_cache(cache)
+        else:
+            request.session["token_cache"] = cache.serialize()
         # Sample value of what is returned from `cache.serialize()`:
         # {
         #     "Account": {
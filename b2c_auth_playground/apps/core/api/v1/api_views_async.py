@@ -0,0 +1,237 @@
+import json
+import logging
+import math
+
+from typing import Optional
+
+import jwt
+import msal
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.authentication import CSRFCheck
+from rest_framework.exceptions import APIException
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.exceptions import NotAuthenticated
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import Throttled
+
+from b2c_auth_playground.apps.core.api.api_exception import B2CContractNotRespectedException
+from b2c_auth_playground.apps.core.api.api_exception import InvalidTokenListException
+from b2c_auth_playground.apps.core.api.api_exception import ServiceUnavailable
+from b2c_auth_playground.apps.core.api.api_exception import TooManyTokensException
+from b2c_auth_playground.apps.core.api.authentication import B2CUser
+from b2c_auth_playground.apps.core.api.authentication import authenticate_bearer_async
+from b2c_auth_playground.apps.core.api.authentication import home_account_id
+from b2c_auth_playground.apps.core.api.throttling import IntrospectionRateThrottle
+from b2c_auth_playground.apps.core.services.authority_registry import UnknownUserFlowError
+from b2c_auth_playground.apps.core.services.flow_state import consume_flow
+from b2c_auth_playground.apps.core.services.flow_state import forgetting_flow
+from b2c_auth_playground.apps.core.services.introspection import introspect_tokens_async
+from b2c_auth_playground.apps.core.services.metrics import timed
+from b2c_auth_playground.apps.core.services.microsoft_b2c_async import obtain_access_token_async
+from b2c_auth_playground.apps.core.services.microsoft_b2c_async import verify_flow_async
+from b2c_auth_playground.apps.core.services.resilience import UpstreamUnavailable
+from b2c_auth_playground.apps.core.services.token_cache_codec import dumps_cache
+from b2c_auth_playground.apps.core.services.token_cache_codec import loads_cache
+from b2c_auth_playground.apps.core.services.token_cache_store import PartitionedTokenCache
+from b2c_auth_playground.apps.core.services.token_cache_store import new_session_partition
+from b2c_auth_playground.apps.core.services.token_cache_store import token_cache_store
+from b2c_auth_playground.settings import B2C_AUTHORITY_SIGN_UP_SIGN_IN
+from b2c_auth_playground.settings import B2C_FLOW_STATE_STORE
+from b2c_auth_playground.settings import B2C_INTROSPECTION_MAX_TOKENS
+from b2c_auth_playground.settings import B2C_SCOPES
+from b2c_auth_playground.settings import B2C_TOKEN_CACHE_BACKEND
+from b2c_auth_playground.settings import B2C_TOKEN_CACHE_CODEC
+
+logger = logging.getLogger(__name__)
+
+# DRF views cannot be coroutines, so these are plain Django async views answering what the DRF ones in `api_views`
+# answer. Errors keep DRF's `{"detail": ...}` body.
+
+
+def _error_response(exception_class: APIException) -> JsonResponse:
+    return JsonResponse({"detail": exception_class.default_detail}, status=exception_class.status_code)
+
+
+async def _authenticate(request) -> Optional[JsonResponse]:
+    """
+    Keeps the claims of the bearer token in `request.auth`, like DRF does, or `None` when there is none. Returns the
+    response to give when the token is not accepted.
+    """
+    try:
+        request.auth = await authenticate_bearer_async(request)
+    except AuthenticationFailed:
+        response = _error_response(AuthenticationFailed)
+        response["WWW-Authenticate"] = 'Bearer realm="api"'
+        return response
+    except ServiceUnavailable:
+        return _error_response(ServiceUnavailable)
+    return None
+
+
+def _csrf_rejected(request) -> Optional[JsonResponse]:
+    """
+    What DRF's `SessionAuthentication` does for session users: the request must pass the CSRF check.
+    """
+    check = CSRFCheck(lambda request: None)
+    check.process_request(request)
+    reason = check.process_view(request, None, (), {})
+    if not reason:
+        return None
+    return JsonResponse({"detail": f"CSRF Failed: {reason}"}, status=PermissionDenied.status_code)
+
+
+@forgetting_flow
+async def handle_response_oidc(request):
+    current_referer = request.headers.get("referer")
+    logger.info("It came from %s", current_referer)
+
+    code_from_user_flow = request.GET.get("code")
+    if B2C_FLOW_STATE_STORE == "cookie":
+        auth_flow_details = consume_flow(request)
+    else:
+        auth_flow_details = await request.session.apop("flow", {})
+        auth_flow_details = auth_flow_details if auth_flow_details else await request.session.apop("flow-edit", {})
+    if not code_from_user_flow or not auth_flow_details:
+        return _error_response(B2CContractNotRespectedException)
+
+    logger.debug("Trying to finish the flow")
+    cache = await _load_cache(request)
+    try:
+        acquire_token_details = await verify_flow_async(auth_flow_details, request.GET, cache)
+    except jwt.InvalidTokenError as e:
+        logger.warning("The id_token we received is not valid: %s", e)
+        return _error_response(B2CContractNotRespectedException)
+    except UnknownUserFlowError as e:
+        logger.warning("The flow did not start from a user flow we know: %s", e)
+        return _error_response(B2CContractNotRespectedException)
+    except UpstreamUnavailable as e:
+        logger.warning("Could not redeem the authorization code: %s", e)
+        return _error_response(ServiceUnavailable)
+    if acquire_token_details.error:
+        logger.error(
+            "We got %s! Its description: %s",
+            acquire_token_details.error,
+            acquire_token_details.error_description,
+        )
+        return _error_response(ServiceUnavailable)
+    else:
+        await _save_cache(request, cache)
+        await request.session.aset("user", acquire_token_details.id_token_claims)
+        location_index = reverse("index")
+        return redirect(location_index)
+
+
+async def consult_user_data(request):
+    rejected = await _authenticate(request)
+    if rejected:
+        return rejected
+    cache = await _load_cache(request)
+    hard_coded_scopes = B2C_SCOPES
+    try:
+        result = await obtain_access_token_async(hard_coded_scopes, cache, B2C_AUTHORITY_SIGN_UP_SIGN_IN)
+    except UpstreamUnavailable as e:
+        logger.warning("Could not refresh the access token: %s", e)
+        return _error_response(ServiceUnavailable)
+    await _save_cache(request, cache)
+
+    try:
+        access_token = result.get("access_token")
+        if not access_token:
+            logger.warning(
+                "Authentication gives you an id token only. Authorisation to a resource gives you access tokens"
+            )
+    except AttributeError:
+        result = {"error": "did you use ROPC?!"}
+
+    return JsonResponse(result, safe=False)
+
+
+async def what_do_i_have(request):
+    rejected = await _authenticate(request)
+    if rejected:
+        return rejected
+    if request.auth is not None:
+        return JsonResponse(request.auth, safe=False)
+    id_token_claims = await request.session.aget("user")
+    return JsonResponse(id_token_claims, safe=False)
+
+
+# DRF exempts its views from CSRF and only enforces it for session users, so does this one
+@csrf_exempt
+@require_POST
+async def introspect(request):
+    # What `IsAuthenticated` and `IntrospectionRateThrottle` do for the DRF view
+    rejected = await _authenticate(request)
+    if rejected:
+        return rejected
+    request.user = B2CUser(request.auth) if request.auth is not None else await request.auser()
+    if not request.user.is_authenticated:
+        response = _error_response(NotAuthenticated)
+        response["WWW-Authenticate"] = 'Bearer realm="api"'
+        return response
+    if request.auth is None:
+        rejected = _csrf_rejected(request)
+        if rejected:
+            return rejected
+    throttle = IntrospectionRateThrottle()
+    if not throttle.allow_request(request, None):
+        response = _error_response(Throttled)
+        response["Retry-After"] = str(math.ceil(throttle.wait()))
+        return response
+    try:
+        tokens = json.loads(request.body)
+    except ValueError:
+        return _error_response(InvalidTokenListException)
+    if not isinstance(tokens, list) or not all(isinstance(token, str) for token in tokens):
+        return _error_response(InvalidTokenListException)
+    if len(tokens) > B2C_INTROSPECTION_MAX_TOKENS:
+        return _error_response(TooManyTokensException)
+    return JsonResponse(await introspect_tokens_async(tokens), safe=False)
+
+
+@timed("cache_load")
+async def _load_cache(request):
+    if B2C_TOKEN_CACHE_BACKEND == "partitioned":
+        return PartitionedTokenCache(token_cache_store(), *await _token_cache_pointer(request))
+    cache = msal.SerializableTokenCache()
+    token_cache = await request.session.aget("token_cache")
+    if token_cache:
+        loads_cache(cache, token_cache)
+    return cache
+
+
+async def _token_cache_pointer(request):
+    # Bearer token callers have no session: the account comes from the token and its cache is shared
+    claims = getattr(request, "auth", None)
+    if claims is not None:
+        return home_account_id(claims), None
+    account = await request.session.aget("token_cache_account")
+    partition = await request.session.aget("token_cache_partition")
+    # Sessions from before partitions were per session keep reading the account's shared one
+    if not partition and not account:
+        partition = new_session_partition()
+    return account, partition
+
+
+@timed("cache_save")
+async def _save_cache(request, cache):
+    if isinstance(cache, PartitionedTokenCache):
+        if cache.has_state_changed:
+            await sync_to_async(cache.flush, thread_sensitive=False)()
+            if getattr(request, "auth", None) is not None:
+                return
+            if await request.session.aget("token_cache_account") != cache.home_account_id:
+                await request.session.aset("token_cache_account", cache.home_account_id)
+                await request.session.aset("token_cache_partition", cache.session_partition)
+        return
+    if cache.has_state_changed:
+        if B2C_TOKEN_CACHE_CODEC == "compact":
+            await request.session.aset("token_cache", dumps_cache(cache))
+        else:
+            await request.session.aset("token_cache", cache.serialize())
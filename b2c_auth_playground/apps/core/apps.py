@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "b2c_auth_playground.apps.core"
+
+    def ready(self):
+        from b2c_auth_playground.apps.core import startup
+        from b2c_auth_playground.settings import B2C_STARTUP_MODE
+
+        # Warming up waits for a server to load the app (see `startup.server_started`), so management commands do not
+        # talk to B2C
+        if B2C_STARTUP_MODE == "preload":
+            # The server forks the workers after this, and each of them warms up (see `post_fork` in gunicorn.conf.py)
+            startup.preload_modules()
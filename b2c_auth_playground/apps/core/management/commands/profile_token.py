@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from b2c_auth_playground.apps.core.services.profiler import PROFILE_HEADER
+from b2c_auth_playground.apps.core.services.profiler import profile_token
+from b2c_auth_playground.settings import B2C_PROFILER_ENABLED
+from b2c_auth_playground.settings import B2C_PROFILER_TOKEN_MAX_AGE
+
+
+class Command(BaseCommand):
+    help = f"Prints a value for the {PROFILE_HEADER} header, which gets a request profiled (see /profiles)"
+
+    def handle(self, *args, **options):
+        if not B2C_PROFILER_ENABLED:
+            self.stderr.write("B2C_PROFILER_ENABLED is off here; the server must have it on to honour the token")
+        self.stderr.write(f"Valid for {B2C_PROFILER_TOKEN_MAX_AGE} seconds, on any server sharing this SECRET_KEY")
+        self.stdout.write(profile_token())
@@ -0,0 +1,162 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from asgiref.sync import markcoroutinefunction
+from asgiref.sync import sync_to_async
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.exceptions import MiddlewareNotUsed
+
+from b2c_auth_playground.apps.core.services.metrics import timed_stage
+from b2c_auth_playground.apps.core.services.profiler import PROFILE_HEADER
+from b2c_auth_playground.apps.core.services.profiler import is_valid_token
+from b2c_auth_playground.apps.core.services.profiler import recording_request
+from b2c_auth_playground.apps.core.services.profiler import save_profile
+from b2c_auth_playground.apps.core.services.request_deadline import deadline
+from b2c_auth_playground.settings import B2C_PROFILER_ENABLED
+from b2c_auth_playground.settings import B2C_PROFILER_PATHS
+from b2c_auth_playground.settings import B2C_PROFILER_THRESHOLD_MS
+from b2c_auth_playground.settings import B2C_REQUEST_DEADLINE
+from b2c_auth_playground.settings import B2C_STATIC_MAX_AGE
+from b2c_auth_playground.settings import B2C_STATIC_SERVE
+from b2c_auth_playground.settings import STATIC_ROOT
+from b2c_auth_playground.settings import STATIC_URL
+from b2c_auth_playground.support.static_assets import StaticAssetIndex
+from b2c_auth_playground.support.static_assets import asset_response
+
+
+class TimedSessionMiddleware(SessionMiddleware):
+    """
+    Django's session middleware, reporting how long saving the session takes as the `session_save` stage.
+    """
+
+    def process_response(self, request, response):
+        with timed_stage("session_save"):
+            return super().process_response(request, response)
+
+
+class SamplingProfilerMiddleware:
+    """
+    Profiles a request when it carries a valid `X-B2C-Profile` header (see `profiler.profile_token`), or, with a
+    threshold, every request under `B2C_PROFILER_PATHS`, keeping only the ones slower than it. Profiles go to the
+    ring buffer of the process and are downloaded from `/profiles`.
+
+    When B2C_PROFILER_ENABLED is off Django drops the middleware altogether.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not B2C_PROFILER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self._threshold = B2C_PROFILER_THRESHOLD_MS / 1000
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _trigger(self, request):
+        token = request.headers.get(PROFILE_HEADER)
+        if token and is_valid_token(token):
+            return "header"
+        if self._threshold and request.path.startswith(B2C_PROFILER_PATHS):
+            return "threshold"
+        return None
+
+    def _keep(self, trigger, duration) -> bool:
+        return trigger == "header" or duration >= self._threshold
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trigger = self._trigger(request)
+        if not trigger:
+            return self.get_response(request)
+        started_at, started = time.time(), time.perf_counter()
+        with recording_request() as recording:
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        if self._keep(trigger, duration):
+            profile = save_profile(recording, request, trigger, started_at, duration)
+            response[PROFILE_HEADER] = profile.id
+        return response
+
+    async def __acall__(self, request):
+        trigger = self._trigger(request)
+        if not trigger:
+            return await self.get_response(request)
+        started_at, started = time.time(), time.perf_counter()
+        with recording_request(sample_current_thread=False) as recording:
+            response = await self.get_response(request)
+        duration = time.perf_counter() - started
+        if self._keep(trigger, duration):
+            profile = save_profile(recording, request, trigger, started_at, duration)
+            response[PROFILE_HEADER] = profile.id
+        return response
+
+
+class RequestDeadlineMiddleware:
+    """
+    Gives each request B2C_REQUEST_DEADLINE seconds for its calls to B2C (see `request_deadline.deadline`). Dropped by
+    Django when it is 0.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not B2C_REQUEST_DEADLINE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with deadline(B2C_REQUEST_DEADLINE):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with deadline(B2C_REQUEST_DEADLINE):
+            return await self.get_response(request)
+
+
+class StaticAssetsMiddleware:
+    """
+    Answers GET and HEAD requests under STATIC_URL from what `collectstatic` left in STATIC_ROOT, with the smallest
+    variant the client accepts. Files whose name has a content hash are cached by browsers for good; anything else for
+    B2C_STATIC_MAX_AGE seconds. Requests for files it does not know go on to the views. Dropped by Django when
+    B2C_STATIC_SERVE is off.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not B2C_STATIC_SERVE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self._index = StaticAssetIndex(STATIC_ROOT)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _find(self, request):
+        if request.method not in ("GET", "HEAD") or not request.path_info.startswith(STATIC_URL):
+            return None
+        return self._index.find(request.path_info[len(STATIC_URL) :])
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        asset = self._find(request)
+        if not asset:
+            return self.get_response(request)
+        return asset_response(asset, request, B2C_STATIC_MAX_AGE)
+
+    async def __acall__(self, request):
+        asset = self._find(request)
+        if not asset:
+            return await self.get_response(request)
+        return await sync_to_async(asset_response, thread_sensitive=False)(
+            asset, request, B2C_STATIC_MAX_AGE, streaming=False
+        )
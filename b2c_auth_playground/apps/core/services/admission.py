@@ -0,0 +1,286 @@
+import asyncio
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from collections import deque
+from contextlib import asynccontextmanager
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable
+from typing import Deque
+from typing import Optional
+from typing import Tuple
+
+from b2c_auth_playground.apps.core.services.metrics import record_admission_rejection
+from b2c_auth_playground.settings import B2C_ADMISSION_IP_BURST
+from b2c_auth_playground.settings import B2C_ADMISSION_IP_PER_MINUTE
+from b2c_auth_playground.settings import B2C_ADMISSION_MAX_IN_FLIGHT
+from b2c_auth_playground.settings import B2C_ADMISSION_MAX_QUEUED
+from b2c_auth_playground.settings import B2C_ADMISSION_QUEUE_TIMEOUT
+from b2c_auth_playground.settings import B2C_ADMISSION_STORE
+from b2c_auth_playground.settings import B2C_ADMISSION_STORE_PATH
+from b2c_auth_playground.settings import B2C_ADMISSION_TRUST_X_FORWARDED_FOR
+from b2c_auth_playground.settings import B2C_ADMISSION_TRUSTED_PROXIES
+from b2c_auth_playground.settings import B2C_ADMISSION_USERNAME_BURST
+from b2c_auth_playground.settings import B2C_ADMISSION_USERNAME_PER_MINUTE
+
+# (tokens left, when they were counted)
+_BucketState = Tuple[float, float]
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status: int, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+@dataclass(frozen=True)
+class BucketLimit:
+    per_minute: float
+    burst: float
+
+    def take(self, state: Optional[_BucketState], now: float) -> Tuple[_BucketState, float]:
+        """
+        Takes one token; returns the new state and 0, or the state as is and how long until a token is available.
+        """
+        rate = self.per_minute / 60
+        tokens, counted_at = state if state else (self.burst, now)
+        tokens = min(self.burst, tokens + (now - counted_at) * rate)
+        if tokens >= 1:
+            return (tokens - 1, now), 0.0
+        return (tokens, now), (1 - tokens) / rate if rate else math.inf
+
+
+class InMemoryBucketStore:
+    """
+    Token buckets of this process only. Keys are kept in an LRU, so random usernames cannot make it grow forever.
+    """
+
+    def __init__(self, max_size: int = 100_000):
+        self._max_size = max_size
+        self._states: "OrderedDict[str, _BucketState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: BucketLimit) -> float:
+        with self._lock:
+            state, wait = limit.take(self._states.get(key), time.time())
+            self._states[key] = state
+            self._states.move_to_end(key)
+            while len(self._states) > self._max_size:
+                self._states.popitem(last=False)
+        return wait
+
+
+class SqliteBucketStore:
+    """
+    Token buckets shared by every worker process of the node. Rows of buckets that refilled are dropped now and then.
+    """
+
+    def __init__(self, path: str, cleanup_every: int = 1000):
+        self._path = str(path)
+        self._cleanup_every = cleanup_every
+        self._takes = 0
+        self._local = threading.local()
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                bucket_key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                counted_at REAL NOT NULL,
+                full_at REAL NOT NULL
+            )
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if not connection:
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def take(self, key: str, limit: BucketLimit) -> float:
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT tokens, counted_at FROM buckets WHERE bucket_key = ?", (key,)).fetchone()
+            (tokens, counted_at), wait = limit.take(row, now)
+            full_at = counted_at + (limit.burst - tokens) * 60 / limit.per_minute if limit.per_minute else math.inf
+            connection.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)", (key, tokens, counted_at, full_at))
+        self._takes += 1
+        if self._takes % self._cleanup_every == 0:
+            # A full bucket is the same as no bucket
+            connection.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+        return wait
+
+
+class _Waiter:
+    def __init__(self, notify: Callable[[], None]):
+        self.notify = notify
+        self.granted = False
+
+
+class ConcurrencyLimiter:
+    """
+    At most `max_in_flight` holders at once; up to `max_queued` more wait at most `queue_timeout` seconds for a slot,
+    which is handed over by whoever releases one. Anyone else is rejected right away. Threads and coroutines can share
+    the same limiter.
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, queue_timeout: float):
+        self._max_in_flight = max_in_flight
+        self._max_queued = max_queued
+        self._queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+
+    def _try_acquire_or_enqueue(self, waiter: _Waiter) -> bool:
+        with self._lock:
+            if self._in_flight < self._max_in_flight:
+                self._in_flight += 1
+                return True
+            if len(self._waiters) >= self._max_queued:
+                raise AdmissionRejected(503, self._queue_timeout, "queue_full")
+            self._waiters.append(waiter)
+            return False
+
+    def _give_up(self, waiter: _Waiter) -> None:
+        with self._lock:
+            if waiter.granted:
+                return
+            self._waiters.remove(waiter)
+        raise AdmissionRejected(503, self._queue_timeout, "queue_timeout")
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                return
+        # It got the slot while going away, so it passes it on
+        self._release()
+
+    def _release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                # The slot goes straight to the oldest waiter, so newcomers cannot cut the line
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.notify()
+            else:
+                self._in_flight -= 1
+
+    @contextmanager
+    def slot(self):
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        if not self._try_acquire_or_enqueue(waiter):
+            event.wait(self._queue_timeout)
+            self._give_up(waiter)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def slot_async(self):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+        waiter = _Waiter(lambda: loop.call_soon_threadsafe(_resolve, granted))
+        if not self._try_acquire_or_enqueue(waiter):
+            try:
+                await asyncio.wait({granted}, timeout=self._queue_timeout)
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+            self._give_up(waiter)
+        try:
+            yield
+        finally:
+            self._release()
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(True)
+
+
+class LoginAdmission:
+    """
+    What stands between a login form and B2C: token buckets per client IP and per username answer 429 when someone
+    tries too often, and the limiter caps the calls to the token endpoint this process has in flight, answering 503
+    when its queue is full. Both raise `AdmissionRejected`.
+    """
+
+    def __init__(
+        self, bucket_store_factory, limiter: ConcurrencyLimiter, ip_limit: BucketLimit, username_limit: BucketLimit
+    ):
+        self._bucket_store_factory = bucket_store_factory
+        self._buckets = None
+        self._limiter = limiter
+        self._ip_limit = ip_limit
+        self._username_limit = username_limit
+
+    def _bucket_store(self):
+        if not self._buckets:
+            self._buckets = self._bucket_store_factory()
+        return self._buckets
+
+    def check_rate(self, client_ip: str, username: str) -> None:
+        wait = self._bucket_store().take(f"ip:{client_ip}", self._ip_limit)
+        if wait:
+            record_admission_rejection("ip_rate")
+            raise AdmissionRejected(429, wait, "ip_rate")
+        # Usernames are whatever attackers type, we only keep a digest of them
+        digest = hashlib.sha256((username or "").strip().lower().encode("utf-8")).hexdigest()[:32]
+        wait = self._bucket_store().take(f"username:{digest}", self._username_limit)
+        if wait:
+            record_admission_rejection("username_rate")
+            raise AdmissionRejected(429, wait, "username_rate")
+
+    @contextmanager
+    def upstream_slot(self):
+        try:
+            with self._limiter.slot():
+                yield
+        except AdmissionRejected as e:
+            record_admission_rejection(e.reason)
+            raise
+
+    @asynccontextmanager
+    async def upstream_slot_async(self):
+        try:
+            async with self._limiter.slot_async():
+                yield
+        except AdmissionRejected as e:
+            record_admission_rejection(e.reason)
+            raise
+
+
+def client_ip(request) -> str:
+    if B2C_ADMISSION_TRUST_X_FORWARDED_FOR:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if hops:
+            # The left-most entries are whatever the client sent
+            return hops[-min(B2C_ADMISSION_TRUSTED_PROXIES, len(hops))]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def _build_bucket_store():
+    if B2C_ADMISSION_STORE == "sqlite":
+        return SqliteBucketStore(B2C_ADMISSION_STORE_PATH)
+    return InMemoryBucketStore()
+
+
+ropc_admission = LoginAdmission(
+    _build_bucket_store,
+    ConcurrencyLimiter(B2C_ADMISSION_MAX_IN_FLIGHT, B2C_ADMISSION_MAX_QUEUED, B2C_ADMISSION_QUEUE_TIMEOUT),
+    ip_limit=BucketLimit(B2C_ADMISSION_IP_PER_MINUTE, B2C_ADMISSION_IP_BURST),
+    username_limit=BucketLimit(B2C_ADMISSION_USERNAME_PER_MINUTE, B2C_ADMISSION_USERNAME_BURST),
+)
@@ -0,0 +1,156 @@
+import json
+import logging
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from b2c_auth_playground.apps.core.services.discovery import discovery_address
+from b2c_auth_playground.apps.core.services.discovery import discovery_cache
+from b2c_auth_playground.settings import B2C_TENANTS
+from b2c_auth_playground.settings import B2C_TENANTS_FILE
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownUserFlowError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class UserFlow:
+    tenant: str
+    name: str
+    authority: str
+    client_id: str
+    client_credential: str
+    # What the `aud` claim of a token may be: the client id for id tokens, the id of an API for access tokens to it
+    audiences: Tuple[str, ...]
+
+    @property
+    def discovery_address(self) -> str:
+        return discovery_address(self.authority)
+
+
+class AuthorityRegistry:
+    """
+    Every tenant and user flow (policy) we talk to, indexed by authority, by user flow name and by what a token says
+    about where it came from: its issuer and its `tfp` (or `acr`) claim. B2C uses one issuer for all user flows of a
+    tenant, so the issuer gives the tenant and the claim the user flow.
+
+    Issuers are only known after discovery; they are indexed by `index_issuers`, which runs when the registry is
+    warmed up or when a token shows up with an issuer we have not seen yet.
+    """
+
+    def __init__(self, tenants: Iterable[dict], issuer_retry_interval: float = 60):
+        self._issuer_retry_interval = issuer_retry_interval
+        self._last_indexing_at = 0.0
+        self._flows: List[UserFlow] = []
+        self._by_authority: Dict[str, UserFlow] = {}
+        self._by_name: Dict[str, UserFlow] = {}
+        self._by_tenant_and_name: Dict[Tuple[str, str], UserFlow] = {}
+        self._tenant_by_issuer: Dict[str, str] = {}
+        self._tenants = set()
+        self._indexed_tenants = set()
+        self._lock = threading.Lock()
+        for tenant in tenants:
+            for user_flow in tenant["user_flows"]:
+                self._add(
+                    UserFlow(
+                        tenant=tenant["name"],
+                        name=user_flow["name"],
+                        authority=tenant["authority_template"].format(user_flow=user_flow["name"]),
+                        client_id=user_flow["client_id"],
+                        client_credential=user_flow["client_credential"],
+                        audiences=tuple(user_flow.get("audiences") or [user_flow["client_id"]]),
+                    )
+                )
+
+    def _add(self, flow: UserFlow) -> None:
+        self._flows.append(flow)
+        self._tenants.add(flow.tenant)
+        self._by_authority[flow.authority.lower()] = flow
+        self._by_tenant_and_name[(flow.tenant, flow.name.lower())] = flow
+        # A name used by more than one tenant has to be resolved with the tenant
+        self._by_name.setdefault(flow.name.lower(), flow)
+
+    @property
+    def flows(self) -> List[UserFlow]:
+        return list(self._flows)
+
+    def flow_for_authority(self, authority: str) -> UserFlow:
+        flow = self._by_authority.get((authority or "").lower())
+        if not flow:
+            raise UnknownUserFlowError(f"No user flow registered for authority {authority}")
+        return flow
+
+    def flow_for_auth_uri(self, auth_uri: str) -> UserFlow:
+        # https://xptoorg.b2clogin.com/xptoorg.onmicrosoft.com/b2c_1_sign-in-sign-up/oauth2/v2.0/authorize?client_id=...
+        return self.flow_for_authority(auth_uri.split("/oauth2/", 1)[0])
+
+    def flow_for_name(self, name: str, tenant: Optional[str] = None) -> UserFlow:
+        key = name.lower()
+        flow = self._by_tenant_and_name.get((tenant, key)) if tenant else self._by_name.get(key)
+        if not flow:
+            raise UnknownUserFlowError(f"No user flow registered with name {name}")
+        return flow
+
+    def flow_for_claims(self, claims: dict) -> UserFlow:
+        """
+        User flow that issued a token with these (possibly not yet verified) claims.
+        """
+        name = claims.get("tfp") or claims.get("acr")
+        issuer = claims.get("iss")
+        if not name or not issuer:
+            raise UnknownUserFlowError("The token has no issuer or user flow claim")
+        # Nothing was verified yet, so the claims can be anything JSON allows
+        if not isinstance(name, str) or not isinstance(issuer, str):
+            raise UnknownUserFlowError("The issuer and user flow claims of the token are not strings")
+        tenant = self._tenant_by_issuer.get(issuer)
+        # Tokens of unknown issuers may be garbage, so tenants we could not index are only retried now and then
+        retry_due = time.monotonic() - self._last_indexing_at >= self._issuer_retry_interval
+        if tenant is None and self._indexed_tenants != self._tenants and retry_due:
+            self.index_issuers()
+            tenant = self._tenant_by_issuer.get(issuer)
+        flow = self._by_tenant_and_name.get((tenant, name.lower())) if tenant else None
+        if not flow:
+            raise UnknownUserFlowError(f"No user flow {name} registered for issuer {issuer}")
+        return flow
+
+    def index_issuers(self) -> None:
+        """
+        Learns the issuer of each tenant not indexed yet from the discovery document of one of its user flows.
+        """
+        with self._lock:
+            self._last_indexing_at = time.monotonic()
+            for flow in self._flows:
+                if flow.tenant in self._indexed_tenants:
+                    continue
+                try:
+                    issuer = discovery_cache.get(flow.discovery_address)["issuer"]
+                except Exception:
+                    logger.exception("Could not learn the issuer of tenant %s", flow.tenant)
+                    continue
+                self._tenant_by_issuer[issuer] = flow.tenant
+                self._indexed_tenants.add(flow.tenant)
+
+
+def load_tenants() -> List[dict]:
+    tenants = list(B2C_TENANTS)
+    if B2C_TENANTS_FILE:
+        with open(B2C_TENANTS_FILE, encoding="utf-8") as file:
+            tenants.extend(json.load(file))
+    return tenants
+
+
+authority_registry = AuthorityRegistry(load_tenants())
+
+
+def warm_up_discovery_documents() -> None:
+    discovery_cache.warm_up(flow.discovery_address for flow in authority_registry.flows)
+    authority_registry.index_issuers()
@@ -0,0 +1,119 @@
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+from typing import List
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+from b2c_auth_playground.settings import B2C_CLAIMS_CACHE_SHARDS
+from b2c_auth_playground.settings import B2C_CLAIMS_CACHE_SIZE
+
+# (claims, when they stop being valid)
+_Entry = Tuple[dict, float]
+
+# A single audience or the ones any of which a token may be issued for
+Audience = Union[str, Sequence[str]]
+
+
+@dataclass(frozen=True)
+class ClaimsCacheStats:
+    hits: int
+    misses: int
+    expired: int
+    evicted: int
+    size: int
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class _Shard:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: "OrderedDict[bytes, _Entry]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+
+class VerifiedClaimsCache:
+    """
+    Claims of tokens that already went through `jwt.decode`, keyed by the digest of the token and of what it was
+    verified against (authority and audience). An entry is dropped once the token expires, and each shard is an LRU
+    bounded by `max_size / shards`, so threads only contend when their tokens land on the same shard.
+
+    Only valid tokens are kept: a token that fails verification is verified again the next time it shows up.
+    """
+
+    def __init__(self, max_size: int = B2C_CLAIMS_CACHE_SIZE, shards: int = B2C_CLAIMS_CACHE_SHARDS):
+        shard_size = max(1, max_size // shards)
+        self._shards: List[_Shard] = [_Shard(shard_size) for _ in range(shards)]
+
+    @staticmethod
+    def _key(token: str, authority: str, audience: Audience) -> bytes:
+        audiences = audience if isinstance(audience, str) else " ".join(audience)
+        return hashlib.sha256(f"{authority}\n{audiences}\n{token}".encode("utf-8")).digest()
+
+    def _shard_for(self, key: bytes) -> _Shard:
+        return self._shards[int.from_bytes(key[:4], "little") % len(self._shards)]
+
+    def get_or_verify(self, token: str, authority: str, audience: Audience, verify: Callable[[], dict]) -> dict:
+        key = self._key(token, authority, audience)
+        shard = self._shard_for(key)
+        now = time.time()
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if expires_at > now:
+                    shard.entries.move_to_end(key)
+                    shard.hits += 1
+                    # Callers are free to change what they get, such as storing it in the session
+                    return dict(claims)
+                del shard.entries[key]
+                shard.expired += 1
+            shard.misses += 1
+
+        claims = verify()
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)) or expires_at <= now:
+            return claims
+
+        with shard.lock:
+            shard.entries[key] = (dict(claims), expires_at)
+            shard.entries.move_to_end(key)
+            while len(shard.entries) > shard.max_size:
+                _, (_, oldest_expires_at) = shard.entries.popitem(last=False)
+                if oldest_expires_at > now:
+                    shard.evicted += 1
+                else:
+                    shard.expired += 1
+        return claims
+
+    def clear(self) -> None:
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+
+    def stats(self) -> ClaimsCacheStats:
+        hits = misses = expired = evicted = size = 0
+        for shard in self._shards:
+            with shard.lock:
+                hits += shard.hits
+                misses += shard.misses
+                expired += shard.expired
+                evicted += shard.evicted
+                size += len(shard.entries)
+        return ClaimsCacheStats(hits=hits, misses=misses, expired=expired, evicted=evicted, size=size)
+
+
+verified_claims_cache = VerifiedClaimsCache()
@@ -0,0 +1,134 @@
+import logging
+import threading
+
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+import msal
+
+from msal import ConfidentialClientApplication
+from msal import SerializableTokenCache
+
+from b2c_auth_playground.apps.core.services.discovery import DiscoveryCachingHttpClient
+from b2c_auth_playground.apps.core.services.discovery import discovery_cache
+from b2c_auth_playground.apps.core.services.metrics import timed_stage
+from b2c_auth_playground.apps.core.services.resilience import resilient_http_client
+
+logger = logging.getLogger(__name__)
+
+PoolKey = Tuple[str, str]
+
+# The token cache bound to the current request (thread or asyncio task)
+_current_token_cache: ContextVar[Optional[SerializableTokenCache]] = ContextVar("current_token_cache", default=None)
+
+
+class BoundTokenCache:
+    """
+    MSAL keeps a reference to `token_cache` (and some of its bound methods) when the application is built. As the
+    application is shared by many requests, we give it this proxy instead, which forwards everything to the cache
+    bound to the current context through `bind_token_cache`.
+    """
+
+    def _target(self) -> SerializableTokenCache:
+        cache = _current_token_cache.get()
+        if cache is None:
+            # Nothing was bound, so it behaves like MSAL does when you don't provide a cache: a throwaway one
+            cache = SerializableTokenCache()
+            _current_token_cache.set(cache)
+        return cache
+
+    # These two are captured as bound methods by MSAL when it builds its internal clients
+    def remove_rt(self, *args, **kwargs):
+        return self._target().remove_rt(*args, **kwargs)
+
+    def update_rt(self, *args, **kwargs):
+        return self._target().update_rt(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+def bind_token_cache(cache: Optional[SerializableTokenCache]) -> SerializableTokenCache:
+    cache = cache if cache is not None else SerializableTokenCache()
+    _current_token_cache.set(cache)
+    return cache
+
+
+@dataclass(frozen=True)
+class ClientAppPoolStats:
+    hits: int
+    misses: int
+    size: int
+
+
+class ClientAppPool:
+    """
+    Process-wide registry of long-lived `ConfidentialClientApplication` keyed by (authority, client id). Building one
+    implies authority discovery and HTTP client setup, so we do it once per key instead of once per call.
+    """
+
+    def __init__(self, factory: Callable[..., ConfidentialClientApplication] = None, http_client=None):
+        self._factory = factory if factory else msal.ConfidentialClientApplication
+        self._http_client = http_client
+        self._apps: Dict[PoolKey, ConfidentialClientApplication] = {}
+        self._lock = threading.Lock()
+        self._building_locks: Dict[PoolKey, threading.Lock] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, authority: str, client_id: str, client_credential: str) -> ConfidentialClientApplication:
+        key = (authority, client_id)
+        app = self._apps.get(key)
+        if app:
+            with self._lock:
+                self._hits += 1
+            return app
+
+        with self._lock:
+            building_lock = self._building_locks.setdefault(key, threading.Lock())
+        # A lock per key so a slow discovery for one authority does not hold the others
+        with building_lock:
+            app = self._apps.get(key)
+            if app:
+                with self._lock:
+                    self._hits += 1
+                return app
+            logger.debug("Building client app for authority %s and client id %s", authority, client_id)
+            with timed_stage("client_app_build"):
+                app = self._factory(
+                    client_id,
+                    authority=authority,
+                    client_credential=client_credential,
+                    token_cache=BoundTokenCache(),
+                    http_client=self._http_client,
+                )
+            with self._lock:
+                self._apps[key] = app
+                self._misses += 1
+            return app
+
+    def warm_up(self, entries: Iterable[Tuple[str, str, str]]) -> None:
+        for authority, client_id, client_credential in entries:
+            try:
+                self.get(authority, client_id, client_credential)
+            except Exception:
+                logger.exception("Could not warm up client app for authority %s", authority)
+
+    def stats(self) -> ClientAppPoolStats:
+        with self._lock:
+            return ClientAppPoolStats(hits=self._hits, misses=self._misses, size=len(self._apps))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._apps.clear()
+            self._building_locks.clear()
+
+
+# Discovery of the authority, done when an app is built, is answered by the cache shared with the other workers
+# Discovery documents come from the shared cache and token requests go through the resilience layer
+client_app_pool = ClientAppPool(http_client=DiscoveryCachingHttpClient(resilient_http_client, discovery_cache))
@@ -0,0 +1,207 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Set
+
+import requests
+
+from b2c_auth_playground.apps.core.services.http_transport import http_session
+from b2c_auth_playground.settings import B2C_DISCOVERY_CACHE_DIR
+from b2c_auth_playground.settings import B2C_DISCOVERY_CACHE_STALE_TTL
+from b2c_auth_playground.settings import B2C_DISCOVERY_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_SUFFIX = "/.well-known/openid-configuration"
+
+
+def discovery_address(authority: str) -> str:
+    # https://xptoorg.b2clogin.com/xptoorg.onmicrosoft.com/B2C_1_sign-in-sign-up/v2.0/.well-known/openid-configuration
+    return f"{authority}/v2.0{DISCOVERY_SUFFIX}"
+
+
+def is_discovery_address(url: str) -> bool:
+    return url.split("?", 1)[0].endswith(DISCOVERY_SUFFIX)
+
+
+def _fetch_document(address: str) -> dict:
+    response = http_session.get(address)
+    response.raise_for_status()
+    return response.json()
+
+
+@dataclass(frozen=True)
+class _Document:
+    body: dict
+    fetched_at: float
+
+
+class DiscoveryCache:
+    """
+    OpenID configuration documents kept in `directory`, one file per address, so every worker process of the node
+    shares what any of them fetched. A document is served as is for `ttl` seconds; for `stale_ttl` seconds more it is
+    still served while one background refresh replaces it. After that it is fetched before answering, unless B2C
+    cannot be reached, in which case the old document is better than nothing.
+
+    Workers take a file lock before fetching, so after a deploy one of them goes to B2C and the others read its file.
+    """
+
+    def __init__(
+        self,
+        directory: str = B2C_DISCOVERY_CACHE_DIR,
+        ttl: float = B2C_DISCOVERY_CACHE_TTL,
+        stale_ttl: float = B2C_DISCOVERY_CACHE_STALE_TTL,
+        fetcher: Callable[[str], dict] = _fetch_document,
+    ):
+        self._directory = Path(directory)
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._fetcher = fetcher
+        self._documents: Dict[str, _Document] = {}
+        self._revalidating: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def get(self, address: str) -> dict:
+        now = time.time()
+        document = self._documents.get(address)
+        if not document or now - document.fetched_at >= self._ttl:
+            # Another worker may have refreshed the file already
+            document = self._read(address) or document
+        if document:
+            age = now - document.fetched_at
+            if age < self._ttl:
+                return document.body
+            if age < self._ttl + self._stale_ttl:
+                self._revalidate_in_background(address)
+                return document.body
+        try:
+            return self._fetch(address, document).body
+        except Exception:
+            if not document:
+                raise
+            logger.warning("Could not refresh %s, serving a copy fetched %.0fs ago", address, now - document.fetched_at)
+            return document.body
+
+    def warm_up(self, addresses: Iterable[str]) -> None:
+        for address in addresses:
+            try:
+                self.get(address)
+            except Exception:
+                logger.exception("Could not warm up discovery document %s", address)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._documents.clear()
+
+    def _path(self, address: str) -> Path:
+        return self._directory / f"{hashlib.sha256(address.encode('utf-8')).hexdigest()}.json"
+
+    def _read(self, address: str) -> Optional[_Document]:
+        try:
+            with open(self._path(address), encoding="utf-8") as file:
+                stored = json.load(file)
+        except (OSError, ValueError):
+            return None
+        document = _Document(stored["body"], stored["fetched_at"])
+        self._documents[address] = document
+        return document
+
+    def _write(self, address: str, document: _Document) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        # Readers either see the previous file or the new one, never half of it
+        descriptor, temporary_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                json.dump({"address": address, "fetched_at": document.fetched_at, "body": document.body}, file)
+            os.replace(temporary_path, self._path(address))
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    @contextmanager
+    def _file_lock(self, address: str, blocking: bool):
+        self._directory.mkdir(parents=True, exist_ok=True)
+        with open(self._path(address).with_suffix(".lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _fetch(self, address: str, known: Optional[_Document], blocking: bool = True) -> _Document:
+        with self._file_lock(address, blocking) as acquired:
+            if not acquired:
+                return known
+            # Whoever held the lock before us may have done the work
+            current = self._read(address)
+            if current and time.time() - current.fetched_at < self._ttl:
+                return current
+            logger.debug("Fetching discovery document %s", address)
+            document = _Document(self._fetcher(address), time.time())
+            self._write(address, document)
+            self._documents[address] = document
+            return document
+
+    def _revalidate_in_background(self, address: str) -> None:
+        with self._lock:
+            if address in self._revalidating:
+                return
+            self._revalidating.add(address)
+
+        def revalidate():
+            try:
+                self._fetch(address, self._documents.get(address), blocking=False)
+            except Exception:
+                logger.exception("Could not revalidate discovery document %s", address)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(address)
+
+        threading.Thread(target=revalidate, name="discovery-revalidation", daemon=True).start()
+
+
+discovery_cache = DiscoveryCache()
+
+
+class DiscoveryCachingHttpClient:
+    """
+    The `http_client` we give MSAL: discovery documents are answered from `discovery_cache`, everything else goes to
+    the wrapped session.
+    """
+
+    def __init__(self, session: requests.Session, cache: DiscoveryCache):
+        self._session = session
+        self._cache = cache
+
+    def get(self, url, **kwargs):
+        if not is_discovery_address(url) or kwargs.get("params"):
+            return self._session.get(url, **kwargs)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(self._cache.get(url)).encode("utf-8")
+        return response
+
+    def post(self, url, **kwargs):
+        return self._session.post(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
@@ -0,0 +1,153 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+from typing import Dict
+from typing import Optional
+
+from cryptography.fernet import Fernet
+from cryptography.fernet import InvalidToken
+from django.http import HttpRequest
+from django.http import HttpResponse
+from django.urls import reverse
+
+from b2c_auth_playground.settings import B2C_FLOW_STATE_SEEN_SIZE
+from b2c_auth_playground.settings import B2C_FLOW_STATE_TTL
+from b2c_auth_playground.settings import SECRET_KEY
+
+logger = logging.getLogger(__name__)
+
+# Followed by the OAuth `state` of the flow, so flows started side by side (signing in from one tab, editing the
+# profile from another) do not overwrite each other
+FLOW_COOKIE_PREFIX = "b2c-auth-flow-"
+# MSAL makes states of letters; anything else is not one of ours and must not end up in a cookie name
+STATE_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,128}")
+
+
+class SeenStates:
+    """
+    OAuth `state` values already consumed, kept until the flow they belong to would have expired anyway. It is bounded
+    like an LRU, so a flood of callbacks cannot make it grow forever. It only covers the current process; the flow TTL
+    is what bounds a replay through another worker.
+    """
+
+    def __init__(self, max_size: int = B2C_FLOW_STATE_SEEN_SIZE):
+        self._max_size = max_size
+        self._states: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_if_new(self, state: str, expires_at: float) -> bool:
+        now = time.time()
+        with self._lock:
+            while self._states and next(iter(self._states.values())) <= now:
+                self._states.popitem(last=False)
+            if state in self._states:
+                return False
+            self._states[state] = expires_at
+            while len(self._states) > self._max_size:
+                self._states.popitem(last=False)
+            return True
+
+
+class FlowStateCodec:
+    """
+    Encrypts and signs (Fernet: AES-CBC + HMAC-SHA256) the compressed auth code flow, so it can travel with the user
+    instead of living in the session. The token carries its creation time, which is how `ttl` is enforced.
+    """
+
+    def __init__(self, secret: str, ttl: int):
+        key = hashlib.sha256(f"b2c-auth-flow-state:{secret}".encode("utf-8")).digest()
+        self._fernet = Fernet(base64.urlsafe_b64encode(key))
+        self._ttl = ttl
+
+    @property
+    def ttl(self) -> int:
+        return self._ttl
+
+    def encode(self, flow: Dict) -> str:
+        payload = zlib.compress(json.dumps(flow, separators=(",", ":")).encode("utf-8"))
+        return self._fernet.encrypt(payload).decode("ascii")
+
+    def decode(self, token: str) -> Optional[Dict]:
+        try:
+            payload = self._fernet.decrypt(token.encode("ascii"), ttl=self._ttl)
+        except (InvalidToken, UnicodeEncodeError):
+            return None
+        return json.loads(zlib.decompress(payload))
+
+
+flow_state_codec = FlowStateCodec(SECRET_KEY, B2C_FLOW_STATE_TTL)
+seen_states = SeenStates()
+
+
+def flow_cookie_name(state: Optional[str]) -> Optional[str]:
+    if not state or not STATE_PATTERN.fullmatch(state):
+        return None
+    return f"{FLOW_COOKIE_PREFIX}{state}"
+
+
+def attach_flow(request: HttpRequest, response: HttpResponse, flow: Dict) -> HttpResponse:
+    response.set_cookie(
+        flow_cookie_name(flow["state"]),
+        flow_state_codec.encode(flow),
+        max_age=flow_state_codec.ttl,
+        # Only the callback needs it
+        path=reverse("v1/response-oidc"),
+        secure=request.is_secure(),
+        httponly=True,
+        samesite="Lax",
+    )
+    return response
+
+
+def consume_flow(request: HttpRequest) -> Optional[Dict]:
+    """
+    The flow the callback in `request` belongs to, found by the `state` B2C sends back.
+    """
+    name = flow_cookie_name(request.GET.get("state"))
+    token = request.COOKIES.get(name) if name else None
+    if not token:
+        return None
+    flow = flow_state_codec.decode(token)
+    if not flow:
+        logger.warning("Flow state is either expired or was tampered with")
+        return None
+    if not seen_states.add_if_new(flow["state"], time.time() + flow_state_codec.ttl):
+        logger.warning("Flow state %s was already used", flow["state"])
+        return None
+    return flow
+
+
+def forget_flow(request: HttpRequest, response: HttpResponse) -> HttpResponse:
+    name = flow_cookie_name(request.GET.get("state"))
+    if name and name in request.COOKIES:
+        response.delete_cookie(name, path=reverse("v1/response-oidc"), samesite="Lax")
+    return response
+
+
+def forgetting_flow(view):
+    """
+    Decorates the callback view, sync or async, so its flow cookie is dropped whatever the answer is: a flow is used
+    once, be it to sign in or to fail.
+    """
+    if asyncio.iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            return forget_flow(request, await view(request, *args, **kwargs))
+
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return forget_flow(request, view(request, *args, **kwargs))
+
+    return wrapper
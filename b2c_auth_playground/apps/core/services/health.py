@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from django.db import connection
+
+from b2c_auth_playground.settings import B2C_HEALTH_CHECK_INTERVAL
+from b2c_auth_playground.settings import B2C_HEALTH_CHECK_TIMEOUT
+from b2c_auth_playground.settings import B2C_HTTP_CONNECT_TIMEOUT
+from b2c_auth_playground.settings import B2C_TOKEN_CACHE_BACKEND
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DependencyStatus:
+    name: str
+    healthy: bool
+    latency_ms: Optional[float] = None
+    last_success_at: Optional[float] = None
+    error: Optional[str] = None
+    critical: bool = True
+
+    def as_dict(self, now: float) -> dict:
+        last_success_age = round(now - self.last_success_at, 3) if self.last_success_at else None
+        return {
+            "healthy": self.healthy,
+            "critical": self.critical,
+            "latencyMs": self.latency_ms,
+            "lastSuccessAgeSeconds": last_success_age,
+            "error": self.error,
+        }
+
+
+@dataclass(frozen=True)
+class Probe:
+    name: str
+    check: Callable[[], None]
+    # A dependency the app cannot serve anything without; the others are reported but do not make the check fail
+    critical: bool = True
+
+
+class HealthProber:
+    """
+    Runs every probe from a background thread and keeps their last result in memory, so answering a health check
+    never waits on a dependency. A probe fails by raising. Critical probes go first in each round; until all of them
+    have answered once, the prober is `starting`.
+
+    The probes are built by the prober thread, as building them imports what they talk to.
+    """
+
+    def __init__(self, build_probes: Callable[[], List[Probe]], interval: float = B2C_HEALTH_CHECK_INTERVAL):
+        self._build_probes = build_probes
+        self._probes: Optional[List[Probe]] = None
+        self._interval = interval
+        self._statuses: Dict[str, DependencyStatus] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def ensure_started(self) -> None:
+        """
+        Starts the prober thread, which runs its first round right away. Never waits for a probe.
+        """
+        if self._thread:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._probe_forever, name="health-prober", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def snapshot(self) -> Dict[str, DependencyStatus]:
+        return dict(self._statuses)
+
+    @property
+    def starting(self) -> bool:
+        probes, statuses = self._probes, self._statuses
+        return probes is None or any(probe.name not in statuses for probe in probes if probe.critical)
+
+    def probe_all(self) -> None:
+        for probe in self._probes:
+            self._statuses[probe.name] = self._run(probe)
+
+    def _run(self, probe: Probe) -> DependencyStatus:
+        previous = self._statuses.get(probe.name)
+        last_success_at = previous.last_success_at if previous else None
+        started = time.monotonic()
+        try:
+            probe.check()
+        except Exception as e:
+            latency_ms = round((time.monotonic() - started) * 1000, 3)
+            logger.warning("Dependency %s is not healthy: %s", probe.name, e)
+            return DependencyStatus(probe.name, False, latency_ms, last_success_at, str(e), probe.critical)
+        finished = time.monotonic()
+        return DependencyStatus(probe.name, True, round((finished - started) * 1000, 3), finished, None, probe.critical)
+
+    def _probe_forever(self) -> None:
+        self._probes = sorted(self._build_probes(), key=lambda probe: not probe.critical)
+        self.probe_all()
+        while not self._stop.wait(self._interval):
+            self.probe_all()
+
+
+def _fetch(address: str) -> dict:
+    from b2c_auth_playground.apps.core.services.http_transport import http_session
+
+    response = http_session.get(address, timeout=(B2C_HTTP_CONNECT_TIMEOUT, B2C_HEALTH_CHECK_TIMEOUT))
+    response.raise_for_status()
+    return response.json()
+
+
+def _authority_probes(authority: str) -> List[Probe]:
+    from b2c_auth_playground.apps.core.services.discovery import discovery_address
+
+    user_flow = authority.rsplit("/", 1)[-1]
+    # Probes go to B2C, not to the discovery cache
+    address = discovery_address(authority)
+
+    def check_jwks():
+        _fetch(_fetch(address)["jwks_uri"])
+
+    # B2C being down must not take every pod out of rotation (or get them restarted); it is reported all the same
+    return [
+        Probe(f"b2c-discovery:{user_flow}", lambda: _fetch(address), critical=False),
+        Probe(f"b2c-jwks:{user_flow}", check_jwks, critical=False),
+    ]
+
+
+def _check_session_database() -> None:
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    finally:
+        # The prober thread keeps its own connection; drop it if it went bad
+        connection.close_if_unusable_or_obsolete()
+
+
+def _check_token_cache_store() -> None:
+    # The store module needs MSAL, which the health check should not load at boot
+    from b2c_auth_playground.apps.core.services.token_cache_store import token_cache_store
+
+    token_cache_store().ping()
+
+
+def build_default_probes() -> List[Probe]:
+    from b2c_auth_playground.apps.core.services.authority_registry import authority_registry
+
+    probes = []
+    for flow in authority_registry.flows:
+        probes.extend(_authority_probes(flow.authority))
+    probes.append(Probe("session-database", _check_session_database))
+    if B2C_TOKEN_CACHE_BACKEND == "partitioned":
+        probes.append(Probe("token-cache-store", _check_token_cache_store))
+    return probes
+
+
+health_prober = HealthProber(build_default_probes)
@@ -0,0 +1,188 @@
+import logging
+import socket
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool
+from urllib3 import HTTPSConnectionPool
+from urllib3.connection import HTTPConnection
+from urllib3.connection import HTTPSConnection
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.util import connection
+
+from b2c_auth_playground.apps.core.services.metrics import observe_upstream_request
+from b2c_auth_playground.apps.core.services.profiler import record_upstream_call
+from b2c_auth_playground.settings import B2C_HTTP_CONNECT_TIMEOUT
+from b2c_auth_playground.settings import B2C_HTTP_DNS_CACHE_TTL
+from b2c_auth_playground.settings import B2C_HTTP_POOL_CONNECTIONS
+from b2c_auth_playground.settings import B2C_HTTP_POOL_MAXSIZE
+from b2c_auth_playground.settings import B2C_HTTP_READ_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TransportStats:
+    requests_sent: int
+    connections_opened: int
+    dns_cache_hits: int
+    dns_cache_misses: int
+
+    @property
+    def connection_reuse_rate(self) -> float:
+        if not self.requests_sent:
+            return 0.0
+        return max(self.requests_sent - self.connections_opened, 0) / self.requests_sent
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+        self.connections_opened = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    def increment(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> TransportStats:
+        with self._lock:
+            return TransportStats(
+                requests_sent=self.requests_sent,
+                connections_opened=self.connections_opened,
+                dns_cache_hits=self.dns_cache_hits,
+                dns_cache_misses=self.dns_cache_misses,
+            )
+
+
+_counters = _Counters()
+
+
+class DnsCache:
+    """
+    `getaddrinfo` results kept for `ttl` seconds. The OS does not give us the record TTL, so it is a fixed one.
+    """
+
+    def __init__(self, ttl: int = B2C_HTTP_DNS_CACHE_TTL):
+        self._ttl = ttl
+        self._entries: Dict[Tuple[str, int], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> Optional[str]:
+        key = (host, port)
+        entry = self._entries.get(key)
+        if entry and entry[1] > time.monotonic():
+            _counters.increment("dns_cache_hits")
+            return entry[0]
+        _counters.increment("dns_cache_misses")
+        try:
+            address_info = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            return None
+        address = address_info[0][4][0]
+        with self._lock:
+            self._entries[key] = (address, time.monotonic() + self._ttl)
+        return address
+
+    def forget(self, host: str, port: int) -> None:
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+dns_cache = DnsCache()
+
+
+class _CachedDnsConnectionMixin:
+    def _new_conn(self):
+        _counters.increment("connections_opened")
+        address = dns_cache.resolve(self.host, self.port)
+        if not address:
+            return super()._new_conn()
+        try:
+            # SNI and certificate validation still use `self.host`, only the socket goes to the cached address
+            return connection.create_connection(
+                (address, self.port),
+                self.timeout,
+                source_address=self.source_address,
+                socket_options=self.socket_options,
+            )
+        except socket.timeout as e:
+            raise ConnectTimeoutError(self, f"Connection to {self.host} timed out") from e
+        except OSError:
+            # The cached address may be gone, let urllib3 resolve it again
+            dns_cache.forget(self.host, self.port)
+            return super()._new_conn()
+
+
+class _CachedDnsHTTPConnection(_CachedDnsConnectionMixin, HTTPConnection):
+    pass
+
+
+class _CachedDnsHTTPSConnection(_CachedDnsConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _CachedDnsHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CachedDnsHTTPConnection
+
+
+class _CachedDnsHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CachedDnsHTTPSConnection
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CachedDnsHTTPConnectionPool,
+            "https": _CachedDnsHTTPSConnectionPool,
+        }
+
+
+class PooledSession(requests.Session):
+    """
+    Keep-alive session used for every call to B2C, including the ones MSAL does through its `http_client` hook.
+    Requests does not support a session-wide timeout, so we apply (connect, read) deadlines unless the caller gives one.
+    """
+
+    def __init__(self, pool_connections: int, pool_maxsize: int, timeout: Tuple[float, float]):
+        super().__init__()
+        self.timeout = timeout
+        # Same minimal retry MSAL configures when it builds its own session
+        adapter = PooledHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=1)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        _counters.increment("requests_sent")
+        started, status = time.perf_counter(), None
+        try:
+            response = super().request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            observe_upstream_request(url, status, elapsed)
+            record_upstream_call(url, status, elapsed)
+
+
+http_session = PooledSession(
+    pool_connections=B2C_HTTP_POOL_CONNECTIONS,
+    pool_maxsize=B2C_HTTP_POOL_MAXSIZE,
+    timeout=(B2C_HTTP_CONNECT_TIMEOUT, B2C_HTTP_READ_TIMEOUT),
+)
+
+
+def transport_stats() -> TransportStats:
+    return _counters.snapshot()
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import jwt
+import requests
+
+from b2c_auth_playground.apps.core.services.authority_registry import UnknownUserFlowError
+from b2c_auth_playground.apps.core.services.authority_registry import UserFlow
+from b2c_auth_playground.apps.core.services.authority_registry import authority_registry
+from b2c_auth_playground.apps.core.services.jwks import verify_token
+from b2c_auth_playground.settings import B2C_INTROSPECTION_THREADS
+
+logger = logging.getLogger(__name__)
+
+# RSA verification happens in OpenSSL without the GIL, so a pool about the size of the CPU count keeps every core busy
+introspection_executor = ThreadPoolExecutor(max_workers=B2C_INTROSPECTION_THREADS, thread_name_prefix="introspection")
+
+
+def verify_registered_token(token: str) -> Tuple[UserFlow, dict]:
+    """
+    Verifies a token against the keys of the registered user flow that issued it, for one of the audiences of the flow.
+    Raises `UnknownUserFlowError` or one of the `jwt.InvalidTokenError` subclasses.
+    """
+    unverified_claims = jwt.decode(token, options={"verify_signature": False})
+    flow = authority_registry.flow_for_claims(unverified_claims)
+    return flow, verify_token(token, flow.authority, flow.audiences)
+
+
+def introspect_token(token: str) -> dict:
+    """
+    Whether the token was issued by one of our user flows and is still valid, with its claims and how many seconds it
+    has left when it is.
+    """
+    try:
+        flow, claims = verify_registered_token(token)
+    except (jwt.InvalidTokenError, UnknownUserFlowError) as e:
+        return {"valid": False, "error": str(e)}
+    except requests.RequestException as e:
+        logger.warning("Could not load the signing keys to introspect a token: %s", e)
+        return {"valid": False, "error": "Signing keys are not available"}
+    return {
+        "valid": True,
+        "userFlow": flow.name,
+        "expiresIn": max(int(claims["exp"] - time.time()), 0) if "exp" in claims else None,
+        "claims": claims,
+    }
+
+
+def introspect_tokens(tokens: List[str]) -> List[dict]:
+    """
+    `introspect_token` of each token, in the same order. Repeated tokens are verified once.
+    """
+    unique_tokens = list(dict.fromkeys(tokens))
+    if len(unique_tokens) == 1:
+        results = {unique_tokens[0]: introspect_token(unique_tokens[0])}
+    else:
+        results = dict(zip(unique_tokens, introspection_executor.map(introspect_token, unique_tokens)))
+    return [results[token] for token in tokens]
+
+
+async def introspect_tokens_async(tokens: List[str]) -> List[dict]:
+    unique_tokens = list(dict.fromkeys(tokens))
+    loop = asyncio.get_running_loop()
+    verified = await asyncio.gather(
+        *[loop.run_in_executor(introspection_executor, introspect_token, token) for token in unique_tokens]
+    )
+    results: Dict[str, dict] = dict(zip(unique_tokens, verified))
+    return [results[token] for token in tokens]
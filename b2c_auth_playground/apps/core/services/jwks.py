@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+import jwt
+
+from jwt import PyJWK
+
+from b2c_auth_playground.apps.core.services.claims_cache import Audience
+from b2c_auth_playground.apps.core.services.claims_cache import verified_claims_cache
+from b2c_auth_playground.apps.core.services.discovery import discovery_address
+from b2c_auth_playground.apps.core.services.discovery import discovery_cache
+from b2c_auth_playground.apps.core.services.discovery import is_discovery_address
+from b2c_auth_playground.apps.core.services.http_transport import http_session
+from b2c_auth_playground.settings import B2C_CLAIMS_CACHE_ENABLED
+from b2c_auth_playground.settings import B2C_JWKS_REFRESH_INTERVAL
+from b2c_auth_playground.settings import B2C_JWKS_UNKNOWN_KID_MIN_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Clock skew we accept between us and B2C when checking `exp`, `nbf` and `iat`
+LEEWAY_IN_SECONDS = 30
+ALLOWED_ALGORITHMS = ["RS256"]
+
+
+class UnknownSigningKeyError(jwt.InvalidTokenError):
+    pass
+
+
+def _fetch_json(url: str) -> dict:
+    if is_discovery_address(url):
+        return discovery_cache.get(url)
+    response = http_session.get(url)
+    response.raise_for_status()
+    return response.json()
+
+
+class JwksKeyStore:
+    """
+    Signing keys of one authority indexed by `kid`. Keys are fetched once and then kept fresh by `JwksRegistry`. When
+    a token comes with a `kid` we don't know (B2C rolled its keys), we refetch at most once per
+    `unknown_kid_min_interval` seconds, so garbage tokens cannot make us hammer the IdP.
+    """
+
+    def __init__(
+        self,
+        authority: str,
+        fetcher: Callable[[str], dict] = _fetch_json,
+        unknown_kid_min_interval: int = B2C_JWKS_UNKNOWN_KID_MIN_INTERVAL,
+    ):
+        self.authority = authority
+        self.issuer: Optional[str] = None
+        self._fetcher = fetcher
+        self._unknown_kid_min_interval = unknown_kid_min_interval
+        self._keys: Dict[str, PyJWK] = {}
+        self._lock = threading.Lock()
+        self._loading_lock = threading.Lock()
+        self._last_fetch_at = 0.0
+
+    @property
+    def discovery_address(self) -> str:
+        return discovery_address(self.authority)
+
+    @property
+    def last_fetch_at(self) -> float:
+        return self._last_fetch_at
+
+    def refresh(self) -> None:
+        configuration = self._fetcher(self.discovery_address)
+        key_set = self._fetcher(configuration["jwks_uri"])
+        keys = {}
+        for key in key_set.get("keys", []):
+            try:
+                keys[key["kid"]] = PyJWK(key)
+            except (KeyError, jwt.PyJWKError):
+                logger.warning("Ignoring unusable key from %s: %s", self.authority, key.get("kid"))
+        with self._lock:
+            self.issuer = configuration["issuer"]
+            self._keys = keys
+            self._last_fetch_at = time.monotonic()
+        logger.debug("Loaded %s signing keys for %s", len(keys), self.authority)
+
+    def get_signing_key(self, kid: str) -> PyJWK:
+        key = self._keys.get(kid)
+        if key:
+            return key
+
+        # Only one thread refetches; the others wait for it and then look again
+        with self._loading_lock:
+            key = self._keys.get(kid)
+            elapsed = time.monotonic() - self._last_fetch_at
+            if not key and (not self._last_fetch_at or elapsed >= self._unknown_kid_min_interval):
+                logger.info("Unknown kid %s for %s, refetching signing keys", kid, self.authority)
+                self.refresh()
+                key = self._keys.get(kid)
+        if not key:
+            raise UnknownSigningKeyError(f"No signing key with kid {kid} for {self.authority}")
+        return key
+
+    def ensure_loaded(self) -> None:
+        if self._last_fetch_at:
+            return
+        with self._loading_lock:
+            if not self._last_fetch_at:
+                self.refresh()
+
+
+class JwksRegistry:
+    """
+    One `JwksKeyStore` per authority plus a daemon thread refreshing all of them in the background.
+    """
+
+    def __init__(self, refresh_interval: int = B2C_JWKS_REFRESH_INTERVAL, store_factory=JwksKeyStore):
+        self._refresh_interval = refresh_interval
+        self._store_factory = store_factory
+        self._stores: Dict[str, JwksKeyStore] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+    def store_for(self, authority: str) -> JwksKeyStore:
+        store = self._stores.get(authority)
+        if store:
+            return store
+        with self._lock:
+            store = self._stores.get(authority)
+            if not store:
+                store = self._store_factory(authority)
+                self._stores[authority] = store
+            self._start_refresher()
+        return store
+
+    def refresh_all(self) -> None:
+        for authority, store in list(self._stores.items()):
+            try:
+                store.refresh()
+            except Exception:
+                # We keep the keys we already have, they are probably still valid
+                logger.exception("Could not refresh signing keys of %s", authority)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _start_refresher(self) -> None:
+        if self._refresher and self._refresher.is_alive():
+            return
+        self._refresher = threading.Thread(target=self._refresh_forever, name="jwks-refresher", daemon=True)
+        self._refresher.start()
+
+    def _refresh_forever(self) -> None:
+        while not self._stop.wait(self._refresh_interval):
+            self.refresh_all()
+
+
+jwks_registry = JwksRegistry()
+
+
+def verify_token(token: str, authority: str, audience: Audience) -> dict:
+    """
+    Verifies signature, issuer, audience (or one of several) and lifetime of a token issued by the given authority.
+    Raises one of the `jwt.InvalidTokenError` subclasses when the token is not valid. Tokens seen before are answered
+    from `verified_claims_cache` until they expire.
+    """
+    if B2C_CLAIMS_CACHE_ENABLED:
+        return verified_claims_cache.get_or_verify(
+            token, authority, audience, lambda: _decode_and_verify(token, authority, audience)
+        )
+    return _decode_and_verify(token, authority, audience)
+
+
+def _decode_and_verify(token: str, authority: str, audience: Audience) -> dict:
+    store = jwks_registry.store_for(authority)
+    store.ensure_loaded()
+    kid = jwt.get_unverified_header(token).get("kid")
+    signing_key = store.get_signing_key(kid)
+    return jwt.decode(
+        token,
+        signing_key.key,
+        algorithms=ALLOWED_ALGORITHMS,
+        audience=audience,
+        issuer=store.issuer,
+        leeway=LEEWAY_IN_SECONDS,
+    )
@@ -0,0 +1,206 @@
+import asyncio
+import functools
+import glob
+import os
+import re
+import time
+
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import generate_latest
+from prometheus_client import multiprocess
+
+from b2c_auth_playground.settings import B2C_METRICS_DIR
+from b2c_auth_playground.settings import B2C_METRICS_ENABLED
+
+# Upper bounds in seconds; from a cache hit to a B2C call that took the whole read timeout
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+B2C_ERROR_CODE = re.compile(r"AADB2C\d+")
+
+if B2C_METRICS_DIR:
+    # Each process writes its own files, `render_metrics` adds them up
+    os.makedirs(B2C_METRICS_DIR, exist_ok=True)
+
+stage_seconds = Histogram(
+    "b2c_auth_stage_seconds",
+    "Time spent in each stage of the authentication pipeline",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+upstream_request_seconds = Histogram(
+    "b2c_upstream_request_seconds",
+    "Time of HTTP calls to B2C, by endpoint",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+upstream_responses = Counter(
+    "b2c_upstream_responses",
+    "HTTP responses received from B2C, by endpoint and status",
+    ["endpoint", "status"],
+)
+upstream_errors = Counter(
+    "b2c_upstream_errors",
+    "OAuth errors returned by B2C, with the AADB2C code of the description when there is one",
+    ["operation", "error", "code"],
+)
+upstream_decisions = Counter(
+    "b2c_upstream_decisions",
+    "What the resilience layer did with calls to the token endpoint (retry, hedge, circuit transitions...), by authority",
+    ["authority", "decision"],
+)
+admission_rejections = Counter(
+    "b2c_admission_rejections",
+    "Logins turned away before reaching B2C, by reason",
+    ["reason"],
+)
+refresh_ahead = Counter(
+    "b2c_refresh_ahead",
+    "Access tokens about to expire, by what became of them: refreshed_ahead, refreshed_inline (by the user request), "
+    "failed or skipped (too many pending, or nothing left to refresh)",
+    ["outcome"],
+)
+refresh_ahead_pending = Gauge(
+    "b2c_refresh_ahead_pending",
+    "Refreshes ahead scheduled or running",
+    multiprocess_mode="livesum",
+)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    if not B2C_METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.labels(stage).observe(time.perf_counter() - started)
+
+
+def timed(stage: str):
+    """
+    Same as `timed_stage`, as a decorator of functions or coroutine functions.
+    """
+
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with timed_stage(stage):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed_stage(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def upstream_endpoint(url: str) -> str:
+    path = url.split("?", 1)[0]
+    if path.endswith("/.well-known/openid-configuration"):
+        return "discovery"
+    if path.endswith("/keys"):
+        return "jwks"
+    if path.endswith("/oauth2/v2.0/token"):
+        return "token"
+    return "other"
+
+
+def observe_upstream_request(url: str, status: Optional[int], seconds: float) -> None:
+    if not B2C_METRICS_ENABLED:
+        return
+    endpoint = upstream_endpoint(url)
+    upstream_request_seconds.labels(endpoint).observe(seconds)
+    upstream_responses.labels(endpoint, str(status) if status else "failed").inc()
+
+
+def record_upstream_error(operation: str, result) -> None:
+    """
+    Counts the error of a token endpoint answer, such as `{"error": "invalid_grant", "error_description":
+    "AADB2C90088: The provided grant has not been issued for this endpoint..."}`. Answers without errors are ignored.
+    """
+    if not B2C_METRICS_ENABLED or not isinstance(result, dict) or not result.get("error"):
+        return
+    code = B2C_ERROR_CODE.search(result.get("error_description") or "")
+    upstream_errors.labels(operation, result["error"], code.group(0) if code else "").inc()
+
+
+def record_upstream_decision(authority: str, decision: str) -> None:
+    if B2C_METRICS_ENABLED:
+        upstream_decisions.labels(authority, decision).inc()
+
+
+def record_refresh_ahead(outcome: str) -> None:
+    if B2C_METRICS_ENABLED:
+        refresh_ahead.labels(outcome).inc()
+
+
+def record_refresh_ahead_pending(change: int) -> None:
+    if B2C_METRICS_ENABLED:
+        refresh_ahead_pending.inc(change)
+
+
+def record_admission_rejection(reason: str) -> None:
+    if B2C_METRICS_ENABLED:
+        admission_rejections.labels(reason).inc()
+
+
+def prune_dead_processes() -> None:
+    """
+    Drops the files of the metrics directory written by processes that are gone, such as the workers of a previous
+    run, which would otherwise be added to the metrics of this one. Servers that fork their workers (gunicorn) empty
+    the directory when they start instead.
+    """
+    if not B2C_METRICS_DIR:
+        return
+    for path in glob.glob(os.path.join(B2C_METRICS_DIR, "*.db")):
+        # Files are named after the process that writes them: counter_1234.db, gauge_livesum_1234.db...
+        try:
+            pid = int(os.path.basename(path)[: -len(".db")].rsplit("_", 1)[-1])
+        except ValueError:
+            continue
+        if not _is_running(pid):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, as someone else
+        pass
+    return True
+
+
+def render_metrics():
+    """
+    Metrics in the Prometheus text format and their content type. With a metrics directory they cover every worker
+    process that wrote to it, otherwise only the current one.
+    """
+    if B2C_METRICS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=B2C_METRICS_DIR)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
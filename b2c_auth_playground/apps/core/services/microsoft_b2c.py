@@ -1,4 +1,6 @@
+import json
 import logging
+import time
 
 from dataclasses import dataclass
 from typing import Dict
@@ -6,24 +8,45 @@ from typing import List
 from typing import Optional
 from typing import Union
 
-import jwt
-import msal
-import requests
-
 from django.http import QueryDict
 from msal import ConfidentialClientApplication
 from msal import SerializableTokenCache
+from msal import TokenCache
+from msal.oauth2cli.oidc import decode_part
 
+from b2c_auth_playground.apps.core.services.authority_registry import authority_registry
+from b2c_auth_playground.apps.core.services.client_app_pool import bind_token_cache
+from b2c_auth_playground.apps.core.services.client_app_pool import client_app_pool
+from b2c_auth_playground.apps.core.services.jwks import verify_token
+from b2c_auth_playground.apps.core.services.metrics import record_upstream_error
+from b2c_auth_playground.apps.core.services.metrics import timed_stage
+from b2c_auth_playground.apps.core.services.refresh_ahead import refresh_ahead_scheduler
+from b2c_auth_playground.apps.core.services.resilience import resilient_http_client
+from b2c_auth_playground.apps.core.services.single_flight import token_refresh_coalescer
+from b2c_auth_playground.apps.core.services.token_cache_store import PartitionedTokenCache
+from b2c_auth_playground.apps.core.services.token_cache_store import owner_key
+from b2c_auth_playground.apps.core.services.token_cache_store import token_cache_store
 from b2c_auth_playground.settings import B2C_AUTHORITY_RESOURCE_OWNER
 from b2c_auth_playground.settings import B2C_AUTHORITY_SIGN_UP_SIGN_IN
-from b2c_auth_playground.settings import B2C_YOUR_APP_CLIENT_APPLICATION_ID
-from b2c_auth_playground.settings import B2C_YOUR_APP_CLIENT_CREDENTIAL
+from b2c_auth_playground.settings import B2C_REFRESH_AHEAD_ENABLED
+from b2c_auth_playground.settings import B2C_TOKEN_REFRESH_COALESCING
 from b2c_auth_playground.settings import B2C_YOUR_APP_RESOURCE_CLIENT_CREDENTIAL
 from b2c_auth_playground.settings import B2C_YOUR_APP_RESOURCE_OWNER_APPLICATION_ID
 
 logger = logging.getLogger(__name__)
 
 
+class TokenRequestError(Exception):
+    """
+    B2C answered the token request with an error that retrying would not fix, such as wrong credentials.
+    """
+
+    def __init__(self, status_code: int, body: dict):
+        super().__init__(f"{body.get('error')}: {body.get('error_description')}")
+        self.status_code = status_code
+        self.body = body
+
+
 @dataclass(frozen=True)
 class AuthFlowDetails:
     state: str
@@ -57,14 +80,20 @@ class AcquireTokenDetails:
 def retrieve_client_app(
     cache: SerializableTokenCache = None, authority: str = None, app_id=None, app_secret=None
 ) -> ConfidentialClientApplication:
-    app_id = app_id if app_id else B2C_YOUR_APP_CLIENT_APPLICATION_ID
-    app_secret = app_secret if app_secret else B2C_YOUR_APP_CLIENT_CREDENTIAL
-
-    return msal.ConfidentialClientApplication(
-        B2C_YOUR_APP_CLIENT_APPLICATION_ID,
-        authority=authority,
-        client_credential=B2C_YOUR_APP_CLIENT_CREDENTIAL,
-        token_cache=cache,
+    if not app_id or not app_secret:
+        flow = authority_registry.flow_for_authority(authority)
+        app_id = app_id if app_id else flow.client_id
+        app_secret = app_secret if app_secret else flow.client_credential
+
+    # The app is shared by the whole process; only the token cache is specific to the current request
+    bind_token_cache(cache)
+    return client_app_pool.get(authority, app_id, app_secret)
+
+
+def warm_up_client_apps() -> None:
+    # One client app per registered user flow
+    client_app_pool.warm_up(
+        (flow.authority, flow.client_id, flow.client_credential) for flow in authority_registry.flows
     )
 
 
@@ -94,7 +123,9 @@ def obtain_access_token(scopes=None, cache=None, authority=None) -> dict:
         #     "local_account_id": "21548d8f-47b3-4585-83ad-9aa4cd487ae1",
         #     "realm": "xptoorg.onmicrosoft.com",
         # }
-        result = msal_app.acquire_token_silent(scopes, account=first_account)
+        with timed_stage("acquire_token_silent"):
+            result = _acquire_token_silent(msal_app, scopes, first_account, cache)
+        record_upstream_error("acquire_token_silent", result)
         # Sample content of result:
         # {
         #     "id_token": "eyJ0eXAiOiJKV1QiLCJhbGciOiJSUzI1NiIsImtpZCI6Ilg1ZVhrNHh5b2pORnVtMWtsMll0djhkbE5QNC1jNTdkTzZRR1RWQndhTmsifQ.eyJleHAiOjE2MzI0MjE3MjIsIm5iZiI6MTYzMjQxODEyMiwidmVyIjoiMS4wIiwiaXNzIjoiaHR0cHM6Ly94cHRvb3JnLmIyY2xvZ2luLmNvbS8wM2YxNmZiNS0xMmQ4LTRhMGItYTY1ZS1kMzI1ZWEyNWVkMmEvdjIuMC8iLCJzdWIiOiIyMTU0OGQ4Zi00N2IzLTQ1ODUtODNhZC05YWE0Y2Q0ODdhZTEiLCJhdWQiOiJjMDVkOWM3OC1iYWFiLTRlZTMtOGVhNy1iMWE0YjgwNzQzMDkiLCJub25jZSI6IjFlNDFhYjdmZjk1NTgxNmY4OTRjYzA4YTZmMDFmZjkwNDZmZTEyNDQ5ZDU4NWNmOTQ3NzZkOTk2OTdiMjQ1NjUiLCJpYXQiOjE2MzI0MTgxMjIsImF1dGhfdGltZSI6MTYzMjQxNzkwOSwib2lkIjoiMjE1NDhkOGYtNDdiMy00NTg1LTgzYWQtOWFhNGNkNDg3YWUxIiwiZ2l2ZW5fbmFtZSI6IkdyZWdvcmlvIiwiZmFtaWx5X25hbWUiOiJBbG1laWRhIiwibmFtZSI6Ik5vdCB1bmtub3duIGFueW1vcmUiLCJjaXR5IjoiU8OjbyBQYXVsbyIsImNvdW50cnkiOiJCcmF6aWwiLCJ0ZnAiOiJCMkNfMV9zaWduLWluLXNpZ24tdXAifQ.JuUrkppw4Y2VMn7S3awqk-ayTf25g95YB6nCrGwCoxVGuJM_e82MWB0QreQ6n50-oHmFxggLO1ARC0JL1XII9dbnnMnym70BqPpzQJ0ZGWIyzZroZmZyWtDHE222zJsnt833xKF8xFz48AJnEIChsZvilmuMUVR4GXS61mu7z3_GD4_jxGnLeMFngxkCFMbl7w3QD_RHQQSyX4RrRlZy-CEiKLPzCi42PF5AprpefiZoK_nHZ0ry_yVa6hEGoGP_dxOA5lC3Ef--tAxkeMQKazqRlEetWgJ4JsnA96ebvmvjuo8LIh2dOGY37iXyQ3rGhZdlUAxiyKxnwmrZix39jA",
@@ -123,15 +154,108 @@ def obtain_access_token(scopes=None, cache=None, authority=None) -> dict:
         #         "tfp": "B2C_1_sign-in-sign-up",
         #     },
         # }
+        _refresh_ahead_if_due(result, first_account, scopes, cache, authority)
         return result
 
 
+def _acquire_token_silent(msal_app, scopes, account, cache, force_refresh=False):
+    def acquire():
+        return msal_app.acquire_token_silent(scopes, account=account, force_refresh=force_refresh)
+
+    if not B2C_TOKEN_REFRESH_COALESCING:
+        return acquire()
+    if not force_refresh:
+        if scopes and _has_fresh_access_token(msal_app, scopes, account):
+            # Answered from the cache, nothing to coalesce
+            return acquire()
+        if not scopes:
+            cached = _cached_id_token_result(msal_app, account)
+            if cached:
+                return cached
+    if not isinstance(cache, PartitionedTokenCache):
+        # A cache kept in the session belongs to its request: a follower would get the leader's tokens, but its own
+        # cache would keep the refresh token the leader just rotated. Only caches in the shared store are coalesced
+        return acquire()
+    # Only one refresh per token cache in flight; if another worker did it, we reload what it stored and use it.
+    # Threads only share the result of the very same call, though
+    key = owner_key(account["home_account_id"], cache.session_partition)
+    flight_key = f"{key} {' '.join(sorted(scopes or []))} {'forced' if force_refresh else 'silent'}"
+    return token_refresh_coalescer.run(key, acquire, cache.reload, flight_key)
+
+
+def _has_fresh_access_token(msal_app, scopes, account) -> bool:
+    now = time.time()
+    access_tokens = msal_app.token_cache.search(
+        TokenCache.CredentialType.ACCESS_TOKEN, target=scopes, query={"home_account_id": account["home_account_id"]}
+    )
+    # MSAL considers a token expiring in less than 5 minutes as expired
+    return any(int(entry["expires_on"]) - now > 5 * 60 for entry in access_tokens)
+
+
+def _cached_id_token_result(msal_app, account) -> Optional[dict]:
+    """
+    Without scopes B2C issues no access token, so MSAL would redeem the refresh token on every call to get a new id
+    token. While the cached id token is valid (by MSAL's 5 minutes margin), it is the answer instead.
+    """
+    now = time.time()
+    id_tokens = msal_app.token_cache.search(
+        TokenCache.CredentialType.ID_TOKEN, query={"home_account_id": account["home_account_id"]}
+    )
+    for entry in id_tokens:
+        claims = json.loads(decode_part(entry["secret"].split(".")[1]))
+        if int(claims.get("exp", 0)) - now > 5 * 60:
+            return {
+                "id_token": entry["secret"],
+                "id_token_claims": claims,
+                "token_type": "Bearer",
+                "token_source": "cache",
+            }
+    return None
+
+
+def _refresh_ahead_if_due(result, account, scopes, cache, authority) -> None:
+    if not B2C_REFRESH_AHEAD_ENABLED or not isinstance(result, dict):
+        return
+    if result.get("token_source") == "identity_provider":
+        # The user request paid for the round trip to B2C
+        refresh_ahead_scheduler.record_inline_refresh()
+        return
+    # Only a cache kept in the store can be updated without the user's request (and session) around
+    if not isinstance(cache, PartitionedTokenCache) or not refresh_ahead_scheduler.is_due(result):
+        return
+
+    home_account_id = account["home_account_id"]
+    session_partition = cache.session_partition
+    scopes = tuple(scopes or [])
+
+    def refresh() -> str:
+        background_cache = PartitionedTokenCache(token_cache_store(), home_account_id, session_partition)
+        msal_app = retrieve_client_app(cache=background_cache, authority=authority)
+        accounts = [item for item in msal_app.get_accounts() if item["home_account_id"] == home_account_id]
+        if not accounts:
+            # Signed out (or the partition expired) since the token was served
+            return "skipped"
+        refreshed = _acquire_token_silent(msal_app, list(scopes), accounts[0], background_cache, force_refresh=True)
+        if background_cache.has_state_changed:
+            background_cache.flush()
+        if not refreshed or "error" in refreshed:
+            error = refreshed or {}
+            logger.warning("Refresh ahead got %s: %s", error.get("error"), error.get("error_description"))
+            return "failed"
+        return "refreshed_ahead"
+
+    refresh_ahead_scheduler.schedule((home_account_id, session_partition, authority, scopes), refresh)
+
+
 def verify_flow(auth_flow_details: Dict, query_params: QueryDict, cache=None) -> AcquireTokenDetails:
-    authority = auth_flow_details["auth_uri"].split("/oauth2")[0]
+    flow = authority_registry.flow_for_auth_uri(auth_flow_details["auth_uri"])
+    authority = flow.authority
     msal_app = retrieve_client_app(cache=cache, authority=authority)
     # This method may raise an exception like `"state missing from auth_code_flow" in ex.args` or `state mismatch: oprdHyGTJtIEhbLM vs FwGbuTpMeHsfXztv`
     # Thus it's interesting to wrap it with try/except for production ready apps
-    result = msal_app.acquire_token_by_auth_code_flow(auth_flow_details, query_params)
+    with timed_stage("token_exchange"):
+        result = msal_app.acquire_token_by_auth_code_flow(auth_flow_details, query_params)
+    record_upstream_error("token_exchange", result)
     # {'error': 'access_denied', 'error_description': 'The user has denied access to the scope requested by the client application.'}
     # {'error': 'redirect_uri_mismatch', 'error_description': "AADB2C90006: The redirect URI '' provided in the request is not registered for the client id 'c05d9c78-baab-4ee3-8ea7-b1a4b8074309'.\r\nCorrelation ID: 2969296c-1fb2-47c1-85d0-288d88a94323\r\nTimestamp: 2021-09-19 17:11:23Z\r\n"}
     # {'error': 'invalid_client', 'error_description': 'AADB2C90081: The specified client_secret does not match the expected value for this client. Please correct the client_secret and try again.\r\nCorrelation ID: 24abcb7d-837d-4e06-b060-170904eac5c2\r\nTimestamp: 2021-09-19 20:06:38Z\r\n'}
@@ -163,9 +287,15 @@ def verify_flow(auth_flow_details: Dict, query_params: QueryDict, cache=None) ->
     #         "tfp": "B2C_1_sign-in-sign-up",
     #     },
     # }
+    if "id_token" in result:
+        # MSAL does not check the signature of the id_token, so we do it with our cached signing keys
+        with timed_stage("id_token_verify"):
+            result["id_token_claims"] = verify_token(result["id_token"], authority, flow.client_id)
     acquire_token_details = AcquireTokenDetails(**result)
-    logger.info("What is contained in id_token_claims: %s", acquire_token_details.id_token_claims)
-    logger.info("You can change what is returned in `id_token_claims` if you go to USER FLOW / APPLICATION CLAIMS")
+    # Claims are personal data and rendering them is not free, so they are only logged when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("What is contained in id_token_claims: %s", acquire_token_details.id_token_claims)
+        logger.debug("You can change what is returned in `id_token_claims` if you go to USER FLOW / APPLICATION CLAIMS")
     return acquire_token_details
 
 
@@ -181,9 +311,7 @@ def authenticate(username, password, scopes=None, cache=None):
     raise NotImplementedError
 
 
-def authenticate_on_hair(username, password, scopes=None, cache=None):
-    logger.info("Doing resource owner password credentials flow... But using RAW process (without a library)")
-
+def build_ropc_request(username, password, scopes=None):
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
     params = {
         "client_id": B2C_YOUR_APP_RESOURCE_OWNER_APPLICATION_ID,
@@ -193,8 +321,27 @@ def authenticate_on_hair(username, password, scopes=None, cache=None):
         "scope": " ".join(scopes),
         "response_type": "token id_token",
     }
-    result = requests.post(f"{B2C_AUTHORITY_RESOURCE_OWNER}/oauth2/v2.0/token", data=params, headers=headers)
-    assert result.status_code == 200
+    return f"{B2C_AUTHORITY_RESOURCE_OWNER}/oauth2/v2.0/token", params, headers
+
+
+def error_body(response) -> dict:
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    return body if isinstance(body, dict) and body.get("error") else {"error": f"http_{response.status_code}"}
+
+
+def authenticate_on_hair(username, password, scopes=None, cache=None):
+    logger.info("Doing resource owner password credentials flow... But using RAW process (without a library)")
+
+    address, params, headers = build_ropc_request(username, password, scopes)
+    with timed_stage("ropc_request"):
+        result = resilient_http_client.post(address, data=params, headers=headers)
+    if result.status_code != 200:
+        body = error_body(result)
+        record_upstream_error("ropc", body)
+        raise TokenRequestError(result.status_code, body)
     body = result.json()
 
     # Sample of what is returned
@@ -205,7 +352,10 @@ def authenticate_on_hair(username, password, scopes=None, cache=None):
     #     "id_token": "eyJ0eXAiOiJKV1QiLCJhbGciOiJSUzI1NiIsImtpZCI6Ilg1ZVhrNHh5b2pORnVtMWtsMll0djhkbE5QNC1jNTdkTzZRR1RWQndhTmsifQ.eyJleHAiOjE2MzI1MTA1NjAsIm5iZiI6MTYzMjUwNjk2MCwidmVyIjoiMS4wIiwiaXNzIjoiaHR0cHM6Ly94cHRvb3JnLmIyY2xvZ2luLmNvbS8wM2YxNmZiNS0xMmQ4LTRhMGItYTY1ZS1kMzI1ZWEyNWVkMmEvdjIuMC8iLCJzdWIiOiIyMTU0OGQ4Zi00N2IzLTQ1ODUtODNhZC05YWE0Y2Q0ODdhZTEiLCJhdWQiOiJkNGJlNzM0Zi04NzQ2LTQ3MzgtOGY4NC03MjZiYzQ2YWJhZTAiLCJpYXQiOjE2MzI1MDY5NjAsImF1dGhfdGltZSI6MTYzMjUwNjk2MCwiaWRwIjoiTG9jYWxBY2NvdW50IiwiZ2l2ZW5fbmFtZSI6IkdyZWdvcmlvIiwiZmFtaWx5X25hbWUiOiJBbG1laWRhIiwidGZwIjoiQjJDXzFfcmVzb3VyY2Utb3duZXIiLCJhdF9oYXNoIjoibnFvUk5QbDZyLTVhOTcweGNac2VYQSJ9.GcCckxT38O68We7_V0JkADD5cVjRLsHb0ZmuLKjUhAgTsB9h4vnhiRdlcWOlFyVZq9Ulw8_nRqAfVVtJMC7RYL-JMWzRIDfr7ohEBJE9d2L8Pqt7sHZwaOYJnYOcIHba-xBZyDSLS05DCl3PmYiytVEfF79Ia42rTo0YaTxVMpnlExRCujKiTCh67uJ2g6EtJ03_Ci1fwgE85xG7WOOsaz_r3bxz9dJo-ltM4SWlB7UP9eqdrCZ8g_asQSRqmt00KkT88-VYqvDGAtPycVhghkgfCcFVUrjDgG9zZKgWgQx4V0-2Nn8dsaKZmw_LcEipLXEcC3GpRSMmjWYSr3Q_0A",
     # }
 
-    claims = jwt.decode(body["id_token"], options={"verify_signature": False})
+    with timed_stage("id_token_verify"):
+        claims = verify_token(
+            body["id_token"], B2C_AUTHORITY_RESOURCE_OWNER, B2C_YOUR_APP_RESOURCE_OWNER_APPLICATION_ID
+        )
     # Sample value of claims
     # {
     #     "exp": 1632515480,
@@ -230,7 +380,8 @@ def build_auth_code_flow(authority: str = None, scopes: List[str] = None, redire
     msal_app = retrieve_client_app(authority=authority)
 
     scopes = scopes if scopes else []
-    value = msal_app.initiate_auth_code_flow(scopes, redirect_uri)
+    with timed_stage("auth_code_flow_build"):
+        value = msal_app.initiate_auth_code_flow(scopes, redirect_uri)
     # Sample `value` with authority "b2c_1_sign-in-sign-u":
     # {
     #     "state": "XHIlwMSuDtjVNTFk",
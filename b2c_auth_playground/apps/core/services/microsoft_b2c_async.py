@@ -0,0 +1,101 @@
+import functools
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import List
+
+import httpx
+
+from asgiref.sync import sync_to_async
+from django.http import QueryDict
+
+from b2c_auth_playground.apps.core.services.jwks import verify_token
+from b2c_auth_playground.apps.core.services.metrics import observe_upstream_request
+from b2c_auth_playground.apps.core.services.metrics import record_upstream_error
+from b2c_auth_playground.apps.core.services.metrics import timed_stage
+from b2c_auth_playground.apps.core.services.microsoft_b2c import AcquireTokenDetails
+from b2c_auth_playground.apps.core.services.microsoft_b2c import AuthFlowDetails
+from b2c_auth_playground.apps.core.services.microsoft_b2c import TokenRequestError
+from b2c_auth_playground.apps.core.services.microsoft_b2c import build_auth_code_flow
+from b2c_auth_playground.apps.core.services.microsoft_b2c import build_ropc_request
+from b2c_auth_playground.apps.core.services.microsoft_b2c import error_body
+from b2c_auth_playground.apps.core.services.microsoft_b2c import obtain_access_token
+from b2c_auth_playground.apps.core.services.microsoft_b2c import verify_flow
+from b2c_auth_playground.apps.core.services.profiler import follow_thread
+from b2c_auth_playground.apps.core.services.profiler import record_upstream_call
+from b2c_auth_playground.apps.core.services.resilience import is_idempotent
+from b2c_auth_playground.apps.core.services.resilience import upstream_guard
+from b2c_auth_playground.settings import B2C_ASYNC_MSAL_THREADS
+from b2c_auth_playground.settings import B2C_AUTHORITY_RESOURCE_OWNER
+from b2c_auth_playground.settings import B2C_HTTP_CONNECT_TIMEOUT
+from b2c_auth_playground.settings import B2C_HTTP_POOL_MAXSIZE
+from b2c_auth_playground.settings import B2C_HTTP_READ_TIMEOUT
+from b2c_auth_playground.settings import B2C_YOUR_APP_RESOURCE_OWNER_APPLICATION_ID
+
+logger = logging.getLogger(__name__)
+
+async_http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=B2C_HTTP_POOL_MAXSIZE, max_keepalive_connections=B2C_HTTP_POOL_MAXSIZE),
+    timeout=httpx.Timeout(B2C_HTTP_READ_TIMEOUT, connect=B2C_HTTP_CONNECT_TIMEOUT),
+)
+
+# MSAL only has a synchronous API, so whatever goes through it runs here instead of blocking the event loop
+msal_executor = ThreadPoolExecutor(max_workers=B2C_ASYNC_MSAL_THREADS, thread_name_prefix="msal")
+
+
+def _in_msal_executor(function):
+    @functools.wraps(function)
+    def followed(*args, **kwargs):
+        # The executor thread is sampled when the request is being profiled
+        with follow_thread():
+            return function(*args, **kwargs)
+
+    return sync_to_async(followed, thread_sensitive=False, executor=msal_executor)
+
+
+async def build_auth_code_flow_async(
+    authority: str = None, scopes: List[str] = None, redirect_uri: str = None
+) -> AuthFlowDetails:
+    return await _in_msal_executor(build_auth_code_flow)(authority=authority, scopes=scopes, redirect_uri=redirect_uri)
+
+
+async def verify_flow_async(auth_flow_details: Dict, query_params: QueryDict, cache=None) -> AcquireTokenDetails:
+    return await _in_msal_executor(verify_flow)(auth_flow_details, query_params, cache)
+
+
+async def obtain_access_token_async(scopes=None, cache=None, authority=None) -> dict:
+    return await _in_msal_executor(obtain_access_token)(scopes, cache, authority)
+
+
+async def authenticate_on_hair_async(username, password, scopes=None):
+    logger.info("Doing resource owner password credentials flow... But using RAW process (without a library)")
+
+    address, params, headers = build_ropc_request(username, password, scopes)
+
+    async def send(timeout):
+        started, status = time.perf_counter(), None
+        try:
+            response = await async_http_client.post(
+                address, data=params, headers=headers, timeout=httpx.Timeout(timeout[1], connect=timeout[0])
+            )
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            observe_upstream_request(address, status, elapsed)
+            record_upstream_call(address, status, elapsed)
+
+    with timed_stage("ropc_request"):
+        result = await upstream_guard.call_async(address, send, idempotent=is_idempotent(params))
+    if result.status_code != 200:
+        body = error_body(result)
+        record_upstream_error("ropc", body)
+        raise TokenRequestError(result.status_code, body)
+    body = result.json()
+
+    # Keys are cached, so this is usually CPU only; the first call of an authority may still fetch them
+    return await _in_msal_executor(verify_token)(
+        body["id_token"], B2C_AUTHORITY_RESOURCE_OWNER, B2C_YOUR_APP_RESOURCE_OWNER_APPLICATION_ID
+    )
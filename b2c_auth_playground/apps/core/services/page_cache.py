@@ -0,0 +1,95 @@
+import re
+import secrets
+import threading
+
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from django.dispatch import receiver
+from django.middleware.csrf import get_token
+from django.template.loader import get_template
+from django.utils.autoreload import file_changed
+from django.utils.html import escape
+
+# Random per process, so nothing a template renders by itself can pass for a placeholder
+_MARKER = secrets.token_hex(8)
+_PLACEHOLDER = re.compile(rf"{_MARKER}:(\w+):")
+
+
+def placeholder(name: str) -> str:
+    return f"{_MARKER}:{name}:"
+
+
+class PageSkeleton:
+    """
+    A page rendered once with placeholders where the per-request values go: the text between them never changes, so
+    rendering it again is only joining strings. Values are escaped like the template would.
+    """
+
+    def __init__(self, rendered: str):
+        # Literal text at even positions, placeholder names at odd ones
+        self._parts: List[str] = _PLACEHOLDER.split(rendered)
+
+    def render(self, values: Dict[str, str]) -> str:
+        return "".join(part if i % 2 == 0 else escape(values[part]) for i, part in enumerate(self._parts))
+
+
+class CachedPage:
+    """
+    Skeletons of a template, one for each state of the page (signed in or not, for instance). `states` maps the name
+    of a state to the context the template is rendered with, which has a `placeholder` for every per-request value.
+    Skeletons are built on first use and dropped when a template changes under the development server.
+
+    The context is all the template gets: context processors do not run, so the template must not need them.
+    """
+
+    def __init__(self, template_name: str, states: Dict[str, Callable[[], dict]]):
+        self._template_name = template_name
+        self._states = states
+        self._skeletons: Dict[str, PageSkeleton] = {}
+        self._lock = threading.Lock()
+
+    def render(self, state: str, values: Dict[str, str]) -> str:
+        skeleton = self._skeletons.get(state)
+        if not skeleton:
+            with self._lock:
+                skeleton = self._skeletons.get(state)
+                if not skeleton:
+                    rendered = get_template(self._template_name).render(self._states[state]())
+                    skeleton = self._skeletons[state] = PageSkeleton(rendered)
+        return skeleton.render(values)
+
+    def clear(self) -> None:
+        self._skeletons = {}
+
+
+home_page = CachedPage(
+    "core/pages/home.html",
+    {
+        "anonymous": lambda: {"request": {"session": {}}, "csrf_token": placeholder("csrf_token")},
+        "signed_in": lambda: {
+            "request": {"session": {"user": {"given_name": placeholder("given_name")}}},
+            "csrf_token": placeholder("csrf_token"),
+        },
+    },
+)
+
+
+def render_home_page(request) -> str:
+    """
+    What `render(request, "core/pages/home.html")` gives, out of the skeletons of `home_page`.
+    """
+    # Also tells the CSRF middleware to send the cookie, as `{% csrf_token %}` does
+    values = {"csrf_token": get_token(request)}
+    if "user" not in request.session:
+        return home_page.render("anonymous", values)
+    # A template renders a missing claim as nothing
+    values["given_name"] = str(request.session["user"].get("given_name", ""))
+    return home_page.render("signed_in", values)
+
+
+@receiver(file_changed, dispatch_uid="page_cache_template_changed")
+def _template_changed(sender, file_path, **kwargs):
+    if file_path.suffix == ".html":
+        home_page.clear()
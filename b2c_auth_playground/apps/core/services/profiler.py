@@ -0,0 +1,255 @@
+import sys
+import threading
+import time
+import uuid
+
+from collections import Counter
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from django.core import signing
+
+from b2c_auth_playground.apps.core.services.metrics import upstream_endpoint
+from b2c_auth_playground.settings import B2C_PROFILER_BUFFER_SIZE
+from b2c_auth_playground.settings import B2C_PROFILER_INTERVAL
+from b2c_auth_playground.settings import B2C_PROFILER_MAX_DEPTH
+from b2c_auth_playground.settings import B2C_PROFILER_TOKEN_MAX_AGE
+
+PROFILE_HEADER = "X-B2C-Profile"
+_TOKEN_SALT = "b2c_auth_playground.profiler"
+
+
+@dataclass(frozen=True)
+class UpstreamCall:
+    endpoint: str
+    status: Optional[int]
+    milliseconds: float
+
+
+@dataclass
+class Recording:
+    """
+    What the sampler collected for one request so far: how many times each stack was seen and the calls to B2C.
+    """
+
+    stacks: Counter = field(default_factory=Counter)
+    samples: int = 0
+    upstream_calls: List[UpstreamCall] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class Profile:
+    id: str
+    view: str
+    method: str
+    path: str
+    trigger: str
+    started_at: float
+    duration_ms: float
+    samples: int
+    stacks: Dict[str, int]
+    upstream_calls: List[UpstreamCall]
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "view": self.view,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "startedAt": self.started_at,
+            "durationMs": self.duration_ms,
+            "samples": self.samples,
+            "upstreamCalls": [
+                {"endpoint": call.endpoint, "status": call.status, "milliseconds": call.milliseconds}
+                for call in self.upstream_calls
+            ],
+        }
+
+    def collapsed(self) -> str:
+        """
+        One `frame;frame;frame count` line per stack, root first, as `flamegraph.pl` and speedscope read them.
+        """
+        lines = [f"{stack} {count}" for stack, count in sorted(self.stacks.items())]
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+_current_recording: ContextVar[Optional[Recording]] = ContextVar("b2c_profiler_recording", default=None)
+
+
+def _collapse(frame, max_depth: int) -> str:
+    names = []
+    while frame is not None and len(names) < max_depth:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """
+    One background thread that, every `interval` seconds, takes the stack of each thread being profiled. It sleeps
+    while nothing is being profiled, so requests that are not profiled only pay for checking if they should be.
+    """
+
+    def __init__(self, interval: float = B2C_PROFILER_INTERVAL, max_depth: int = B2C_PROFILER_MAX_DEPTH):
+        self._interval = interval
+        self._max_depth = max_depth
+        self._targets: Dict[int, Recording] = {}
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_started(self) -> None:
+        if self._thread:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._sample_forever, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    @contextmanager
+    def sampling(self, recording: Recording):
+        """
+        Samples the current thread into `recording` until the block exits.
+        """
+        self._ensure_started()
+        thread_id = threading.get_ident()
+        with self._lock:
+            previous = self._targets.get(thread_id)
+            self._targets[thread_id] = recording
+        self._wake_up.set()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if previous is None:
+                    self._targets.pop(thread_id, None)
+                else:
+                    self._targets[thread_id] = previous
+
+    def _sample_forever(self) -> None:
+        own_id = threading.get_ident()
+        while True:
+            if not self._targets:
+                self._wake_up.wait()
+                self._wake_up.clear()
+                continue
+            time.sleep(self._interval)
+            with self._lock:
+                targets = list(self._targets.items())
+            frames = sys._current_frames()
+            for thread_id, recording in targets:
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own_id:
+                    continue
+                recording.stacks[_collapse(frame, self._max_depth)] += 1
+                recording.samples += 1
+            # Frames keep their locals alive, do not hold them until the next round
+            del frames
+
+
+class ProfileStore:
+    """
+    Ring buffer with the last `max_size` profiles of this process.
+    """
+
+    def __init__(self, max_size: int = B2C_PROFILER_BUFFER_SIZE):
+        self._profiles: Deque[Profile] = deque(maxlen=max_size)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        with self._lock:
+            return next((profile for profile in self._profiles if profile.id == profile_id), None)
+
+    def all(self) -> List[Profile]:
+        with self._lock:
+            return list(reversed(self._profiles))
+
+
+stack_sampler = StackSampler()
+profile_store = ProfileStore()
+
+
+@contextmanager
+def recording_request(sample_current_thread: bool = True):
+    """
+    Collects the calls to B2C made while the block runs and, unless told otherwise, samples the current thread; yields
+    the `Recording`. The event loop thread of the async stack runs every request at once, so it is not sampled: only
+    the threads that call `follow_thread` are.
+    """
+    recording = Recording()
+    token = _current_recording.set(recording)
+    try:
+        if sample_current_thread:
+            with stack_sampler.sampling(recording):
+                yield recording
+        else:
+            yield recording
+    finally:
+        _current_recording.reset(token)
+
+
+@contextmanager
+def follow_thread():
+    """
+    Samples the current thread as part of the request being profiled, if there is one. Meant for work a request
+    hands to another thread, such as MSAL calls of the async stack.
+    """
+    recording = _current_recording.get()
+    if recording is None:
+        yield
+        return
+    with stack_sampler.sampling(recording):
+        yield
+
+
+def record_upstream_call(url: str, status: Optional[int], seconds: float) -> None:
+    recording = _current_recording.get()
+    if recording is not None:
+        recording.upstream_calls.append(UpstreamCall(upstream_endpoint(url), status, round(seconds * 1000, 3)))
+
+
+def save_profile(recording: Recording, request, trigger: str, started_at: float, duration: float) -> Profile:
+    resolver_match = getattr(request, "resolver_match", None)
+    profile = Profile(
+        id=uuid.uuid4().hex,
+        view=resolver_match.view_name if resolver_match else "",
+        method=request.method,
+        path=request.path,
+        trigger=trigger,
+        started_at=started_at,
+        duration_ms=round(duration * 1000, 3),
+        samples=recording.samples,
+        stacks=dict(recording.stacks),
+        upstream_calls=list(recording.upstream_calls),
+    )
+    profile_store.add(profile)
+    return profile
+
+
+def profile_token() -> str:
+    """
+    Value for the `X-B2C-Profile` header that asks for a request to be profiled; it is valid for
+    `B2C_PROFILER_TOKEN_MAX_AGE` seconds.
+    """
+    return signing.TimestampSigner(salt=_TOKEN_SALT).sign("profile")
+
+
+def is_valid_token(value: str) -> bool:
+    try:
+        return signing.TimestampSigner(salt=_TOKEN_SALT).unsign(value, max_age=B2C_PROFILER_TOKEN_MAX_AGE) == "profile"
+    except signing.BadSignature:
+        return False
@@ -0,0 +1,112 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from b2c_auth_playground.apps.core.services.metrics import record_refresh_ahead
+from b2c_auth_playground.apps.core.services.metrics import record_refresh_ahead_pending
+from b2c_auth_playground.settings import B2C_REFRESH_AHEAD_CONCURRENCY
+from b2c_auth_playground.settings import B2C_REFRESH_AHEAD_JITTER
+from b2c_auth_playground.settings import B2C_REFRESH_AHEAD_MAX_PENDING
+from b2c_auth_playground.settings import B2C_REFRESH_AHEAD_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# Account, session partition (see `owner_key`), authority and scopes
+RefreshKey = Tuple[str, Optional[str], str, Tuple[str, ...]]
+# Does the refresh and tells how it went: refreshed_ahead, failed or skipped
+Refresh = Callable[[], str]
+
+
+class RefreshAheadScheduler:
+    """
+    When an access token served from the cache is about to expire, the request keeps it and a background worker
+    redeems the refresh token. Each (account, authority, scopes) has at most one refresh pending, the pool bounds
+    how many run at once, and a random delay spreads refreshes of tokens that were issued together. Delayed refreshes
+    wait in a heap that a single thread hands to the pool when they are due.
+
+    MSAL already treats tokens expiring within 5 minutes as expired, so `window` only matters above that. What it
+    does is counted in the `b2c_refresh_ahead` metrics.
+    """
+
+    def __init__(
+        self,
+        window: float = B2C_REFRESH_AHEAD_WINDOW,
+        concurrency: int = B2C_REFRESH_AHEAD_CONCURRENCY,
+        jitter: float = B2C_REFRESH_AHEAD_JITTER,
+        max_pending: int = B2C_REFRESH_AHEAD_MAX_PENDING,
+    ):
+        self.window = window
+        self._jitter = jitter
+        self._max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="refresh-ahead")
+        self._pending: Set[RefreshKey] = set()
+        # (due at, tie breaker, key, refresh), soonest first
+        self._delayed: List[Tuple[float, int, RefreshKey, Refresh]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._dispatcher: Optional[threading.Thread] = None
+
+    def is_due(self, result: dict) -> bool:
+        expires_in = result.get("expires_in") if isinstance(result, dict) else None
+        return expires_in is not None and int(expires_in) <= self.window
+
+    def record_inline_refresh(self) -> None:
+        record_refresh_ahead("refreshed_inline")
+
+    def schedule(self, key: RefreshKey, refresh: Refresh) -> bool:
+        with self._condition:
+            if key in self._pending:
+                return False
+            if len(self._pending) >= self._max_pending:
+                record_refresh_ahead("skipped")
+                return False
+            self._pending.add(key)
+            record_refresh_ahead_pending(1)
+            due_at = time.monotonic() + random.uniform(0, self._jitter)
+            heapq.heappush(self._delayed, (due_at, next(self._sequence), key, refresh))
+            if not self._dispatcher:
+                # Started on first use, so a process that forks after loading the app does not lose it
+                self._dispatcher = threading.Thread(
+                    target=self._dispatch_forever, name="refresh-ahead-dispatcher", daemon=True
+                )
+                self._dispatcher.start()
+            self._condition.notify()
+        return True
+
+    def _dispatch_forever(self) -> None:
+        with self._condition:
+            while True:
+                if not self._delayed:
+                    self._condition.wait()
+                    continue
+                wait = self._delayed[0][0] - time.monotonic()
+                if wait > 0:
+                    # Woken up early when something due sooner is scheduled
+                    self._condition.wait(wait)
+                    continue
+                _, _, key, refresh = heapq.heappop(self._delayed)
+                self._executor.submit(self._run, key, refresh)
+
+    def _run(self, key: RefreshKey, refresh: Refresh) -> None:
+        try:
+            record_refresh_ahead(refresh())
+        except Exception:
+            logger.exception("Could not refresh ahead the token of %s", key[0])
+            record_refresh_ahead("failed")
+        finally:
+            with self._condition:
+                self._pending.discard(key)
+                record_refresh_ahead_pending(-1)
+
+
+refresh_ahead_scheduler = RefreshAheadScheduler()
@@ -0,0 +1,28 @@
+import contextvars
+import time
+
+from contextlib import contextmanager
+from typing import Optional
+
+# Kept apart from `resilience` so the middleware can set deadlines without importing the HTTP clients
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("b2c_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Every call to B2C made inside shares these `seconds`, whatever thread or coroutine it runs in, as long as the
+    context is copied there (`sync_to_async` does it). A nested deadline can only make it shorter.
+    """
+    expires_at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(min(expires_at, current) if current else expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    expires_at = _deadline.get()
+    return None if expires_at is None else expires_at - time.monotonic()
@@ -0,0 +1,462 @@
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Awaitable
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import httpx
+import requests
+
+from b2c_auth_playground.apps.core.services.http_transport import http_session
+from b2c_auth_playground.apps.core.services.metrics import record_upstream_decision
+from b2c_auth_playground.apps.core.services.metrics import upstream_endpoint
+from b2c_auth_playground.apps.core.services.request_deadline import remaining_time
+from b2c_auth_playground.settings import B2C_CIRCUIT_FAILURE_THRESHOLD
+from b2c_auth_playground.settings import B2C_CIRCUIT_OPEN_SECONDS
+from b2c_auth_playground.settings import B2C_HEDGE_MAX_RATIO
+from b2c_auth_playground.settings import B2C_HEDGE_MIN_SAMPLES
+from b2c_auth_playground.settings import B2C_HEDGE_PERCENTILE
+from b2c_auth_playground.settings import B2C_HEDGE_THREADS
+from b2c_auth_playground.settings import B2C_HEDGING_ENABLED
+from b2c_auth_playground.settings import B2C_HTTP_CONNECT_TIMEOUT
+from b2c_auth_playground.settings import B2C_HTTP_READ_TIMEOUT
+from b2c_auth_playground.settings import B2C_RETRY_BASE_DELAY
+from b2c_auth_playground.settings import B2C_RETRY_MAX_ATTEMPTS
+from b2c_auth_playground.settings import B2C_RETRY_MAX_DELAY
+
+logger = logging.getLogger(__name__)
+
+# B2C is struggling or throttling us: worth retrying, and counted by the circuit breaker
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+# Sending these grants twice only gives two sets of tokens. The others are resent only when the first request could
+# not be sent, and never hedged: an authorization code can only be redeemed once, a refresh token that rotated on the
+# first request is no longer valid for the second, and each password attempt counts towards the account lockout
+IDEMPOTENT_GRANTS = {"client_credentials"}
+
+TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout, httpx.TransportError)
+# The request never left, so even non-idempotent ones can be sent again
+NOT_SENT_ERRORS = (requests.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)
+
+# (connect, read) in seconds
+Timeout = Tuple[float, float]
+
+
+class UpstreamUnavailable(Exception):
+    def __init__(self, message: str, retry_after: float = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` failures in a row and rejects calls for `open_seconds`. Then one call goes through
+    as a probe: the circuit closes if it works and opens again if it does not. A probe that never tells how it went is
+    replaced by another one after `open_seconds`.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, open_seconds: float):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._open_seconds = open_seconds
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            now = time.monotonic()
+            since = self._opened_at if self._state == self.OPEN else self._probe_at
+            retry_after = since + self._open_seconds - now
+            if retry_after <= 0:
+                self._state = self.HALF_OPEN
+                self._probe_at = now
+                probing = True
+            else:
+                probing = False
+        if probing:
+            record_upstream_decision(self.name, "circuit_half_open")
+            return
+        # Open, or half open with the probe still in flight
+        record_upstream_decision(self.name, "circuit_rejected")
+        raise CircuitOpenError(f"B2C is failing for {self.name}, not calling it for now", max(retry_after, 1))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self._state == self.CLOSED:
+                return
+            self._state = self.CLOSED
+        record_upstream_decision(self.name, "circuit_closed")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.OPEN:
+                return
+            if self._state == self.CLOSED and self._failures < self._failure_threshold:
+                return
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+        logger.warning("Opening the circuit of %s for %.0fs", self.name, self._open_seconds)
+        record_upstream_decision(self.name, "circuit_opened")
+
+
+class LatencyWindow:
+    """
+    Durations of the last `size` answered calls, to know when a call is slow enough to deserve a hedge.
+    """
+
+    def __init__(self, size: int = 200, min_samples: int = B2C_HEDGE_MIN_SAMPLES):
+        self._durations: Deque[float] = deque(maxlen=size)
+        self._min_samples = min_samples
+
+    def add(self, seconds: float) -> None:
+        self._durations.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        durations = sorted(self._durations)
+        if len(durations) < self._min_samples:
+            return None
+        return durations[min(int(len(durations) * percentile / 100), len(durations) - 1)]
+
+
+class _HedgeBudget:
+    """
+    Hedges are at most `max_ratio` of the calls, so a slow B2C does not get twice the load.
+    """
+
+    def __init__(self, max_ratio: float, period: int = 1000):
+        self._max_ratio = max_ratio
+        self._period = period
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def record_call(self) -> None:
+        with self._lock:
+            self._calls += 1
+            if self._calls >= self._period:
+                # Recent calls only, so a quiet hour does not pay for a burst of hedges
+                self._calls, self._hedges = 0, 0
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._hedges + 1 > max(1.0, self._calls * self._max_ratio):
+                return False
+            self._hedges += 1
+            return True
+
+
+class _AuthorityState:
+    def __init__(self, authority: str, guard: "UpstreamGuard"):
+        self.authority = authority
+        self.breaker = CircuitBreaker(authority, guard.failure_threshold, guard.open_seconds)
+        self.latencies = LatencyWindow()
+
+
+def authority_of(url: str) -> str:
+    # https://xptoorg.b2clogin.com/xptoorg.onmicrosoft.com/b2c_1_resource-owner/oauth2/v2.0/token
+    return url.split("/oauth2/", 1)[0].lower()
+
+
+def _is_transient(response) -> bool:
+    return response.status_code in TRANSIENT_STATUSES
+
+
+def _retry_after_header(response) -> Optional[float]:
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamGuard:
+    """
+    Every call to the token endpoint goes through here. Within the request deadline:
+
+    - the circuit breaker of the authority fails fast while B2C keeps failing;
+    - transient failures (see `TRANSIENT_STATUSES` and `TRANSPORT_ERRORS`) are retried with full jitter backoff when
+      the call is idempotent, or when the request could not even be sent;
+    - with hedging, an idempotent call slower than the `hedge_percentile` of recent ones gets a second request, and
+      the first answer wins.
+
+    What it decided ends up in the `b2c_upstream_decisions` metric. It raises `UpstreamUnavailable` (or one of its
+    subclasses) when no answer could be had; answers that are not transient are returned as they are.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = B2C_RETRY_MAX_ATTEMPTS,
+        base_delay: float = B2C_RETRY_BASE_DELAY,
+        max_delay: float = B2C_RETRY_MAX_DELAY,
+        failure_threshold: int = B2C_CIRCUIT_FAILURE_THRESHOLD,
+        open_seconds: float = B2C_CIRCUIT_OPEN_SECONDS,
+        hedging: bool = B2C_HEDGING_ENABLED,
+        hedge_percentile: float = B2C_HEDGE_PERCENTILE,
+        hedge_max_ratio: float = B2C_HEDGE_MAX_RATIO,
+        timeout: Timeout = (B2C_HTTP_CONNECT_TIMEOUT, B2C_HTTP_READ_TIMEOUT),
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.timeout = timeout
+        self._hedge_budget = _HedgeBudget(hedge_max_ratio)
+        self._hedge_executor = None
+        self._states: Dict[str, _AuthorityState] = {}
+        self._lock = threading.Lock()
+
+    def breaker_for(self, url: str) -> CircuitBreaker:
+        return self._state_for(url).breaker
+
+    def _state_for(self, url: str) -> _AuthorityState:
+        authority = authority_of(url)
+        state = self._states.get(authority)
+        if not state:
+            with self._lock:
+                state = self._states.setdefault(authority, _AuthorityState(authority, self))
+        return state
+
+    def _attempt_timeout(self, authority: str) -> Timeout:
+        connect, read = self.timeout
+        remaining = remaining_time()
+        if remaining is None:
+            return connect, read
+        if remaining <= 0:
+            record_upstream_decision(authority, "deadline_exceeded")
+            raise DeadlineExceeded(f"No time left to call {authority}")
+        return min(connect, remaining), min(read, remaining)
+
+    def _hedge_delay(self, state: _AuthorityState, idempotent: bool, timeout: Timeout) -> Optional[float]:
+        if not self.hedging or not idempotent:
+            return None
+        delay = state.latencies.percentile(self.hedge_percentile)
+        # Pointless if the first request would time out before the hedge is sent
+        return delay if delay is not None and delay < timeout[1] else None
+
+    def _backoff(self, state: _AuthorityState, attempt: int, response) -> Optional[float]:
+        """
+        How long to wait before the next attempt, or None when there is no next attempt within the deadline.
+        """
+        if attempt >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        retry_after = _retry_after_header(response) if response is not None else None
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            record_upstream_decision(state.authority, "deadline_exceeded")
+            return None
+        return delay
+
+    def _settle(self, state: _AuthorityState, outcome, idempotent: bool, started: float) -> Tuple[bool, bool]:
+        """
+        Feeds the breaker and the latencies with the outcome of an attempt. Returns whether it is final, and if not,
+        whether it may be retried.
+        """
+        if isinstance(outcome, BaseException):
+            state.breaker.record_failure()
+            return False, idempotent or isinstance(outcome, NOT_SENT_ERRORS)
+        if _is_transient(outcome):
+            state.breaker.record_failure()
+            return False, idempotent
+        state.breaker.record_success()
+        state.latencies.add(time.monotonic() - started)
+        return True, False
+
+    def _give_up(self, state: _AuthorityState, outcome) -> UpstreamUnavailable:
+        record_upstream_decision(state.authority, "gave_up")
+        if isinstance(outcome, BaseException):
+            if remaining_time() is not None and remaining_time() <= 0:
+                return DeadlineExceeded(f"Ran out of time calling {state.authority}: {outcome}")
+            return UpstreamUnavailable(f"Could not reach {state.authority}: {outcome}")
+        retry_after = _retry_after_header(outcome) or 1
+        return UpstreamUnavailable(f"{state.authority} answered {outcome.status_code}", retry_after)
+
+    def call(self, url: str, send: Callable[[Timeout], requests.Response], idempotent: bool) -> requests.Response:
+        state = self._state_for(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._attempt_timeout(state.authority)
+            state.breaker.before_call()
+            started = time.monotonic()
+            try:
+                outcome = self._send(state, send, timeout, self._hedge_delay(state, idempotent, timeout))
+            except TRANSPORT_ERRORS as e:
+                outcome = e
+            final, retryable = self._settle(state, outcome, idempotent, started)
+            if final:
+                return outcome
+            response = None if isinstance(outcome, BaseException) else outcome
+            delay = self._backoff(state, attempt, response) if retryable else None
+            if delay is None:
+                if response is not None:
+                    response.close()
+                raise self._give_up(state, outcome) from (outcome if response is None else None)
+            logger.info("Attempt %s to %s failed (%s), retrying in %.2fs", attempt, state.authority, outcome, delay)
+            record_upstream_decision(state.authority, "retry")
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+
+    async def call_async(
+        self, url: str, send: Callable[[Timeout], Awaitable[httpx.Response]], idempotent: bool
+    ) -> httpx.Response:
+        state = self._state_for(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._attempt_timeout(state.authority)
+            state.breaker.before_call()
+            started = time.monotonic()
+            try:
+                outcome = await self._send_async(state, send, timeout, self._hedge_delay(state, idempotent, timeout))
+            except TRANSPORT_ERRORS as e:
+                outcome = e
+            final, retryable = self._settle(state, outcome, idempotent, started)
+            if final:
+                return outcome
+            response = None if isinstance(outcome, BaseException) else outcome
+            delay = self._backoff(state, attempt, response) if retryable else None
+            if delay is None:
+                raise self._give_up(state, outcome) from (outcome if response is None else None)
+            logger.info("Attempt %s to %s failed (%s), retrying in %.2fs", attempt, state.authority, outcome, delay)
+            record_upstream_decision(state.authority, "retry")
+            await asyncio.sleep(delay)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if not self._hedge_executor:
+            with self._lock:
+                if not self._hedge_executor:
+                    self._hedge_executor = ThreadPoolExecutor(B2C_HEDGE_THREADS, thread_name_prefix="hedge")
+        return self._hedge_executor
+
+    def _send(self, state: _AuthorityState, send, timeout: Timeout, hedge_delay: Optional[float]):
+        self._hedge_budget.record_call()
+        if hedge_delay is None:
+            return send(timeout)
+        executor = self._executor()
+        # The copied context carries the deadline and the profiler recording to the executor thread
+        first = executor.submit(contextvars.copy_context().run, send, timeout)
+        done, _ = wait([first], timeout=hedge_delay)
+        if done or not self._hedge_budget.try_spend():
+            return first.result()
+        record_upstream_decision(state.authority, "hedge")
+        second = executor.submit(contextvars.copy_context().run, send, timeout)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and not _is_transient(future.result()):
+                    if future is second:
+                        record_upstream_decision(state.authority, "hedge_won")
+                    # Threads cannot be cancelled, the slower answer is dropped once it arrives
+                    for other in pending:
+                        other.add_done_callback(_close_response)
+                    return future.result()
+        # Both failed, the first one speaks for them
+        return first.result()
+
+    async def _send_async(self, state: _AuthorityState, send, timeout: Timeout, hedge_delay: Optional[float]):
+        self._hedge_budget.record_call()
+        if hedge_delay is None:
+            return await send(timeout)
+        first = asyncio.ensure_future(send(timeout))
+        done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+        if done or not self._hedge_budget.try_spend():
+            return await first
+        record_upstream_decision(state.authority, "hedge")
+        second = asyncio.ensure_future(send(timeout))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and not _is_transient(task.result()):
+                        if task is second:
+                            record_upstream_decision(state.authority, "hedge_won")
+                        return task.result()
+            return await first
+        finally:
+            for task in (first, second):
+                if not task.done():
+                    task.cancel()
+
+
+def _close_response(future) -> None:
+    if future.exception() is None:
+        future.result().close()
+
+
+def is_idempotent(data) -> bool:
+    grant_type = data.get("grant_type") if isinstance(data, dict) else None
+    return grant_type in IDEMPOTENT_GRANTS
+
+
+upstream_guard = UpstreamGuard()
+
+
+class ResilientHttpClient:
+    """
+    Wraps a session so its calls to the token endpoint go through `upstream_guard`. MSAL gets one, which covers the
+    auth code redemption and the silent refreshes; everything else goes straight to the session.
+    """
+
+    def __init__(self, session: requests.Session, guard: UpstreamGuard):
+        self._session = session
+        self._guard = guard
+
+    def post(self, url, **kwargs):
+        if upstream_endpoint(url) != "token":
+            return self._session.post(url, **kwargs)
+        # The guard works the timeout out of the deadline
+        kwargs.pop("timeout", None)
+        return self._guard.call(
+            url,
+            lambda timeout: self._session.post(url, timeout=timeout, **kwargs),
+            idempotent=is_idempotent(kwargs.get("data")),
+        )
+
+    def get(self, url, **kwargs):
+        return self._session.get(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+resilient_http_client = ResilientHttpClient(http_session, upstream_guard)
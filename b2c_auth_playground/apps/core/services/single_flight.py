@@ -0,0 +1,153 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+from b2c_auth_playground.settings import B2C_LEASE_STORE_PATH
+from b2c_auth_playground.settings import B2C_REFRESH_LEASE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Concurrent `do` calls with the same key run `function` once: the first caller runs it and the others wait for its
+    outcome, be it a result or an exception.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, function: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class SqliteLeaseStore:
+    """
+    Leases shared by every worker process of the node. A lease expires by itself after `ttl`, so a crashed worker
+    cannot hold it forever.
+    """
+
+    def __init__(self, path: str):
+        self._path = str(path)
+        self._local = threading.local()
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                lease_key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if not connection:
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def try_acquire(self, key: str, owner: str, ttl: float) -> bool:
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT owner, expires_at FROM leases WHERE lease_key = ?", (key,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            connection.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (key, owner, now + ttl))
+            return True
+
+    def release(self, key: str, owner: str) -> None:
+        self._connection().execute("DELETE FROM leases WHERE lease_key = ? AND owner = ?", (key, owner))
+
+    def wait_until_released(self, key: str, timeout: float, poll_interval: float = 0.05) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            row = self._connection().execute("SELECT expires_at FROM leases WHERE lease_key = ?", (key,)).fetchone()
+            if not row or row[0] <= time.time():
+                return True
+            time.sleep(poll_interval)
+        return False
+
+
+class TokenRefreshCoalescer:
+    """
+    Makes sure only one refresh per account (`key`) is in flight on the node. Threads of this process making the same
+    call (`flight_key`, the `key` by default) share the leader's result. Other calls wait for the leader's lease to go
+    away, call `on_lease_released` (so they can reload what the leader stored) and then run their own call, which is
+    usually answered from the refreshed cache.
+    """
+
+    def __init__(self, lease_store_factory: Callable[[], SqliteLeaseStore], lease_ttl: float = B2C_REFRESH_LEASE_TTL):
+        self._single_flight = SingleFlight()
+        self._lease_store_factory = lease_store_factory
+        self._lease_store: Optional[SqliteLeaseStore] = None
+        self._lease_ttl = lease_ttl
+
+    def _leases(self) -> SqliteLeaseStore:
+        if not self._lease_store:
+            self._lease_store = self._lease_store_factory()
+        return self._lease_store
+
+    def run(
+        self,
+        key: str,
+        function: Callable[[], Any],
+        on_lease_released: Callable[[], None] = None,
+        flight_key: Optional[str] = None,
+    ) -> Any:
+        def leader():
+            leases = self._leases()
+            owner = f"{os.getpid()}-{threading.get_ident()}"
+            if leases.try_acquire(key, owner, self._lease_ttl):
+                try:
+                    return function()
+                finally:
+                    leases.release(key, owner)
+            logger.debug("Another worker is refreshing %s, waiting for it", key)
+            if not leases.wait_until_released(key, self._lease_ttl):
+                logger.warning("Lease of %s was not released in time, refreshing anyway", key)
+            if on_lease_released:
+                on_lease_released()
+            return function()
+
+        return self._single_flight.do(flight_key or key, leader)
+
+
+token_refresh_coalescer = TokenRefreshCoalescer(lambda: SqliteLeaseStore(B2C_LEASE_STORE_PATH))
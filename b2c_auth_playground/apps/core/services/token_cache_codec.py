@@ -0,0 +1,128 @@
+import base64
+import json
+import zlib
+
+from collections import Counter
+from typing import Dict
+from typing import List
+
+from msal import SerializableTokenCache
+from msal import TokenCache
+
+# First byte of every encoded payload, so the format can evolve without breaking what is already persisted
+CODEC_VERSION = 1
+
+_TOKEN_TYPES = (
+    TokenCache.CredentialType.ACCESS_TOKEN,
+    TokenCache.CredentialType.REFRESH_TOKEN,
+    TokenCache.CredentialType.ID_TOKEN,
+)
+_key_makers = TokenCache().key_makers
+
+
+class UnsupportedCodecVersion(ValueError):
+    pass
+
+
+def _strings_worth_interning(state: Dict[str, Dict[str, dict]]) -> List[str]:
+    occurrences: Counter = Counter()
+    for entries in state.values():
+        for entry in entries.values():
+            occurrences.update(entry.keys())
+            occurrences.update(value for value in entry.values() if isinstance(value, str))
+    return [string for string, count in occurrences.most_common() if count > 1]
+
+
+def _compact_entry(credential_type: str, key: str, entry: dict, strings: List[str], index: Dict[str, int]) -> list:
+    entry = dict(entry)
+    if credential_type in _TOKEN_TYPES:
+        # It is the same as the section it lives in, unless it is missing
+        if entry.get("credential_type") == credential_type:
+            del entry["credential_type"]
+        else:
+            entry.setdefault("credential_type", None)
+
+    fields = []
+    for name, value in entry.items():
+        fields.append(index.get(name, name))
+        if isinstance(value, str):
+            # A string is either a reference to the string table or itself
+            fields.append(index.get(value, value))
+        else:
+            fields.append([value])
+
+    expanded = _expand_entry(credential_type, fields, strings)
+    # MSAL builds the key out of the entry, so we only keep it when it cannot be rebuilt
+    return [fields] if _key_of(credential_type, expanded) == key else [fields, key]
+
+
+def _resolve(value, strings: List[str]):
+    if isinstance(value, int):
+        return strings[value]
+    if isinstance(value, list):
+        return value[0]
+    return value
+
+
+def _expand_entry(credential_type: str, fields: list, strings: List[str]) -> dict:
+    entry = {}
+    for position in range(0, len(fields), 2):
+        entry[_resolve(fields[position], strings)] = _resolve(fields[position + 1], strings)
+    if credential_type in _TOKEN_TYPES:
+        entry.setdefault("credential_type", credential_type)
+        if entry["credential_type"] is None:
+            del entry["credential_type"]
+    return entry
+
+
+def _key_of(credential_type: str, entry: dict) -> str:
+    key_maker = _key_makers.get(credential_type)
+    return key_maker(**entry) if key_maker else None
+
+
+def encode(state: Dict[str, Dict[str, dict]], level: int = 6) -> bytes:
+    strings = _strings_worth_interning(state)
+    index = {string: position for position, string in enumerate(strings)}
+    sections = {
+        credential_type: [_compact_entry(credential_type, key, entry, strings, index) for key, entry in entries.items()]
+        for credential_type, entries in state.items()
+    }
+    payload = json.dumps([strings, sections], separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return bytes([CODEC_VERSION]) + zlib.compress(payload, level)
+
+
+def decode(data: bytes) -> Dict[str, Dict[str, dict]]:
+    version = data[0]
+    if version != CODEC_VERSION:
+        raise UnsupportedCodecVersion(f"Token cache encoded with unknown version {version}")
+    strings, sections = json.loads(zlib.decompress(data[1:]).decode("utf-8"))
+    state = {}
+    for credential_type, compact_entries in sections.items():
+        entries = state.setdefault(credential_type, {})
+        for compact_entry in compact_entries:
+            entry = _expand_entry(credential_type, compact_entry[0], strings)
+            key = compact_entry[1] if len(compact_entry) > 1 else _key_of(credential_type, entry)
+            entries[key] = entry
+    return state
+
+
+def dumps_cache(cache: SerializableTokenCache) -> str:
+    """
+    Text version of `encode`, as what goes into the Django session must be JSON serializable. It reads MSAL's
+    in-memory state directly, which spares us the JSON round trip `serialize` would cost.
+    """
+    with cache._lock:
+        encoded = encode(cache._cache)
+        cache.has_state_changed = False
+    return base64.urlsafe_b64encode(encoded).decode("ascii")
+
+
+def loads_cache(cache: SerializableTokenCache, value: str) -> None:
+    # What we used to store (and what MSAL produces) is plain JSON
+    if value.lstrip().startswith("{"):
+        cache.deserialize(value)
+    else:
+        state = decode(base64.urlsafe_b64decode(value))
+        with cache._lock:
+            cache._cache = state
+            cache.has_state_changed = False
@@ -0,0 +1,284 @@
+import json
+import logging
+import secrets
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+from msal import SerializableTokenCache
+
+from b2c_auth_playground.apps.core.services.metrics import timed
+from b2c_auth_playground.settings import B2C_TOKEN_CACHE_LRU_SIZE
+from b2c_auth_playground.settings import B2C_TOKEN_CACHE_LRU_TTL
+from b2c_auth_playground.settings import B2C_TOKEN_CACHE_STORE_PATH
+
+logger = logging.getLogger(__name__)
+
+Entries = Dict[str, dict]
+PartitionKey = Tuple[str, str]
+
+
+class TokenCacheStore:
+    """
+    Token cache entries partitioned by account (`home_account_id`, or the `owner_key` of an account within a session)
+    and credential type (`Account`, `IdToken`, `AccessToken`, `RefreshToken` and `AppMetadata`). Each partition maps
+    MSAL's cache key to its entry.
+    """
+
+    def load_partition(self, account_id: str, credential_type: str) -> Entries:
+        raise NotImplementedError
+
+    def write(self, account_id: str, credential_type: str, upserts: Entries, deletions: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    def delete_account(self, account_id: str) -> None:
+        raise NotImplementedError
+
+    def ping(self) -> None:
+        raise NotImplementedError
+
+    def forget(self, account_id: str) -> None:
+        """
+        Drops whatever this process keeps in memory about the account, so the next load reads the durable copy.
+        """
+
+
+class SqliteTokenCacheStore(TokenCacheStore):
+    def __init__(self, path: str):
+        self._path = str(path)
+        self._local = threading.local()
+        self._prepare()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if not connection:
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _prepare(self) -> None:
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS token_cache_entries (
+                account_id TEXT NOT NULL,
+                credential_type TEXT NOT NULL,
+                entry_key TEXT NOT NULL,
+                entry TEXT NOT NULL,
+                PRIMARY KEY (account_id, credential_type, entry_key)
+            )
+            """)
+
+    def load_partition(self, account_id: str, credential_type: str) -> Entries:
+        rows = self._connection().execute(
+            "SELECT entry_key, entry FROM token_cache_entries WHERE account_id = ? AND credential_type = ?",
+            (account_id, credential_type),
+        )
+        return {entry_key: json.loads(entry) for entry_key, entry in rows}
+
+    def write(self, account_id: str, credential_type: str, upserts: Entries, deletions: Iterable[str]) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT OR REPLACE INTO token_cache_entries VALUES (?, ?, ?, ?)",
+                [(account_id, credential_type, key, json.dumps(entry)) for key, entry in upserts.items()],
+            )
+            connection.executemany(
+                "DELETE FROM token_cache_entries WHERE account_id = ? AND credential_type = ? AND entry_key = ?",
+                [(account_id, credential_type, key) for key in deletions],
+            )
+
+    def delete_account(self, account_id: str) -> None:
+        self._connection().execute("DELETE FROM token_cache_entries WHERE account_id = ?", (account_id,))
+
+    def ping(self) -> None:
+        self._connection().execute("SELECT 1 FROM token_cache_entries LIMIT 1").fetchall()
+
+
+class LruTokenCacheStore(TokenCacheStore):
+    """
+    In-memory LRU tier in front of a durable store. Writes go through to the durable store. As other workers may
+    write to the same partition, an entry held here is only trusted for `ttl` seconds.
+    """
+
+    def __init__(self, backend: TokenCacheStore, max_partitions: int, ttl: float):
+        self._backend = backend
+        self._max_partitions = max_partitions
+        self._ttl = ttl
+        self._partitions: "OrderedDict[PartitionKey, Tuple[Entries, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load_partition(self, account_id: str, credential_type: str) -> Entries:
+        key = (account_id, credential_type)
+        with self._lock:
+            cached = self._partitions.get(key)
+            if cached and cached[1] > time.monotonic():
+                self._partitions.move_to_end(key)
+                return dict(cached[0])
+        entries = self._backend.load_partition(account_id, credential_type)
+        self._remember(key, entries)
+        return dict(entries)
+
+    def write(self, account_id: str, credential_type: str, upserts: Entries, deletions: Iterable[str]) -> None:
+        deletions = list(deletions)
+        self._backend.write(account_id, credential_type, upserts, deletions)
+        key = (account_id, credential_type)
+        with self._lock:
+            cached = self._partitions.pop(key, None)
+        if cached:
+            entries = dict(cached[0], **upserts)
+            for entry_key in deletions:
+                entries.pop(entry_key, None)
+            self._remember(key, entries)
+
+    def delete_account(self, account_id: str) -> None:
+        self._backend.delete_account(account_id)
+        self.forget(account_id)
+
+    def ping(self) -> None:
+        self._backend.ping()
+
+    def forget(self, account_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._partitions if key[0] == account_id]:
+                del self._partitions[key]
+
+    def _remember(self, key: PartitionKey, entries: Entries) -> None:
+        with self._lock:
+            self._partitions[key] = (entries, time.monotonic() + self._ttl)
+            self._partitions.move_to_end(key)
+            while len(self._partitions) > self._max_partitions:
+                self._partitions.popitem(last=False)
+
+
+class _LazyPartitions(dict):
+    """
+    Stands in for `TokenCache._cache` ({credential_type: {key: entry}}): a partition is only loaded from the store the
+    first time MSAL looks at it.
+    """
+
+    def __init__(self, loader):
+        super().__init__()
+        self._loader = loader
+
+    def _ensure(self, credential_type):
+        if not super().__contains__(credential_type):
+            super().__setitem__(credential_type, self._loader(credential_type))
+
+    def get(self, credential_type, default=None):
+        self._ensure(credential_type)
+        return super().get(credential_type, default)
+
+    def setdefault(self, credential_type, default=None):
+        self._ensure(credential_type)
+        return super().setdefault(credential_type, default)
+
+    def __getitem__(self, credential_type):
+        self._ensure(credential_type)
+        return super().__getitem__(credential_type)
+
+
+class PartitionedTokenCache(SerializableTokenCache):
+    """
+    A `SerializableTokenCache` backed by a `TokenCacheStore`. Only the partitions MSAL touches are loaded and `flush`
+    writes back only the entries that were added, changed or removed.
+
+    With a `session_partition` the entries are kept apart from the ones of the same account signed in elsewhere (see
+    `owner_key`), so signing out of one browser does not take the tokens of the others with it. Without one they are
+    shared by everyone presenting the account, as bearer token callers do.
+    """
+
+    def __init__(
+        self, store: TokenCacheStore, home_account_id: Optional[str] = None, session_partition: Optional[str] = None
+    ):
+        super().__init__()
+        self.home_account_id = home_account_id
+        self.session_partition = session_partition
+        self._store = store
+        self._changes: Dict[PartitionKey, Optional[str]] = {}
+        self._cache = _LazyPartitions(self._load_partition)
+
+    @property
+    def owner(self) -> Optional[str]:
+        return owner_key(self.home_account_id, self.session_partition) if self.home_account_id else None
+
+    @timed("token_cache_partition_load")
+    def _load_partition(self, credential_type: str) -> Entries:
+        if not self.home_account_id:
+            return {}
+        return self._store.load_partition(self.owner, credential_type)
+
+    def reload(self) -> None:
+        """
+        Forgets the partitions loaded so far (and what the store keeps in memory), so the next look at a partition
+        sees what another worker may have written meanwhile.
+        """
+        with self._lock:
+            if self.home_account_id:
+                self._store.forget(self.owner)
+            self._cache = _LazyPartitions(self._load_partition)
+
+    def modify(self, credential_type, old_entry, new_key_value_pairs=None):
+        super().modify(credential_type, old_entry, new_key_value_pairs)
+        key = self.key_makers[credential_type](**old_entry)
+        with self._lock:
+            self._changes[(credential_type, key)] = old_entry.get("home_account_id")
+
+    @timed("token_cache_flush")
+    def flush(self) -> None:
+        with self._lock:
+            if not self.home_account_id:
+                self.home_account_id = next((account for account in self._changes.values() if account), None)
+            if not self.home_account_id:
+                logger.warning("Nothing to flush as no account was found in the token cache")
+                return
+
+            grouped: Dict[PartitionKey, Tuple[Entries, list]] = {}
+            for (credential_type, key), account_id in self._changes.items():
+                upserts, deletions = grouped.setdefault((account_id or self.home_account_id, credential_type), ({}, []))
+                entry = dict.get(self._cache, credential_type, {}).get(key)
+                if entry:
+                    upserts[key] = entry
+                else:
+                    deletions.append(key)
+            for (account_id, credential_type), (upserts, deletions) in grouped.items():
+                self._store.write(owner_key(account_id, self.session_partition), credential_type, upserts, deletions)
+
+            self._changes.clear()
+            self.has_state_changed = False
+
+
+def owner_key(home_account_id: str, session_partition: Optional[str] = None) -> str:
+    """
+    What the store keys the partitions of an account with: the account itself, or the account within one session.
+    """
+    return f"{home_account_id}#{session_partition}" if session_partition else home_account_id
+
+
+def new_session_partition() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def _build_default_store() -> TokenCacheStore:
+    durable_store = SqliteTokenCacheStore(B2C_TOKEN_CACHE_STORE_PATH)
+    return LruTokenCacheStore(durable_store, max_partitions=B2C_TOKEN_CACHE_LRU_SIZE, ttl=B2C_TOKEN_CACHE_LRU_TTL)
+
+
+_default_store: Optional[TokenCacheStore] = None
+_default_store_lock = threading.Lock()
+
+
+def token_cache_store() -> TokenCacheStore:
+    global _default_store
+    if not _default_store:
+        with _default_store_lock:
+            if not _default_store:
+                _default_store = _build_default_store()
+    return _default_store
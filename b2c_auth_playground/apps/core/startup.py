@@ -0,0 +1,86 @@
+import importlib
+import logging
+import threading
+
+from b2c_auth_playground.settings import B2C_CLIENT_APP_POOL_WARM_UP
+from b2c_auth_playground.settings import B2C_DISCOVERY_CACHE_WARM_UP
+from b2c_auth_playground.settings import B2C_STARTUP_MODE
+from b2c_auth_playground.settings import B2C_VIEW_STACK
+
+logger = logging.getLogger(__name__)
+
+_VIEW_MODULES = {
+    "sync": (
+        "b2c_auth_playground.apps.core.views",
+        "b2c_auth_playground.apps.core.api.v1.api_views",
+    ),
+    "async": (
+        "b2c_auth_playground.apps.core.views_async",
+        "b2c_auth_playground.apps.core.api.v1.api_views_async",
+    ),
+}
+_COMMON_MODULES = (
+    "b2c_auth_playground.apps.core.api.api_views",
+    "b2c_auth_playground.apps.core.api.authentication",
+)
+
+
+def preload_modules() -> None:
+    """
+    Imports what the views of the current stack need (MSAL, PyJWT, the HTTP clients...), for a parent process that
+    forks its workers afterwards so they share those pages. Importing opens no connection and starts no thread, which
+    keeps it safe to do before a fork.
+    """
+    for module in _VIEW_MODULES[B2C_VIEW_STACK] + _COMMON_MODULES:
+        importlib.import_module(module)
+
+
+def warm_up() -> None:
+    """
+    Fetches what the first requests would otherwise wait for, as configured. It talks to B2C, so in a preloading parent
+    it has to wait until after the fork.
+    """
+    if B2C_DISCOVERY_CACHE_WARM_UP:
+        from b2c_auth_playground.apps.core.services.authority_registry import warm_up_discovery_documents
+
+        warm_up_discovery_documents()
+    if B2C_CLIENT_APP_POOL_WARM_UP:
+        from b2c_auth_playground.apps.core.services.microsoft_b2c import warm_up_client_apps
+
+        warm_up_client_apps()
+
+
+def warm_up_in_background() -> None:
+    if not B2C_DISCOVERY_CACHE_WARM_UP and not B2C_CLIENT_APP_POOL_WARM_UP:
+        return
+
+    def run():
+        try:
+            warm_up()
+        except Exception:
+            logger.exception("Warm up failed, the first requests will do it")
+
+    # The worker can accept requests meanwhile; whatever is not warm yet is fetched by the request that needs it
+    threading.Thread(target=run, name="startup-warm-up", daemon=True).start()
+
+
+def start_background_work() -> None:
+    """
+    Starts what a process serving requests runs next to them: the warm ups and the health prober. Threads do not
+    survive a fork, so a preloading parent leaves this to its workers.
+    """
+    from b2c_auth_playground.apps.core.services.health import health_prober
+    from b2c_auth_playground.apps.core.services.metrics import prune_dead_processes
+
+    prune_dead_processes()
+    warm_up_in_background()
+    health_prober.ensure_started()
+
+
+def server_started() -> None:
+    """
+    Called by the WSGI and ASGI entry points, which only servers import (management commands do not). When preloading,
+    gunicorn's `post_fork` does it in each worker instead.
+    """
+    if B2C_STARTUP_MODE != "preload":
+        start_background_work()
@@ -1,39 +1,63 @@
+import logging
+import math
+
 from dataclasses import asdict
 
 import requests
 
+from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.shortcuts import render
 from django.urls import reverse
 
+from b2c_auth_playground.apps.core.services.admission import AdmissionRejected
+from b2c_auth_playground.apps.core.services.admission import client_ip
+from b2c_auth_playground.apps.core.services.admission import ropc_admission
+from b2c_auth_playground.apps.core.services.flow_state import attach_flow
+from b2c_auth_playground.apps.core.services.microsoft_b2c import TokenRequestError
 from b2c_auth_playground.apps.core.services.microsoft_b2c import authenticate
 from b2c_auth_playground.apps.core.services.microsoft_b2c import authenticate_on_hair
 from b2c_auth_playground.apps.core.services.microsoft_b2c import build_auth_code_flow
 from b2c_auth_playground.apps.core.services.microsoft_b2c import build_logout_uri
+from b2c_auth_playground.apps.core.services.page_cache import render_home_page
+from b2c_auth_playground.apps.core.services.resilience import UpstreamUnavailable
+from b2c_auth_playground.apps.core.services.token_cache_store import owner_key
+from b2c_auth_playground.apps.core.services.token_cache_store import token_cache_store
+from b2c_auth_playground.settings import B2C_ADMISSION_ENABLED
 from b2c_auth_playground.settings import B2C_AUTHORITY_PROFILE_EDITING
 from b2c_auth_playground.settings import B2C_AUTHORITY_RESOURCE_OWNER
 from b2c_auth_playground.settings import B2C_AUTHORITY_SIGN_UP_SIGN_IN
+from b2c_auth_playground.settings import B2C_FLOW_STATE_STORE
+from b2c_auth_playground.settings import B2C_HOME_PAGE_RENDERING
 from b2c_auth_playground.settings import B2C_SCOPES
 from b2c_auth_playground.settings import B2C_SCOPES_RESOURCE_OWNER
 from b2c_auth_playground.settings import B2C_YOUR_APP_RESOURCE_OWNER_APPLICATION_ID
 
+logger = logging.getLogger(__name__)
+
 
 def index(request):
     if request.method == "GET":
-        logged_user = request.session.get("user")
-        context = {}
-
-        if logged_user:
-            redirect_uri = _build_redirect_uri(request)
-            auth_flow_edit = build_auth_code_flow(authority=B2C_AUTHORITY_PROFILE_EDITING, redirect_uri=redirect_uri)
-            request.session["flow-edit"] = asdict(auth_flow_edit)
-            context["auth_flow_edit_uri"] = auth_flow_edit.auth_uri
-
-        return render(request, "core/pages/home.html", context)
+        # Read-only: the profile edit flow is only built when the user asks for it
+        if B2C_HOME_PAGE_RENDERING == "cached":
+            return HttpResponse(render_home_page(request))
+        return render(request, "core/pages/home.html")
     elif request.method == "POST":
         username, password = request.POST.get("email"), request.POST.get("password")
 
-        claims = authenticate_on_hair(username, password, B2C_SCOPES_RESOURCE_OWNER)
+        try:
+            if B2C_ADMISSION_ENABLED:
+                ropc_admission.check_rate(client_ip(request), username)
+                with ropc_admission.upstream_slot():
+                    claims = authenticate_on_hair(username, password, B2C_SCOPES_RESOURCE_OWNER)
+            else:
+                claims = authenticate_on_hair(username, password, B2C_SCOPES_RESOURCE_OWNER)
+        except AdmissionRejected as e:
+            return _rejected(e)
+        except UpstreamUnavailable as e:
+            return _upstream_unavailable(e)
+        except TokenRequestError as e:
+            return _login_failed(e)
 
         # This one is not working! MSAL problem or did I make something wrong? 🤔
         # result = authenticate(username, password, B2C_SCOPES_RESOURCE_OWNER)
@@ -45,6 +69,11 @@ def index(request):
 
 
 def logout(request):
+    token_cache_account = request.session.get("token_cache_account")
+    token_cache_partition = request.session.get("token_cache_partition")
+    # Only this session's tokens: the account may be signed in elsewhere too
+    if token_cache_account and token_cache_partition:
+        token_cache_store().delete_account(owner_key(token_cache_account, token_cache_partition))
     request.session.flush()
     index_request_path = reverse("index")
     redirect_uri = request.build_absolute_uri(index_request_path)
@@ -59,11 +88,54 @@ def initiate_login_flow(request):
         authority=B2C_AUTHORITY_SIGN_UP_SIGN_IN, scopes=B2C_SCOPES, redirect_uri=redirect_uri
     )
     # So we can retrieve it later
+    if B2C_FLOW_STATE_STORE == "cookie":
+        return attach_flow(request, redirect(auth_flow_details.auth_uri), asdict(auth_flow_details))
     request.session["flow"] = asdict(auth_flow_details)
     # Then we redirect the user
     return redirect(auth_flow_details.auth_uri)
 
 
+def initiate_profile_edit_flow(request):
+    if not request.session.get("user"):
+        return redirect(reverse("index"))
+    redirect_uri = _build_redirect_uri(request)
+    auth_flow_edit = build_auth_code_flow(authority=B2C_AUTHORITY_PROFILE_EDITING, redirect_uri=redirect_uri)
+    if B2C_FLOW_STATE_STORE == "cookie":
+        return attach_flow(request, redirect(auth_flow_edit.auth_uri), asdict(auth_flow_edit))
+    request.session["flow-edit"] = asdict(auth_flow_edit)
+    return redirect(auth_flow_edit.auth_uri)
+
+
+def _rejected(rejection: AdmissionRejected) -> HttpResponse:
+    if rejection.status == 429:
+        message = "Too many login attempts, try again later."
+    else:
+        message = "We are too busy to sign you in right now, try again in a moment."
+    response = HttpResponse(message, status=rejection.status, content_type="text/plain; charset=utf-8")
+    response["Retry-After"] = str(rejection.retry_after)
+    return response
+
+
+def _upstream_unavailable(error: UpstreamUnavailable) -> HttpResponse:
+    logger.warning("Could not sign in through B2C: %s", error)
+    response = HttpResponse(
+        "We cannot reach the sign in service right now, try again in a moment.",
+        status=503,
+        content_type="text/plain; charset=utf-8",
+    )
+    response["Retry-After"] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+
+def _login_failed(error: TokenRequestError) -> HttpResponse:
+    logger.info("B2C refused the credentials: %s", error)
+    if error.status_code >= 500:
+        return HttpResponse(
+            "The sign in service failed, try again later.", status=502, content_type="text/plain; charset=utf-8"
+        )
+    return HttpResponse("Invalid e-mail or password.", status=401, content_type="text/plain; charset=utf-8")
+
+
 def _build_redirect_uri(request):
     location_redirect = reverse("v1/response-oidc")
     redirect_uri = request.build_absolute_uri(location_redirect)
@@ -0,0 +1,108 @@
+from dataclasses import asdict
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.shortcuts import redirect
+from django.shortcuts import render
+from django.urls import reverse
+
+from b2c_auth_playground.apps.core.services.admission import AdmissionRejected
+from b2c_auth_playground.apps.core.services.admission import client_ip
+from b2c_auth_playground.apps.core.services.admission import ropc_admission
+from b2c_auth_playground.apps.core.services.flow_state import attach_flow
+from b2c_auth_playground.apps.core.services.microsoft_b2c import TokenRequestError
+from b2c_auth_playground.apps.core.services.microsoft_b2c import build_logout_uri
+from b2c_auth_playground.apps.core.services.microsoft_b2c_async import authenticate_on_hair_async
+from b2c_auth_playground.apps.core.services.microsoft_b2c_async import build_auth_code_flow_async
+from b2c_auth_playground.apps.core.services.page_cache import render_home_page
+from b2c_auth_playground.apps.core.services.resilience import UpstreamUnavailable
+from b2c_auth_playground.apps.core.services.token_cache_store import owner_key
+from b2c_auth_playground.apps.core.services.token_cache_store import token_cache_store
+from b2c_auth_playground.apps.core.views import _build_redirect_uri
+from b2c_auth_playground.apps.core.views import _login_failed
+from b2c_auth_playground.apps.core.views import _rejected
+from b2c_auth_playground.apps.core.views import _upstream_unavailable
+from b2c_auth_playground.settings import B2C_ADMISSION_ENABLED
+from b2c_auth_playground.settings import B2C_AUTHORITY_PROFILE_EDITING
+from b2c_auth_playground.settings import B2C_AUTHORITY_SIGN_UP_SIGN_IN
+from b2c_auth_playground.settings import B2C_FLOW_STATE_STORE
+from b2c_auth_playground.settings import B2C_HOME_PAGE_RENDERING
+from b2c_auth_playground.settings import B2C_SCOPES
+from b2c_auth_playground.settings import B2C_SCOPES_RESOURCE_OWNER
+
+# Same pages as `views`, but they never block the event loop while talking to B2C.
+# Session values are read with the async API first, so the template finds them already loaded.
+
+
+async def index(request):
+    if request.method == "GET":
+        # Loads the session so the template does not hit the database from the event loop
+        await request.session.aget("user")
+        if B2C_HOME_PAGE_RENDERING == "cached":
+            return HttpResponse(render_home_page(request))
+        return render(request, "core/pages/home.html")
+    elif request.method == "POST":
+        username, password = request.POST.get("email"), request.POST.get("password")
+
+        try:
+            if B2C_ADMISSION_ENABLED:
+                # The buckets may live in SQLite, so they are not checked from the event loop
+                await sync_to_async(ropc_admission.check_rate, thread_sensitive=False)(client_ip(request), username)
+                async with ropc_admission.upstream_slot_async():
+                    claims = await authenticate_on_hair_async(username, password, B2C_SCOPES_RESOURCE_OWNER)
+            else:
+                claims = await authenticate_on_hair_async(username, password, B2C_SCOPES_RESOURCE_OWNER)
+        except AdmissionRejected as e:
+            return _rejected(e)
+        except UpstreamUnavailable as e:
+            return _upstream_unavailable(e)
+        except TokenRequestError as e:
+            return _login_failed(e)
+
+        await request.session.aset("user", claims)
+        location_index = reverse("index")
+        return redirect(location_index)
+    else:
+        raise NotImplementedError
+
+
+async def logout(request):
+    token_cache_account = await request.session.aget("token_cache_account")
+    token_cache_partition = await request.session.aget("token_cache_partition")
+    # Only this session's tokens: the account may be signed in elsewhere too
+    if token_cache_account and token_cache_partition:
+        owner = owner_key(token_cache_account, token_cache_partition)
+        # Opening the store and deleting from it are SQLite calls, kept off the event loop
+        await sync_to_async(lambda: token_cache_store().delete_account(owner))()
+    await request.session.aflush()
+    index_request_path = reverse("index")
+    redirect_uri = request.build_absolute_uri(index_request_path)
+    redirect_uri = redirect_uri.replace("http", "https") if "localhost" not in redirect_uri else redirect_uri
+    final_address = build_logout_uri(redirect_uri)
+    return redirect(final_address)
+
+
+async def initiate_login_flow(request):
+    redirect_uri = _build_redirect_uri(request)
+    auth_flow_details = await build_auth_code_flow_async(
+        authority=B2C_AUTHORITY_SIGN_UP_SIGN_IN, scopes=B2C_SCOPES, redirect_uri=redirect_uri
+    )
+    # So we can retrieve it later
+    if B2C_FLOW_STATE_STORE == "cookie":
+        return attach_flow(request, redirect(auth_flow_details.auth_uri), asdict(auth_flow_details))
+    await request.session.aset("flow", asdict(auth_flow_details))
+    # Then we redirect the user
+    return redirect(auth_flow_details.auth_uri)
+
+
+async def initiate_profile_edit_flow(request):
+    if not await request.session.aget("user"):
+        return redirect(reverse("index"))
+    redirect_uri = _build_redirect_uri(request)
+    auth_flow_edit = await build_auth_code_flow_async(
+        authority=B2C_AUTHORITY_PROFILE_EDITING, redirect_uri=redirect_uri
+    )
+    if B2C_FLOW_STATE_STORE == "cookie":
+        return attach_flow(request, redirect(auth_flow_edit.auth_uri), asdict(auth_flow_edit))
+    await request.session.aset("flow-edit", asdict(auth_flow_edit))
+    return redirect(auth_flow_edit.auth_uri)
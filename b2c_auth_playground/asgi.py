@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'b2c_auth_playground.settings')
 
 application = get_asgi_application()
+
+from b2c_auth_playground.apps.core.startup import server_started  # noqa: E402 (needs the apps loaded)
+
+server_started()
@@ -1,3 +1,4 @@
+import json
 import os
 
 from logging import Formatter
@@ -15,7 +16,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = "django-insecure-c=%dkk#bxs_og2!=q@en!en)(412xa$oueg%8aofr!m*26ad=("
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Without debug, pages link to the hashed static files, so `python manage.py collectstatic` must have run first
+DEBUG = os.getenv("DJANGO_DEBUG", "true").lower() == "true"
 
 ALLOWED_HOSTS = ["*"]
 
@@ -34,8 +36,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "b2c_auth_playground.apps.core.middleware.SamplingProfilerMiddleware",
+    "b2c_auth_playground.apps.core.middleware.RequestDeadlineMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "b2c_auth_playground.apps.core.middleware.StaticAssetsMiddleware",
+    "b2c_auth_playground.apps.core.middleware.TimedSessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -70,7 +75,7 @@ WSGI_APPLICATION = "b2c_auth_playground.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.getenv("DATABASE_PATH", BASE_DIR / "db.sqlite3"),
     }
 }
 
@@ -111,6 +116,29 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/topics/logging/
 
 
+# "sync" writes each record from the thread that logs it; "async" only puts it in a queue of B2C_LOG_QUEUE_SIZE records
+# that a background thread writes, dropping records when it is full. B2C_LOG_FORMAT is "plain" or "json" (one object
+# per line). B2C_LOG_RATE_LIMITS thins out records below WARNING, as JSON mapping logger names to {"sample": 0.1} or
+# {"per_second": 5, "burst": 10} (per message template)
+B2C_LOG_MODE = os.getenv("B2C_LOG_MODE", "sync")
+B2C_LOG_FORMAT = os.getenv("B2C_LOG_FORMAT", "plain")
+B2C_LOG_QUEUE_SIZE = int(os.getenv("B2C_LOG_QUEUE_SIZE", 10_000))
+B2C_LOG_RATE_LIMITS = json.loads(
+    os.getenv(
+        "B2C_LOG_RATE_LIMITS",
+        json.dumps(
+            {
+                # Lines written on every login
+                "b2c_auth_playground.apps.core.services.microsoft_b2c": {"per_second": 5, "burst": 10},
+                "b2c_auth_playground.apps.core.services.microsoft_b2c_async": {"per_second": 5, "burst": 10},
+                "b2c_auth_playground.apps.core.api.v1": {"per_second": 5, "burst": 10},
+            }
+        ),
+    )
+)
+
+LOG_HANDLER = "queue" if B2C_LOG_MODE == "async" else "console"
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -119,29 +147,73 @@ LOGGING = {
             "()": Formatter,
             "format": "%(asctime)s - level=%(levelname)s - %(name)s - %(message)s",
         },
+        "json": {
+            "()": "b2c_auth_playground.support.structured_logging.JsonFormatter",
+        },
+    },
+    "filters": {
+        "rate_limit": {
+            "()": "b2c_auth_playground.support.structured_logging.RateLimitFilter",
+            "rules": B2C_LOG_RATE_LIMITS,
+        },
     },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
-            "formatter": "standard",
-        }
+            "formatter": "json" if B2C_LOG_FORMAT == "json" else "standard",
+            "filters": ["rate_limit"],
+        },
     },
     "loggers": {
-        "": {"level": os.getenv("ROOT_LOG_LEVEL", "INFO"), "handlers": ["console"]},
+        "": {"level": os.getenv("ROOT_LOG_LEVEL", "INFO"), "handlers": [LOG_HANDLER]},
         "b2c_auth_playground": {
-            "level": os.getenv("PROJECT_LOG_LEVEL", "DEBUG"),
-            "handlers": ["console"],
+            "level": os.getenv("PROJECT_LOG_LEVEL", "INFO"),
+            "handlers": [LOG_HANDLER],
             "propagate": False,
         },
-        "django": {"level": os.getenv("DJANGO_LOG_LEVEL", "INFO"), "handlers": ["console"]},
-        "django.db.backends": {"level": os.getenv("DJANGO_DB_BACKENDS_LOG_LEVEL", "INFO"), "handlers": ["console"]},
+        "django": {"level": os.getenv("DJANGO_LOG_LEVEL", "INFO"), "handlers": [LOG_HANDLER]},
+        "django.db.backends": {"level": os.getenv("DJANGO_DB_BACKENDS_LOG_LEVEL", "INFO"), "handlers": [LOG_HANDLER]},
     },
 }
+if B2C_LOG_MODE == "async":
+    # Only built in this mode, as it starts the listener thread
+    LOGGING["handlers"]["queue"] = {
+        "class": "b2c_auth_playground.support.structured_logging.QueueStreamHandler",
+        "formatter": "json" if B2C_LOG_FORMAT == "json" else "standard",
+        "filters": ["rate_limit"],
+        "max_size": B2C_LOG_QUEUE_SIZE,
+    }
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/authentication/
+
+REST_FRAMEWORK = {
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        # Bearer tokens of our user flows come first, so API calls carrying one never read the session
+        "b2c_auth_playground.apps.core.api.authentication.B2CBearerAuthentication",
+        "rest_framework.authentication.SessionAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+    ],
+}
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
 STATIC_URL = "/static/"
+STATIC_ROOT = os.getenv("STATIC_ROOT", str(BASE_DIR / "staticfiles"))
+# `collectstatic` names every file after a hash of its content and writes gzip (and brotli, when the `brotli` package
+# is installed) variants of the text ones next to it. Templates must go through `{% static %}` to get the hashed name.
+# With DJANGO_DEBUG=false, that name comes from the manifest `collectstatic` writes: run it on every deploy, or pages
+# fail with "Missing staticfiles manifest entry". With debug on, pages link to the files by their plain names.
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "b2c_auth_playground.support.static_assets.PrecompressedManifestStaticFilesStorage"},
+}
+# The app serves STATIC_ROOT itself (see `StaticAssetsMiddleware`) in the best encoding the browser accepts. Hashed
+# names never change content, so browsers keep them for a year without asking again; other files, such as the ones
+# a page without `{% static %}` links to, are kept for B2C_STATIC_MAX_AGE seconds.
+B2C_STATIC_SERVE = os.getenv("B2C_STATIC_SERVE", "true").lower() == "true"
+B2C_STATIC_MAX_AGE = int(os.getenv("B2C_STATIC_MAX_AGE", 60))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -152,7 +224,10 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Custom settings for B2C
 
 B2B_TENANT = "xptoorg"
-authority_template = f"https://{B2B_TENANT}.b2clogin.com/{B2B_TENANT}.onmicrosoft.com/{{user_flow}}"
+# It can point to another tenant, or to `benchmarks/fake_b2c.py`
+authority_template = os.getenv(
+    "B2C_AUTHORITY_TEMPLATE", f"https://{B2B_TENANT}.b2clogin.com/{B2B_TENANT}.onmicrosoft.com/{{user_flow}}"
+)
 
 # In order to communicate with MS
 
@@ -196,3 +271,181 @@ USER_FLOWS_RESOURCE_OWNER = "B2C_1_resource-owner"
 B2C_AUTHORITY_SIGN_UP_SIGN_IN = authority_template.format(user_flow=USER_FLOWS_SIGN_UP_SIGN_IN)
 B2C_AUTHORITY_PROFILE_EDITING = authority_template.format(user_flow=USER_FLOWS_PROFILE_EDITING)
 B2C_AUTHORITY_RESOURCE_OWNER = authority_template.format(user_flow=USER_FLOWS_RESOURCE_OWNER)
+
+# Bearer tokens are accepted when their audience is the app itself (id tokens) or one of these APIs (access tokens
+# issued for the scopes of an API, such as the one in B2C_SCOPES), given as a comma-separated list of application ids
+B2C_API_AUDIENCES = [audience for audience in os.getenv("B2C_API_AUDIENCES", "").split(",") if audience]
+
+# Tenants and user flows the app works with, each user flow with the app registration that uses it and, optionally,
+# the `audiences` its tokens may have (only its client id otherwise). More of them can come from B2C_TENANTS_FILE, a
+# JSON file with a list like this one
+B2C_TENANTS = [
+    {
+        "name": B2B_TENANT,
+        "authority_template": authority_template,
+        "user_flows": [
+            {
+                "name": USER_FLOWS_SIGN_UP_SIGN_IN,
+                "client_id": B2C_YOUR_APP_CLIENT_APPLICATION_ID,
+                "client_credential": B2C_YOUR_APP_CLIENT_CREDENTIAL,
+                "audiences": [B2C_YOUR_APP_CLIENT_APPLICATION_ID, *B2C_API_AUDIENCES],
+            },
+            {
+                "name": USER_FLOWS_PROFILE_EDITING,
+                "client_id": B2C_YOUR_APP_CLIENT_APPLICATION_ID,
+                "client_credential": B2C_YOUR_APP_CLIENT_CREDENTIAL,
+            },
+            {
+                "name": USER_FLOWS_RESOURCE_OWNER,
+                "client_id": B2C_YOUR_APP_RESOURCE_OWNER_APPLICATION_ID,
+                "client_credential": B2C_YOUR_APP_RESOURCE_CLIENT_CREDENTIAL,
+            },
+        ],
+    }
+]
+B2C_TENANTS_FILE = os.getenv("B2C_TENANTS_FILE")
+
+# "lazy" boots workers without importing MSAL, PyJWT or the HTTP clients; they are imported by the first request that
+# needs them, and warm ups run in the background. "preload" imports them when the app is loaded, for gunicorn's
+# preload_app: the parent loads once, the forked workers share it, and each worker warms up after the fork. Either way
+# only server processes warm up, never management commands
+B2C_STARTUP_MODE = os.getenv("B2C_STARTUP_MODE", "lazy")
+
+# Client apps are kept in a process-wide pool. Warming it up means authority discovery happens during boot
+B2C_CLIENT_APP_POOL_WARM_UP = os.getenv("B2C_CLIENT_APP_POOL_WARM_UP", "false").lower() == "true"
+
+# OpenID configuration of each authority is kept in files shared by the worker processes of the node. It is served
+# as is for B2C_DISCOVERY_CACHE_TTL seconds, then for B2C_DISCOVERY_CACHE_STALE_TTL more while it is refreshed in the
+# background. Warming it up means the documents are ready when the app is loaded
+B2C_DISCOVERY_CACHE_DIR = os.getenv("B2C_DISCOVERY_CACHE_DIR", str(BASE_DIR / "discovery_cache"))
+B2C_DISCOVERY_CACHE_TTL = float(os.getenv("B2C_DISCOVERY_CACHE_TTL", 6 * 60 * 60))
+B2C_DISCOVERY_CACHE_STALE_TTL = float(os.getenv("B2C_DISCOVERY_CACHE_STALE_TTL", 24 * 60 * 60))
+B2C_DISCOVERY_CACHE_WARM_UP = os.getenv("B2C_DISCOVERY_CACHE_WARM_UP", "true").lower() == "true"
+
+# Signing keys of each authority are cached locally and refreshed in the background (values in seconds)
+B2C_JWKS_REFRESH_INTERVAL = int(os.getenv("B2C_JWKS_REFRESH_INTERVAL", 60 * 60))
+B2C_JWKS_UNKNOWN_KID_MIN_INTERVAL = int(os.getenv("B2C_JWKS_UNKNOWN_KID_MIN_INTERVAL", 5 * 60))
+
+# Shared HTTP transport used for every call to B2C (timeouts and DNS TTL in seconds)
+B2C_HTTP_POOL_CONNECTIONS = int(os.getenv("B2C_HTTP_POOL_CONNECTIONS", 10))
+B2C_HTTP_POOL_MAXSIZE = int(os.getenv("B2C_HTTP_POOL_MAXSIZE", 20))
+B2C_HTTP_CONNECT_TIMEOUT = float(os.getenv("B2C_HTTP_CONNECT_TIMEOUT", 3.05))
+B2C_HTTP_READ_TIMEOUT = float(os.getenv("B2C_HTTP_READ_TIMEOUT", 10))
+B2C_HTTP_DNS_CACHE_TTL = int(os.getenv("B2C_HTTP_DNS_CACHE_TTL", 60))
+
+# Calls to the token endpoint go through a resilience layer. Each request has B2C_REQUEST_DEADLINE seconds for all
+# of its calls to B2C (0 for none). Transient failures are retried up to B2C_RETRY_MAX_ATTEMPTS attempts, with a
+# jittered backoff between B2C_RETRY_BASE_DELAY and B2C_RETRY_MAX_DELAY seconds, when the grant is idempotent.
+# B2C_CIRCUIT_FAILURE_THRESHOLD failures in a row fail the calls to that authority fast for B2C_CIRCUIT_OPEN_SECONDS
+B2C_REQUEST_DEADLINE = float(os.getenv("B2C_REQUEST_DEADLINE", 15))
+B2C_RETRY_MAX_ATTEMPTS = int(os.getenv("B2C_RETRY_MAX_ATTEMPTS", 3))
+B2C_RETRY_BASE_DELAY = float(os.getenv("B2C_RETRY_BASE_DELAY", 0.2))
+B2C_RETRY_MAX_DELAY = float(os.getenv("B2C_RETRY_MAX_DELAY", 2))
+B2C_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("B2C_CIRCUIT_FAILURE_THRESHOLD", 5))
+B2C_CIRCUIT_OPEN_SECONDS = float(os.getenv("B2C_CIRCUIT_OPEN_SECONDS", 30))
+# Hedging sends a second request when an idempotent one is slower than the B2C_HEDGE_PERCENTILE of the recent ones
+# (once there are B2C_HEDGE_MIN_SAMPLES of them), for at most B2C_HEDGE_MAX_RATIO of the calls
+B2C_HEDGING_ENABLED = os.getenv("B2C_HEDGING_ENABLED", "false").lower() == "true"
+B2C_HEDGE_PERCENTILE = float(os.getenv("B2C_HEDGE_PERCENTILE", 95))
+B2C_HEDGE_MIN_SAMPLES = int(os.getenv("B2C_HEDGE_MIN_SAMPLES", 20))
+B2C_HEDGE_MAX_RATIO = float(os.getenv("B2C_HEDGE_MAX_RATIO", 0.1))
+B2C_HEDGE_THREADS = int(os.getenv("B2C_HEDGE_THREADS", 16))
+
+# Where MSAL token caches live: "session" keeps the whole serialized cache in the Django session, "partitioned" keeps
+# entries per account and credential type in a local store and only a pointer in the session
+B2C_TOKEN_CACHE_BACKEND = os.getenv("B2C_TOKEN_CACHE_BACKEND", "partitioned")
+B2C_TOKEN_CACHE_STORE_PATH = os.getenv("B2C_TOKEN_CACHE_STORE_PATH", str(BASE_DIR / "token_cache.sqlite3"))
+B2C_TOKEN_CACHE_LRU_SIZE = int(os.getenv("B2C_TOKEN_CACHE_LRU_SIZE", 1024))
+B2C_TOKEN_CACHE_LRU_TTL = float(os.getenv("B2C_TOKEN_CACHE_LRU_TTL", 5))
+# How the cache is written when it is kept in the session: "compact" (interned and compressed) or "json"
+B2C_TOKEN_CACHE_CODEC = os.getenv("B2C_TOKEN_CACHE_CODEC", "compact")
+
+# "sync" serves pages and APIs with the regular views, "async" with the ones in `views_async`/`api_views_async`
+# (run it behind an ASGI server such as uvicorn). MSAL calls of the async stack run in a dedicated thread pool
+B2C_VIEW_STACK = os.getenv("B2C_VIEW_STACK", "sync")
+B2C_ASYNC_MSAL_THREADS = int(os.getenv("B2C_ASYNC_MSAL_THREADS", 64))
+
+# "cached" answers GET / out of skeletons of the home page, one per state (anonymous or signed in), rendered once per
+# process, filling in the CSRF token and the user's name on each request (see `page_cache`). "template" renders the
+# template every time. Either way templates come from Django's cached loader, which it uses unless told otherwise
+B2C_HOME_PAGE_RENDERING = os.getenv("B2C_HOME_PAGE_RENDERING", "cached")
+
+# The health check answers from what a background prober last saw (values in seconds)
+B2C_HEALTH_CHECK_INTERVAL = float(os.getenv("B2C_HEALTH_CHECK_INTERVAL", 10))
+B2C_HEALTH_CHECK_TIMEOUT = float(os.getenv("B2C_HEALTH_CHECK_TIMEOUT", 2))
+
+# Access tokens expiring within the window (seconds) are refreshed by a background pool while the request keeps the
+# cached one. It needs B2C_TOKEN_CACHE_BACKEND=partitioned, as the background worker has no session to write to
+B2C_REFRESH_AHEAD_ENABLED = os.getenv("B2C_REFRESH_AHEAD_ENABLED", "false").lower() == "true"
+B2C_REFRESH_AHEAD_WINDOW = float(os.getenv("B2C_REFRESH_AHEAD_WINDOW", 10 * 60))
+B2C_REFRESH_AHEAD_CONCURRENCY = int(os.getenv("B2C_REFRESH_AHEAD_CONCURRENCY", 4))
+B2C_REFRESH_AHEAD_JITTER = float(os.getenv("B2C_REFRESH_AHEAD_JITTER", 5))
+B2C_REFRESH_AHEAD_MAX_PENDING = int(os.getenv("B2C_REFRESH_AHEAD_MAX_PENDING", 1000))
+
+# Concurrent refreshes of the same account are coalesced: threads share one result and worker processes of the node
+# take turns through a lease (TTL in seconds) kept in a local SQLite file. Only token caches kept in the store are, as
+# one kept in the session belongs to its request. With no B2C_SCOPES there is no access token to refresh, and a valid
+# cached id token is the answer instead of redeeming the refresh token again
+B2C_TOKEN_REFRESH_COALESCING = os.getenv("B2C_TOKEN_REFRESH_COALESCING", "true").lower() == "true"
+B2C_LEASE_STORE_PATH = os.getenv("B2C_LEASE_STORE_PATH", str(BASE_DIR / "leases.sqlite3"))
+B2C_REFRESH_LEASE_TTL = float(os.getenv("B2C_REFRESH_LEASE_TTL", 30))
+
+# Where the auth code flow (state, nonce, PKCE verifier) waits for the callback: "session", or "cookie" for an
+# encrypted and signed cookie that expires after B2C_FLOW_STATE_TTL seconds and needs no session write
+B2C_FLOW_STATE_STORE = os.getenv("B2C_FLOW_STATE_STORE", "cookie")
+B2C_FLOW_STATE_TTL = int(os.getenv("B2C_FLOW_STATE_TTL", 10 * 60))
+B2C_FLOW_STATE_SEEN_SIZE = int(os.getenv("B2C_FLOW_STATE_SEEN_SIZE", 100_000))
+
+# Tokens sent to the introspection endpoint are verified by this many threads, at most B2C_INTROSPECTION_MAX_TOKENS
+# per request. Only authenticated callers may use it, each at most B2C_INTROSPECTION_RATE requests (a DRF rate such as
+# "60/min", counted by each worker process)
+B2C_INTROSPECTION_THREADS = int(os.getenv("B2C_INTROSPECTION_THREADS", os.cpu_count() or 4))
+B2C_INTROSPECTION_MAX_TOKENS = int(os.getenv("B2C_INTROSPECTION_MAX_TOKENS", 500))
+B2C_INTROSPECTION_RATE = os.getenv("B2C_INTROSPECTION_RATE", "60/min")
+
+# Admission control of the ROPC login form: token buckets per client IP and per username (shared by the workers of the
+# node with "sqlite", or per process with "memory") answer 429, and at most B2C_ADMISSION_MAX_IN_FLIGHT calls to the
+# token endpoint per process are in flight, with B2C_ADMISSION_MAX_QUEUED more waiting up to
+# B2C_ADMISSION_QUEUE_TIMEOUT seconds before a 503
+B2C_ADMISSION_ENABLED = os.getenv("B2C_ADMISSION_ENABLED", "true").lower() == "true"
+B2C_ADMISSION_STORE = os.getenv("B2C_ADMISSION_STORE", "sqlite")
+B2C_ADMISSION_STORE_PATH = os.getenv("B2C_ADMISSION_STORE_PATH", str(BASE_DIR / "admission.sqlite3"))
+B2C_ADMISSION_IP_PER_MINUTE = float(os.getenv("B2C_ADMISSION_IP_PER_MINUTE", 30))
+B2C_ADMISSION_IP_BURST = float(os.getenv("B2C_ADMISSION_IP_BURST", 10))
+B2C_ADMISSION_USERNAME_PER_MINUTE = float(os.getenv("B2C_ADMISSION_USERNAME_PER_MINUTE", 6))
+B2C_ADMISSION_USERNAME_BURST = float(os.getenv("B2C_ADMISSION_USERNAME_BURST", 5))
+B2C_ADMISSION_MAX_IN_FLIGHT = int(os.getenv("B2C_ADMISSION_MAX_IN_FLIGHT", 16))
+B2C_ADMISSION_MAX_QUEUED = int(os.getenv("B2C_ADMISSION_MAX_QUEUED", 32))
+B2C_ADMISSION_QUEUE_TIMEOUT = float(os.getenv("B2C_ADMISSION_QUEUE_TIMEOUT", 2))
+# Take the client IP from X-Forwarded-For; only when proxies we trust set it. Each proxy appends the address it got the
+# request from, and anything left of what ours appended comes from the client, so with B2C_ADMISSION_TRUSTED_PROXIES
+# proxies in front of the app the client IP is that many entries from the right
+B2C_ADMISSION_TRUST_X_FORWARDED_FOR = os.getenv("B2C_ADMISSION_TRUST_X_FORWARDED_FOR", "false").lower() == "true"
+B2C_ADMISSION_TRUSTED_PROXIES = int(os.getenv("B2C_ADMISSION_TRUSTED_PROXIES", 1))
+
+# Claims of tokens we already verified are kept until the token expires, in an LRU split in shards so threads do not
+# wait on each other
+B2C_CLAIMS_CACHE_ENABLED = os.getenv("B2C_CLAIMS_CACHE_ENABLED", "true").lower() == "true"
+B2C_CLAIMS_CACHE_SIZE = int(os.getenv("B2C_CLAIMS_CACHE_SIZE", 10_000))
+B2C_CLAIMS_CACHE_SHARDS = int(os.getenv("B2C_CLAIMS_CACHE_SHARDS", 16))
+
+# Latency of each stage of the authentication pipeline and errors returned by B2C, served at /metrics to staff users
+# (or to anyone with B2C_METRICS_PUBLIC, for a scraper on a private network). With several worker processes, each
+# writes them to the PROMETHEUS_MULTIPROC_DIR directory so the endpoint adds all of them up. prometheus_client reads it
+# once, when it is imported, so it has to be in the environment of the server: `gunicorn.conf.py` sets it (and empties
+# the directory when gunicorn starts); for uvicorn workers, export it. Without it each process only reports its own
+B2C_METRICS_ENABLED = os.getenv("B2C_METRICS_ENABLED", "true").lower() == "true"
+B2C_METRICS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+B2C_METRICS_PUBLIC = os.getenv("B2C_METRICS_PUBLIC", "false").lower() == "true"
+
+# Requests can be profiled by a sampling profiler: the ones with a signed `X-B2C-Profile` header (`python manage.py
+# profile_token` gives one, valid for B2C_PROFILER_TOKEN_MAX_AGE seconds), and, when the threshold is above zero, the
+# ones under B2C_PROFILER_PATHS slower than it. Each process keeps its last B2C_PROFILER_BUFFER_SIZE profiles, staff
+# users download them from /profiles
+B2C_PROFILER_ENABLED = os.getenv("B2C_PROFILER_ENABLED", "false").lower() == "true"
+B2C_PROFILER_THRESHOLD_MS = float(os.getenv("B2C_PROFILER_THRESHOLD_MS", 0))
+B2C_PROFILER_PATHS = tuple(os.getenv("B2C_PROFILER_PATHS", "/api/").split(","))
+B2C_PROFILER_INTERVAL = float(os.getenv("B2C_PROFILER_INTERVAL", 0.005))
+B2C_PROFILER_MAX_DEPTH = int(os.getenv("B2C_PROFILER_MAX_DEPTH", 128))
+B2C_PROFILER_BUFFER_SIZE = int(os.getenv("B2C_PROFILER_BUFFER_SIZE", 50))
+B2C_PROFILER_TOKEN_MAX_AGE = int(os.getenv("B2C_PROFILER_TOKEN_MAX_AGE", 60 * 60))
@@ -0,0 +1,47 @@
+import importlib
+import threading
+
+from asgiref.sync import markcoroutinefunction
+
+
+class LazyView:
+    """
+    Stands for the view at `dotted_path` in a URL conf and only imports its module on the first request that needs
+    it, so a worker that only answers the health check never imports MSAL or PyJWT.
+
+    Attributes Django or DRF read from the view at request time (such as `csrf_exempt`) come from the real view.
+    `view_class` is the exception: Django asks for it when it builds the reverse lookup table, which must not import
+    anything. Async views have to be declared as such, as Django checks that before calling them.
+    """
+
+    def __init__(self, dotted_path: str, is_async: bool = False):
+        self._module_path, self.__name__ = dotted_path.rsplit(".", 1)
+        self.__qualname__ = self.__name__
+        self.__module__ = self._module_path
+        self._view = None
+        self._lock = threading.Lock()
+        if is_async:
+            markcoroutinefunction(self)
+
+    def _load(self):
+        if self._view is None:
+            with self._lock:
+                if self._view is None:
+                    self._view = getattr(importlib.import_module(self._module_path), self.__name__)
+        return self._view
+
+    def __call__(self, request, *args, **kwargs):
+        return self._load()(request, *args, **kwargs)
+
+    def __getattr__(self, name):
+        # Private names include the coroutine markers asgiref and inspect look for
+        if name.startswith("_") or name == "view_class":
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return f"<LazyView {self._module_path}.{self.__name__}>"
+
+
+def lazy_view(dotted_path: str, is_async: bool = False) -> LazyView:
+    return LazyView(dotted_path, is_async)
@@ -0,0 +1,186 @@
+import gzip
+import json
+import mimetypes
+import os
+import threading
+
+from dataclasses import dataclass
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.http import FileResponse
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are built
+    brotli = None
+
+# Suffix of the precompressed variant of each encoding, best first
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+COMPRESSIBLE_EXTENSIONS = {".css", ".eot", ".html", ".ico", ".js", ".json", ".map", ".mjs", ".svg", ".ttf", ".txt"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    # No timestamp, so the same file always gives the same bytes
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Django's manifest storage, which gives each file a name with a hash of its content, plus a gzip and, when the
+    `brotli` package is installed, a brotli variant next to every text file it collects (`main.1a2b3c.js.gz`). A
+    variant is only kept when it is noticeably smaller than the file.
+    """
+
+    min_size = 256
+    min_saving = 0.05
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+            if not isinstance(processed, Exception):
+                names.update((name, hashed_name))
+        if dry_run:
+            return
+        for name in sorted(names):
+            if name and os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+                self._write_variants(name)
+
+    def _write_variants(self, name: str) -> None:
+        path = self.path(name)
+        with open(path, "rb") as file:
+            data = file.read()
+        for encoding, suffix in ENCODINGS.items():
+            variant = path + suffix
+            compressed = None
+            if len(data) >= self.min_size and (encoding != "br" or brotli):
+                compressed = _compress(data, encoding)
+            if compressed is not None and len(compressed) <= len(data) * (1 - self.min_saving):
+                with open(variant, "wb") as file:
+                    file.write(compressed)
+            elif os.path.exists(variant):
+                # Left by an earlier collect of a file that changed since
+                os.remove(variant)
+
+
+@dataclass(frozen=True)
+class StaticAsset:
+    content_type: str
+    immutable: bool
+    # Encoding ("identity", "br" or "gzip") to the path of the file holding it
+    paths: Dict[str, str]
+    etag: str
+
+
+def accepted_encodings(accept_encoding: str) -> List[str]:
+    """
+    The encodings of `ENCODINGS` the `Accept-Encoding` header allows, best first, then `identity`.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, parameters = part.strip().partition(";")
+        weight = 1.0
+        if parameters.strip().startswith("q="):
+            try:
+                weight = float(parameters.strip()[2:])
+            except ValueError:
+                weight = 0.0
+        if coding:
+            weights[coding.strip().lower()] = weight
+    default = weights.get("*", 0.0)
+    return [encoding for encoding in ENCODINGS if weights.get(encoding, default) > 0] + ["identity"]
+
+
+class StaticAssetIndex:
+    """
+    What `collectstatic` left in `root`, read once on the first lookup: for each file, its variants and whether its
+    name carries a content hash (it is in the manifest), in which case it can be cached forever.
+    """
+
+    def __init__(self, root: str, manifest_name: str = ManifestStaticFilesStorage.manifest_name):
+        self._root = str(root)
+        self._manifest_name = manifest_name
+        self._assets: Optional[Dict[str, StaticAsset]] = None
+        self._lock = threading.Lock()
+
+    def find(self, name: str) -> Optional[StaticAsset]:
+        if self._assets is None:
+            with self._lock:
+                if self._assets is None:
+                    self._assets = self._scan()
+        return self._assets.get(name)
+
+    def _hashed_names(self) -> set:
+        try:
+            with open(os.path.join(self._root, self._manifest_name), encoding="utf-8") as file:
+                return set(json.load(file).get("paths", {}).values())
+        except (OSError, ValueError):
+            return set()
+
+    def _scan(self) -> Dict[str, StaticAsset]:
+        hashed_names = self._hashed_names()
+        assets = {}
+        suffixes = tuple(ENCODINGS.values())
+        for directory, _, files in os.walk(self._root):
+            for file_name in files:
+                if file_name.endswith(suffixes):
+                    continue
+                path = os.path.join(directory, file_name)
+                name = os.path.relpath(path, self._root).replace(os.sep, "/")
+                paths = {"identity": path}
+                for encoding, suffix in ENCODINGS.items():
+                    if os.path.exists(path + suffix):
+                        paths[encoding] = path + suffix
+                stat = os.stat(path)
+                assets[name] = StaticAsset(
+                    content_type=mimetypes.guess_type(file_name)[0] or "application/octet-stream",
+                    immutable=name in hashed_names,
+                    paths=paths,
+                    etag=f"{stat.st_size:x}-{int(stat.st_mtime):x}",
+                )
+        return assets
+
+
+def choose_variant(asset: StaticAsset, request):
+    """
+    The encoding to answer with and the path of its file.
+    """
+    for encoding in accepted_encodings(request.headers.get("accept-encoding", "")):
+        if encoding in asset.paths:
+            return encoding, asset.paths[encoding]
+    return "identity", asset.paths["identity"]
+
+
+def asset_response(asset: StaticAsset, request, max_age: int, streaming: bool = True) -> HttpResponse:
+    """
+    Answers `request` with the best variant of `asset`. Without `streaming` the file is read whole, as ASGI servers
+    cannot stream a file the way WSGI ones do.
+    """
+    encoding, path = choose_variant(asset, request)
+    etag = f'"{asset.etag}-{encoding}"'
+    if etag in request.headers.get("if-none-match", ""):
+        response = HttpResponseNotModified()
+    elif request.method == "HEAD":
+        response = HttpResponse(content_type=asset.content_type)
+        response["Content-Length"] = os.path.getsize(path)
+    elif streaming:
+        response = FileResponse(open(path, "rb"), content_type=asset.content_type)
+        # The variant is named after the file, which is of no use to anyone
+        response.headers.pop("Content-Disposition", None)
+    else:
+        with open(path, "rb") as file:
+            response = HttpResponse(file.read(), content_type=asset.content_type)
+    if encoding != "identity" and response.status_code == 200:
+        response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Vary"] = "Accept-Encoding"
+    response["Cache-Control"] = IMMUTABLE if asset.immutable else f"public, max-age={max_age}"
+    return response
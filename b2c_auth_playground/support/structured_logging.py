@@ -0,0 +1,177 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from datetime import datetime
+from datetime import timezone
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+# Attributes every LogRecord has; whatever else is on a record came through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line with the time, level, logger and message, plus whatever was given through `extra`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Thins out noisy messages below WARNING. `rules` maps logger names (a rule covers the children of the logger too) to
+    either `{"sample": 0.1}`, keeping that share of the records, or `{"per_second": 5, "burst": 10}`, a token bucket
+    for each message template of the logger. The next record let through of a template tells how many were dropped.
+    """
+
+    def __init__(self, rules: Optional[Dict[str, dict]] = None):
+        super().__init__()
+        # Longest names first, so the most specific rule wins
+        self._rules = sorted((rules or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self._rule_by_logger: Dict[str, Optional[dict]] = {}
+        self._buckets: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def _rule_for(self, name: str) -> Optional[dict]:
+        try:
+            return self._rule_by_logger[name]
+        except KeyError:
+            pass
+        rule = next((rule for prefix, rule in self._rules if name == prefix or name.startswith(f"{prefix}.")), None)
+        self._rule_by_logger[name] = rule
+        return rule
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rule = self._rule_for(record.name)
+        if not rule:
+            return True
+        if "sample" in rule:
+            return random.random() < rule["sample"]
+        # The template, not the message, so every login shares the same budget
+        key = (record.name, str(record.msg))
+        rate, burst = rule["per_second"], rule.get("burst", rule["per_second"])
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.setdefault(key, [burst, now, 0])
+            tokens, counted_at, suppressed = bucket
+            tokens = min(burst, tokens + (now - counted_at) * rate)
+            if tokens < 1:
+                bucket[:] = [tokens, now, suppressed + 1]
+                return False
+            bucket[:] = [tokens - 1, now, 0]
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class QueueStreamHandler(QueueHandler):
+    """
+    Puts records in a bounded queue and returns; a listener thread formats them and writes them to `stream`. When the
+    queue is full records are dropped instead of making the request wait, and a warning says how many once there is
+    room again (at most once a second).
+
+    Only the message is rendered by the calling thread (its arguments may change once we return); the formatter runs
+    in the listener.
+    """
+
+    def __init__(self, stream=None, max_size: int = 10_000):
+        super().__init__(queue.Queue(maxsize=max_size))
+        self._target = logging.StreamHandler(stream or sys.stderr)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._reported_at = 0.0
+        self.listener = None
+        self._start_listener()
+        atexit.register(self.close)
+        # Threads do not survive a fork, so a worker forked after logging was configured starts its own listener
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def _start_listener(self) -> None:
+        self.listener = QueueListener(self.queue, self._target, respect_handler_level=True)
+        self.listener.start()
+
+    def _restart_after_fork(self) -> None:
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._start_listener()
+
+    def setFormatter(self, fmt: logging.Formatter) -> None:
+        # dictConfig sets the formatter on us, but formatting happens in the listener
+        self._target.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Other handlers may still need the record as it is
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            # Tracebacks keep frames alive, so they are rendered now
+            record.exc_text = (self._target.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self._dropped and time.monotonic() - self._reported_at >= 1:
+            self._report_dropped()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+
+    def _report_dropped(self) -> None:
+        with self._dropped_lock:
+            dropped, self._dropped = self._dropped, 0
+            self._reported_at = time.monotonic()
+        report = logging.LogRecord(
+            __name__, logging.WARNING, __file__, 0, "Dropped %s log records, the queue was full", (dropped,), None
+        )
+        try:
+            self.queue.put_nowait(self.prepare(report))
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += dropped
+
+    def close(self) -> None:
+        if self.listener:
+            if self._dropped:
+                self._report_dropped()
+            # Writes whatever is still queued before the process goes away
+            self.listener.stop()
+            self.listener = None
+        self._target.close()
+        super().close()
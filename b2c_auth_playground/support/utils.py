@@ -1,12 +0,0 @@
-import http.client as httplib
-
-
-def is_internet_available():
-    conn = httplib.HTTPConnection("www.google.com", timeout=5)
-    try:
-        conn.request("HEAD", "/")
-        conn.close()
-        return True
-    except:
-        conn.close()
-        return False
@@ -1,19 +1,40 @@
 from django.contrib import admin
 from django.urls import path
 
-from b2c_auth_playground.apps.core import views
-from b2c_auth_playground.apps.core.api import api_views
-from b2c_auth_playground.apps.core.api.v1 import api_views as api_views_v1
+from b2c_auth_playground.settings import B2C_VIEW_STACK
+from b2c_auth_playground.support.lazy_view import lazy_view
+
+# Views are imported on the first request that needs them, which keeps MSAL, PyJWT and friends out of worker boot
+is_async = B2C_VIEW_STACK == "async"
+if is_async:
+    pages, apis_v1 = "b2c_auth_playground.apps.core.views_async", "b2c_auth_playground.apps.core.api.v1.api_views_async"
+else:
+    pages, apis_v1 = "b2c_auth_playground.apps.core.views", "b2c_auth_playground.apps.core.api.v1.api_views"
+apis = "b2c_auth_playground.apps.core.api.api_views"
+
+
+def page(name: str):
+    return lazy_view(f"{pages}.{name}", is_async)
+
+
+def api_v1(name: str):
+    return lazy_view(f"{apis_v1}.{name}", is_async)
+
 
 urlpatterns = [
     # Pages
-    path("", views.index, name="index"),
-    path("login-auth-code", views.initiate_login_flow, name="login-auth-code-flow"),
-    path("logout", views.logout, name="logout"),
+    path("", page("index"), name="index"),
+    path("login-auth-code", page("initiate_login_flow"), name="login-auth-code-flow"),
+    path("edit-profile", page("initiate_profile_edit_flow"), name="edit-profile-flow"),
+    path("logout", page("logout"), name="logout"),
     path("admin/", admin.site.urls),
     # APIs
-    path("health-check", api_views.health_check, name="health-check"),
-    path("api/v1/response-oidc", api_views_v1.handle_response_oidc, name="v1/response-oidc"),
-    path("api/v1/user-data", api_views_v1.consult_user_data, name="v1/user-data"),
-    path("api/v1/what-i-have", api_views_v1.what_do_i_have, name="v1/what-i-have"),
+    path("health-check", lazy_view(f"{apis}.health_check"), name="health-check"),
+    path("metrics", lazy_view(f"{apis}.metrics"), name="metrics"),
+    path("profiles", lazy_view(f"{apis}.profiles"), name="profiles"),
+    path("profiles/<str:profile_id>", lazy_view(f"{apis}.download_profile"), name="download-profile"),
+    path("api/v1/response-oidc", api_v1("handle_response_oidc"), name="v1/response-oidc"),
+    path("api/v1/user-data", api_v1("consult_user_data"), name="v1/user-data"),
+    path("api/v1/what-i-have", api_v1("what_do_i_have"), name="v1/what-i-have"),
+    path("api/v1/introspect", api_v1("introspect"), name="v1/introspect"),
 ]
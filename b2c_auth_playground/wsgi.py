@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'b2c_auth_playground.settings')
 
 application = get_wsgi_application()
+
+from b2c_auth_playground.apps.core.startup import server_started  # noqa: E402 (needs the apps loaded)
+
+server_started()
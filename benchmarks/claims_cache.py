@@ -0,0 +1,68 @@
+"""
+Cost of verifying the same RS256 token with `jwt.decode` every time versus answering it from the verified-claims cache.
+
+    python -m benchmarks.claims_cache --iterations 5000 --threads 8
+"""
+
+import argparse
+import json
+import time
+import timeit
+
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from b2c_auth_playground.apps.core.services.claims_cache import VerifiedClaimsCache
+
+AUTHORITY = "https://benchmark.b2clogin.com/benchmark.onmicrosoft.com/b2c_1_sign_up_sign_in"
+AUDIENCE = "benchmark-client-id"
+
+
+def _sample_token(private_key) -> str:
+    now = int(time.time())
+    claims = {"iss": AUTHORITY, "aud": AUDIENCE, "sub": "benchmark", "iat": now, "nbf": now, "exp": now + 3600}
+    return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": "benchmark"})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_key = private_key.public_key()
+    token = _sample_token(private_key)
+
+    def verify():
+        return jwt.decode(token, public_key, algorithms=["RS256"], audience=AUDIENCE, issuer=AUTHORITY)
+
+    cache = VerifiedClaimsCache()
+
+    def cached():
+        return cache.get_or_verify(token, AUTHORITY, AUDIENCE, verify)
+
+    results = []
+    for label, call in (("jwt.decode", verify), ("cache", cached)):
+        per_call = timeit.timeit(call, number=args.iterations) / args.iterations
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            started = time.perf_counter()
+            list(executor.map(lambda _: call(), range(args.iterations)))
+            threaded = (time.perf_counter() - started) / args.iterations
+        results.append(
+            {
+                "path": label,
+                "single_thread_us": round(per_call * 1_000_000, 2),
+                f"{args.threads}_threads_us": round(threaded * 1_000_000, 2),
+            }
+        )
+    stats = cache.stats()
+    results.append({"hit_ratio": round(stats.hit_ratio, 4), "size": stats.size})
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
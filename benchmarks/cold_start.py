@@ -0,0 +1,140 @@
+"""
+Cold start of a worker: how long importing the WSGI and ASGI entry points takes, and then how long the first request
+takes to be answered, each in a fresh interpreter. Fails when a median goes over its budget, or when one of the
+`--lazy-modules` is already imported before the first request.
+
+    python -m benchmarks.cold_start --runs 5 --path /health-check --import-budget-ms 800 --first-request-budget-ms 400
+
+Warm ups are turned off unless `--with-warm-up` is given, so B2C being slow or unreachable does not count. Dependency
+probes run in the background, so the first health check may well answer 503 "starting"; it is timed all the same.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Runs in the fresh interpreter; everything it prints but the last line is ignored
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module} as entry_point
+imported = time.perf_counter()
+loaded_at_import = [name for name in {lazy_modules!r} if name in sys.modules]
+status = {stack}_request(entry_point.application, {path!r})
+answered = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (answered - imported) * 1000,
+    "status": status,
+    "loaded_at_import": loaded_at_import,
+}}))
+"""
+
+WSGI_REQUEST = """
+import io
+
+def wsgi_request(application, path):
+    environ = {
+        "REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": "", "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1", "HTTP_HOST": "localhost", "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(), "wsgi.errors": sys.stderr,
+    }
+    statuses = []
+    b"".join(application(environ, lambda status, headers, *args: statuses.append(status)))
+    return int(statuses[0].split()[0])
+"""
+
+ASGI_REQUEST = """
+import asyncio
+
+def asgi_request(application, path):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 50000), "server": ("localhost", 80),
+    }
+    messages, requests = [], [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # Django listens for a disconnect until the response is sent, then cancels this
+        await asyncio.Future()
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    return messages[0]["status"]
+"""
+
+ENTRY_POINTS = {
+    "wsgi": ("b2c_auth_playground.wsgi", "sync", WSGI_REQUEST),
+    "asgi": ("b2c_auth_playground.asgi", "async", ASGI_REQUEST),
+}
+
+
+def measure(entry_point: str, args) -> dict:
+    module, view_stack, request_helper = ENTRY_POINTS[entry_point]
+    code = request_helper + PROBE.format(
+        module=module, stack=entry_point, path=args.path, lazy_modules=tuple(args.lazy_modules)
+    )
+    environment = dict(os.environ, B2C_VIEW_STACK=view_stack)
+    if not args.with_warm_up:
+        environment.update(B2C_DISCOVERY_CACHE_WARM_UP="false", B2C_CLIENT_APP_POOL_WARM_UP="false")
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code], env=environment, capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "entry_point": entry_point,
+        "path": args.path,
+        "runs": args.runs,
+        "status": runs[-1]["status"],
+        "import_ms": round(statistics.median(run["import_ms"] for run in runs), 1),
+        "first_request_ms": round(statistics.median(run["first_request_ms"] for run in runs), 1),
+        "loaded_at_import": sorted({name for run in runs for name in run["loaded_at_import"]}),
+    }
+
+
+def over_budget(result: dict, args) -> list:
+    failures = []
+    if result["import_ms"] > args.import_budget_ms:
+        failures.append(f"importing took {result['import_ms']}ms, the budget is {args.import_budget_ms}ms")
+    if result["first_request_ms"] > args.first_request_budget_ms:
+        failures.append(
+            f"the first request took {result['first_request_ms']}ms, the budget is {args.first_request_budget_ms}ms"
+        )
+    if result["loaded_at_import"]:
+        failures.append(f"{', '.join(result['loaded_at_import'])} imported before the first request")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/health-check")
+    parser.add_argument("--entry-points", nargs="+", default=list(ENTRY_POINTS), choices=list(ENTRY_POINTS))
+    parser.add_argument("--import-budget-ms", type=float, default=1000)
+    parser.add_argument("--first-request-budget-ms", type=float, default=500)
+    parser.add_argument("--lazy-modules", nargs="*", default=["msal", "jwt", "requests", "httpx"])
+    parser.add_argument("--with-warm-up", action="store_true")
+    args = parser.parse_args()
+
+    results = []
+    for entry_point in args.entry_points:
+        result = measure(entry_point, args)
+        result["over_budget"] = over_budget(result, args)
+        results.append(result)
+    print(json.dumps(results, indent=4))
+    if any(result["over_budget"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Load test of the whole app against `fake_b2c`: the auth code login (`/login-auth-code` then `/api/v1/response-oidc`),
+the resource owner password login (POST `/`) and the APIs a signed-in user calls.
+
+    python -m benchmarks.end_to_end --stack sync --workers 2 --concurrency 50 --duration 30 \\
+        --b2c-latency token=40 --b2c-error-rate token=0.01 --baseline benchmarks/results/end_to_end-1a2b3c4.json
+
+Each virtual user signs in as one of `--users` identities, calls the APIs `--api-calls` times and starts over with a
+new session. The app, the fake B2C and their databases are created from scratch in a temporary directory.
+
+Results go to `benchmarks/results/end_to_end-<commit>.json` (or `--output`): throughput, errors and p50/p95/p99 for
+each endpoint, along with the mean of each stage the app reports at `/metrics`. With `--baseline` the run is also
+compared with a previous one.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.view_stack_throughput import SERVERS
+
+RESULTS_DIR = Path(__file__).parent / "results"
+ROOT_DIR = Path(__file__).resolve().parent.parent
+PASSWORD = "benchmark"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.journeys = 0
+
+    async def call(self, name: str, expected_status: int, request) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            response = None
+        self.latencies[name].append(time.perf_counter() - started)
+        if response is None or response.status_code != expected_status:
+            self.errors[name] += 1
+            return None
+        return response
+
+    def summary(self, duration: float) -> Dict[str, dict]:
+        return {name: _summarize(latencies, self.errors[name], duration) for name, latencies in self.latencies.items()}
+
+
+def _percentile(ordered: List[float], percent: float) -> float:
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return round(ordered[index] * 1000, 2)
+
+
+def _summarize(latencies: List[float], errors: int, duration: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "requests_per_second": round(len(ordered) / duration, 2),
+        "p50_ms": _percentile(ordered, 50),
+        "p95_ms": _percentile(ordered, 95),
+        "p99_ms": _percentile(ordered, 99),
+    }
+
+
+def _local_path(location: str) -> str:
+    parts = urlsplit(location)
+    return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+
+async def _auth_code_login(app, b2c, recorder: Recorder, user: str) -> bool:
+    started = await recorder.call("GET /login-auth-code", 302, app.get("/login-auth-code"))
+    if not started:
+        return False
+    # The fake authorize endpoint signs `login_hint` in right away and sends us back to the app
+    authorize_address = httpx.URL(started.headers["location"]).copy_add_param("login_hint", user)
+    authorized = await recorder.call("B2C authorize", 302, b2c.get(authorize_address))
+    if not authorized:
+        return False
+    callback = _local_path(authorized.headers["location"])
+    return bool(await recorder.call("GET /api/v1/response-oidc", 302, app.get(callback)))
+
+
+async def _password_login(app, recorder: Recorder, user: str) -> bool:
+    page = await recorder.call("GET /", 200, app.get("/"))
+    if not page:
+        return False
+    form = {"email": user, "password": PASSWORD, "csrfmiddlewaretoken": app.cookies.get("csrftoken")}
+    return bool(await recorder.call("POST /", 302, app.post("/", data=form)))
+
+
+async def _virtual_user(base_url: str, ca_file: str, recorder: Recorder, deadline: float, args) -> None:
+    async with httpx.AsyncClient(verify=ca_file, timeout=30) as b2c:
+        while time.monotonic() < deadline:
+            user = f"user-{random.randrange(args.users)}"
+            async with httpx.AsyncClient(base_url=base_url, timeout=30) as app:
+                if random.random() < args.password_ratio:
+                    signed_in = await _password_login(app, recorder, user)
+                else:
+                    signed_in = await _auth_code_login(app, b2c, recorder, user)
+                if not signed_in:
+                    continue
+                for _ in range(args.api_calls):
+                    await recorder.call("GET /api/v1/user-data", 200, app.get("/api/v1/user-data"))
+                    await recorder.call("GET /api/v1/what-i-have", 200, app.get("/api/v1/what-i-have"))
+            recorder.journeys += 1
+
+
+async def _wait_until_up(url: str, verify, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(verify=verify) as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def _drive(base_url: str, ca_file: str, args) -> dict:
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(*(_virtual_user(base_url, ca_file, recorder, deadline, args) for _ in range(args.concurrency)))
+    # Journeys started before the deadline are allowed to finish
+    elapsed = time.monotonic() - started
+    return {"duration": round(elapsed, 2), "journeys": recorder.journeys, "endpoints": recorder.summary(elapsed)}
+
+
+def _stages(exposition: str) -> Dict[str, dict]:
+    """
+    Count and mean of each `b2c_auth_stage_seconds` stage, as the app reported them at `/metrics`.
+    """
+    totals: Dict[str, Dict[str, float]] = defaultdict(dict)
+    for family in text_string_to_metric_families(exposition):
+        if family.name != "b2c_auth_stage_seconds":
+            continue
+        for sample in family.samples:
+            if sample.name.endswith(("_count", "_sum")):
+                totals[sample.labels["stage"]][sample.name.rsplit("_", 1)[1]] = sample.value
+    return {
+        stage: {"count": int(values["count"]), "mean_ms": round(values["sum"] / values["count"] * 1000, 2)}
+        for stage, values in sorted(totals.items())
+        if values.get("count")
+    }
+
+
+def _commit() -> Dict[str, Optional[str]]:
+    def git(*arguments):
+        completed = subprocess.run(["git", *arguments], cwd=ROOT_DIR, capture_output=True, text=True)
+        return completed.stdout.strip() if completed.returncode == 0 else None
+
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "--", "."))}
+
+
+def _compare(result: dict, baseline: dict) -> Dict[str, dict]:
+    comparison = {}
+    for name, current in result["endpoints"].items():
+        previous = baseline["endpoints"].get(name)
+        if not previous:
+            continue
+        comparison[name] = {
+            metric: f"{(current[metric] - previous[metric]) / previous[metric]:+.1%}" if previous[metric] else None
+            for metric in ("requests_per_second", "p50_ms", "p95_ms", "p99_ms")
+        }
+    return comparison
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="end-to-end-") as work_dir:
+        work_dir = Path(work_dir)
+        ca_file = str(work_dir / "cert.pem")
+        authority_host = f"https://127.0.0.1:{args.b2c_port}"
+        b2c_command = [
+            sys.executable,
+            "-m",
+            "benchmarks.fake_b2c",
+            "--port",
+            str(args.b2c_port),
+            "--cert-dir",
+            str(work_dir),
+            "--password",
+            PASSWORD,
+            "--jitter",
+            str(args.b2c_jitter),
+        ]
+        for value in args.b2c_latency:
+            b2c_command += ["--latency", value]
+        for value in args.b2c_error_rate:
+            b2c_command += ["--error-rate", value]
+        environment = dict(
+            os.environ,
+            B2C_AUTHORITY_TEMPLATE=f"{authority_host}/fake.onmicrosoft.com/{{user_flow}}",
+            REQUESTS_CA_BUNDLE=ca_file,
+            SSL_CERT_FILE=ca_file,
+            DATABASE_PATH=str(work_dir / "db.sqlite3"),
+            B2C_TOKEN_CACHE_STORE_PATH=str(work_dir / "token_cache.sqlite3"),
+            B2C_LEASE_STORE_PATH=str(work_dir / "leases.sqlite3"),
+            B2C_ADMISSION_STORE_PATH=str(work_dir / "admission.sqlite3"),
+            B2C_DISCOVERY_CACHE_DIR=str(work_dir / "discovery_cache"),
+            B2C_VIEW_STACK=args.stack,
+            ROOT_LOG_LEVEL="WARNING",
+            PROJECT_LOG_LEVEL="WARNING",
+            DJANGO_LOG_LEVEL="WARNING",
+            PROMETHEUS_MULTIPROC_DIR=str(work_dir / "metrics"),
+            B2C_METRICS_PUBLIC="true",
+        )
+        b2c = subprocess.Popen(b2c_command, cwd=ROOT_DIR, stdout=subprocess.DEVNULL)
+        app = None
+        try:
+            # The certificate the app has to trust is written right before the fake starts listening
+            discovery = f"{authority_host}/fake.onmicrosoft.com/b2c_1/v2.0/.well-known/openid-configuration"
+            asyncio.run(_wait_until_up(discovery, verify=False))
+            subprocess.run(
+                [sys.executable, "manage.py", "migrate", "-v", "0"], cwd=ROOT_DIR, env=environment, check=True
+            )
+            app = subprocess.Popen(SERVERS[args.stack](args.port, args.workers), cwd=ROOT_DIR, env=environment)
+            base_url = f"http://127.0.0.1:{args.port}"
+            asyncio.run(_wait_until_up(f"{base_url}/health-check", verify=True))
+            measured = asyncio.run(_drive(base_url, ca_file, args))
+            measured["stages"] = _stages(httpx.get(f"{base_url}/metrics").text)
+        finally:
+            for process in (app, b2c):
+                if process:
+                    process.terminate()
+                    process.wait()
+
+    return {
+        **_commit(),
+        "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "config": {name: value for name, value in vars(args).items() if name not in ("output", "baseline")},
+        **measured,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stack", default="sync", choices=list(SERVERS))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--users", type=int, default=100, help="Distinct identities the virtual users sign in as")
+    parser.add_argument("--api-calls", type=int, default=3, help="API calls made after each login")
+    parser.add_argument("--password-ratio", type=float, default=0.2, help="Share of logins done with ROPC")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--b2c-port", type=int, default=8443)
+    parser.add_argument("--b2c-latency", action="append", default=[], help="Passed to fake_b2c --latency")
+    parser.add_argument("--b2c-jitter", type=float, default=0, help="Passed to fake_b2c --jitter")
+    parser.add_argument("--b2c-error-rate", action="append", default=[], help="Passed to fake_b2c --error-rate")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path, help="Previous result to compare with")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.baseline:
+        result["compared_with"] = {
+            "commit": json.loads(args.baseline.read_text()).get("commit"),
+            "endpoints": _compare(result, json.loads(args.baseline.read_text())),
+        }
+    output = args.output or RESULTS_DIR / f"end_to_end-{result['commit'] or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=4))
+    print(json.dumps(result, indent=4))
+    print(f"Saved to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Stand-in for an Azure AD B2C tenant, so the whole login journey can be measured without a real one.
+
+    python -m benchmarks.fake_b2c --port 8443 --cert-dir /tmp/fake-b2c --latency token=40 --error-rate token=0.01
+
+It serves, for any user flow, OIDC discovery, the JWKS, the authorize endpoint (which signs the user in right away,
+taking `login_hint` as the user) and the token endpoint for the authorization code (with PKCE), refresh token and
+resource owner password grants. Tokens are real RS256 JWTs signed by a key generated at startup.
+
+MSAL only talks to https authorities, so the server generates a self-signed certificate in `--cert-dir`. Point the
+app to it with:
+
+    B2C_AUTHORITY_TEMPLATE=https://127.0.0.1:8443/fake.onmicrosoft.com/{user_flow}
+    REQUESTS_CA_BUNDLE=/tmp/fake-b2c/cert.pem SSL_CERT_FILE=/tmp/fake-b2c/cert.pem
+
+Latency (milliseconds) and error rates (0 to 1) are given per endpoint: discovery, jwks, authorize, token or logout.
+"""
+
+import argparse
+import base64
+import datetime
+import hashlib
+import ipaddress
+import json
+import random
+import re
+import secrets
+import ssl
+import threading
+import time
+import uuid
+
+from dataclasses import dataclass
+from dataclasses import field
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import parse_qs
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+
+import jwt
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+ENDPOINTS = ["discovery", "jwks", "authorize", "token", "logout"]
+OIDC_SCOPES = {"openid", "profile", "offline_access"}
+REFRESH_TOKEN_LIFETIME = 14 * 24 * 60 * 60
+
+ROUTES = [
+    ("discovery", re.compile(r"^/(?P<tenant>[^/]+)/(?P<policy>[^/]+)/v2\.0/\.well-known/openid-configuration$")),
+    ("jwks", re.compile(r"^/(?P<tenant>[^/]+)/(?P<policy>[^/]+)/discovery/v2\.0/keys$")),
+    ("authorize", re.compile(r"^/(?P<tenant>[^/]+)/(?P<policy>[^/]+)/oauth2/v2\.0/authorize$")),
+    ("token", re.compile(r"^/(?P<tenant>[^/]+)/(?P<policy>[^/]+)/oauth2/v2\.0/token$")),
+    ("logout", re.compile(r"^/(?P<tenant>[^/]+)/(?P<policy>[^/]+)/oauth2/v2\.0/logout$")),
+]
+
+
+class OAuthError(Exception):
+    def __init__(self, error: str, description: str, status: int = 400):
+        super().__init__(description)
+        self.error = error
+        self.description = description
+        self.status = status
+
+
+@dataclass(frozen=True)
+class Grant:
+    user: str
+    policy: str
+    client_id: str
+    scopes: Tuple[str, ...]
+    nonce: Optional[str] = None
+    redirect_uri: Optional[str] = None
+    code_challenge: Optional[str] = None
+    auth_time: int = field(default_factory=lambda: int(time.time()))
+
+
+@dataclass
+class FaultInjection:
+    latency: Dict[str, float] = field(default_factory=dict)
+    jitter: float = 0
+    error_rates: Dict[str, float] = field(default_factory=dict)
+    error_status: int = 503
+
+    def delay(self, endpoint: str) -> None:
+        seconds = self.latency.get(endpoint, 0) + random.uniform(0, self.jitter)
+        if seconds:
+            time.sleep(seconds)
+
+    def should_fail(self, endpoint: str) -> bool:
+        return random.random() < self.error_rates.get(endpoint, 0)
+
+
+class FakeB2C:
+    def __init__(self, base_url: str, tenant_id: str, password: str, token_lifetime: int, faults: FaultInjection):
+        self.base_url = base_url
+        self.tenant_id = tenant_id
+        self.password = password
+        self.token_lifetime = token_lifetime
+        self.faults = faults
+        self.kid = secrets.token_urlsafe(8)
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._codes: Dict[str, Grant] = {}
+        self._refresh_tokens: Dict[str, Grant] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def issuer(self) -> str:
+        return f"{self.base_url}/{self.tenant_id}/v2.0/"
+
+    def discovery(self, tenant: str, policy: str) -> dict:
+        authority = f"{self.base_url}/{tenant}/{policy}"
+        return {
+            "issuer": self.issuer,
+            "authorization_endpoint": f"{authority}/oauth2/v2.0/authorize",
+            "token_endpoint": f"{authority}/oauth2/v2.0/token",
+            "end_session_endpoint": f"{authority}/oauth2/v2.0/logout",
+            "jwks_uri": f"{authority}/discovery/v2.0/keys",
+            "response_modes_supported": ["query", "fragment", "form_post"],
+            "response_types_supported": ["code", "code id_token", "code token", "code id_token token", "id_token"],
+            "scopes_supported": ["openid"],
+            "subject_types_supported": ["pairwise"],
+            "id_token_signing_alg_values_supported": ["RS256"],
+            "token_endpoint_auth_methods_supported": ["client_secret_post", "client_secret_basic"],
+            "claims_supported": ["name", "given_name", "family_name", "oid", "sub", "tfp", "iss", "iat", "exp"],
+        }
+
+    def jwks(self) -> dict:
+        public_jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self._private_key.public_key()))
+        return {"keys": [dict(public_jwk, kid=self.kid, use="sig", alg="RS256")]}
+
+    def authorize(self, policy: str, query: Dict[str, str]) -> str:
+        for name in ("client_id", "redirect_uri", "response_type"):
+            if not query.get(name):
+                raise OAuthError("invalid_request", f"AADB2C90014: The claim '{name}' is missing")
+        if query.get("code_challenge") and query.get("code_challenge_method", "plain") != "S256":
+            raise OAuthError("invalid_request", "AADB2C90183: The supplied code_challenge_method is not supported")
+        code = secrets.token_urlsafe(32)
+        grant = Grant(
+            user=query.get("login_hint") or "anonymous",
+            policy=policy,
+            client_id=query["client_id"],
+            scopes=tuple(query.get("scope", "openid").split()),
+            nonce=query.get("nonce"),
+            redirect_uri=query["redirect_uri"],
+            code_challenge=query.get("code_challenge"),
+        )
+        with self._lock:
+            self._codes[code] = grant
+        parameters = {"code": code}
+        if query.get("state"):
+            parameters["state"] = query["state"]
+        return f"{query['redirect_uri']}?{urlencode(parameters)}"
+
+    def token(self, policy: str, form: Dict[str, str]) -> dict:
+        grant_type = form.get("grant_type")
+        if grant_type == "authorization_code":
+            grant = self._redeem_code(form)
+        elif grant_type == "refresh_token":
+            with self._lock:
+                grant = self._refresh_tokens.pop(form.get("refresh_token", ""), None)
+            if not grant:
+                raise OAuthError("invalid_grant", "AADB2C90080: The provided grant has expired")
+        elif grant_type == "password":
+            if form.get("password") != self.password:
+                raise OAuthError(
+                    "access_denied", "AADB2C90225: The username or password provided in the request are invalid."
+                )
+            grant = Grant(
+                user=form.get("username") or "anonymous",
+                policy=policy,
+                client_id=form.get("client_id", ""),
+                scopes=tuple(form.get("scope", "openid").split()),
+            )
+        else:
+            raise OAuthError("unsupported_grant_type", f"AADB2C90086: The supplied grant_type [{grant_type}]")
+        if grant.policy.lower() != policy.lower():
+            raise OAuthError(
+                "invalid_grant",
+                f"AADB2C90088: The provided grant has not been issued for this endpoint. "
+                f"Actual Value : {grant.policy} and Expected Value : {policy}",
+            )
+        return self._issue(grant)
+
+    def _redeem_code(self, form: Dict[str, str]) -> Grant:
+        with self._lock:
+            grant = self._codes.pop(form.get("code", ""), None)
+        if not grant:
+            raise OAuthError("invalid_grant", "AADB2C90080: The provided grant has expired")
+        if grant.redirect_uri != form.get("redirect_uri"):
+            raise OAuthError("redirect_uri_mismatch", "AADB2C90006: The redirect URI provided is not registered")
+        if grant.code_challenge:
+            verifier = form.get("code_verifier", "")
+            digest = hashlib.sha256(verifier.encode("ascii")).digest()
+            if base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii") != grant.code_challenge:
+                raise OAuthError("invalid_grant", "AADB2C90181: The code_verifier does not match the code_challenge")
+        return grant
+
+    def _issue(self, grant: Grant) -> dict:
+        now = int(time.time())
+        object_id = str(uuid.uuid5(uuid.NAMESPACE_URL, grant.user))
+        claims = {
+            "exp": now + self.token_lifetime,
+            "nbf": now,
+            "ver": "1.0",
+            "iss": self.issuer,
+            "sub": object_id,
+            "aud": grant.client_id,
+            "iat": now,
+            "auth_time": grant.auth_time,
+            "oid": object_id,
+            "given_name": grant.user,
+            "family_name": "Benchmark",
+            "name": grant.user,
+            "tfp": grant.policy,
+        }
+        if grant.nonce:
+            claims["nonce"] = grant.nonce
+        client_info = {"uid": f"{object_id}-{grant.policy.lower()}", "utid": self.tenant_id}
+        refresh_token = secrets.token_urlsafe(48)
+        with self._lock:
+            self._refresh_tokens[refresh_token] = grant
+        body = {
+            "id_token": self._sign(claims),
+            "token_type": "Bearer",
+            "not_before": now,
+            "client_info": base64.urlsafe_b64encode(json.dumps(client_info).encode("utf-8")).decode("ascii"),
+            "scope": " ".join(grant.scopes),
+            "refresh_token": refresh_token,
+            "refresh_token_expires_in": REFRESH_TOKEN_LIFETIME,
+        }
+        resource_scopes = [scope for scope in grant.scopes if scope not in OIDC_SCOPES]
+        if resource_scopes:
+            access_claims = {key: claims[key] for key in ("iss", "exp", "nbf", "sub", "oid", "tfp", "iat")}
+            access_claims.update(aud=grant.client_id, azp=grant.client_id, scp=" ".join(resource_scopes))
+            body.update(
+                access_token=self._sign(access_claims),
+                expires_in=self.token_lifetime,
+                expires_on=now + self.token_lifetime,
+            )
+        return body
+
+    def _sign(self, claims: dict) -> str:
+        return jwt.encode(claims, self._private_key, algorithm="RS256", headers={"kid": self.kid})
+
+
+def _handler_for(b2c: FakeB2C):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self._dispatch(parse_qs(urlsplit(self.path).query))
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self._dispatch(parse_qs(self.rfile.read(length).decode("utf-8")))
+
+        def _dispatch(self, parameters: Dict[str, List[str]]):
+            path = urlsplit(self.path).path
+            for endpoint, pattern in ROUTES:
+                match = pattern.match(path)
+                if match:
+                    break
+            else:
+                return self._send_json(404, {"error": "not_found"})
+            b2c.faults.delay(endpoint)
+            if b2c.faults.should_fail(endpoint):
+                status = b2c.faults.error_status
+                return self._send_json(status, {"error": "server_error", "error_description": "Injected failure"})
+            parameters = {name: values[0] for name, values in parameters.items()}
+            tenant, policy = match.group("tenant"), match.group("policy")
+            try:
+                if endpoint == "discovery":
+                    self._send_json(200, b2c.discovery(tenant, policy))
+                elif endpoint == "jwks":
+                    self._send_json(200, b2c.jwks())
+                elif endpoint == "authorize":
+                    self._redirect(b2c.authorize(policy, parameters))
+                elif endpoint == "token":
+                    self._send_json(200, b2c.token(policy, parameters))
+                else:
+                    self._redirect(parameters.get("post_logout_redirect_uri") or f"{b2c.base_url}/")
+            except OAuthError as e:
+                self._send_json(e.status, {"error": e.error, "error_description": e.description})
+
+        def _send_json(self, status: int, body: dict):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _redirect(self, location: str):
+            self.send_response(302)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    return Handler
+
+
+def write_self_signed_certificate(cert_dir: Path, host: str) -> Tuple[Path, Path]:
+    cert_dir.mkdir(parents=True, exist_ok=True)
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+    alternative_names = [x509.DNSName("localhost")]
+    try:
+        alternative_names.append(x509.IPAddress(ipaddress.ip_address(host)))
+    except ValueError:
+        alternative_names.append(x509.DNSName(host))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=7))
+        .add_extension(x509.SubjectAlternativeName(alternative_names), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = cert_dir / "cert.pem", cert_dir / "key.pem"
+    cert_path.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    )
+    return cert_path, key_path
+
+
+def build_server(host: str, port: int, cert_dir: Path, b2c: FakeB2C) -> ThreadingHTTPServer:
+    cert_path, key_path = write_self_signed_certificate(cert_dir, host)
+    server = ThreadingHTTPServer((host, port), _handler_for(b2c))
+    server.daemon_threads = True
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    return server
+
+
+def _per_endpoint(values: List[str], scale: float = 1) -> Dict[str, float]:
+    parsed = {}
+    for value in values:
+        endpoint, _, number = value.partition("=")
+        if endpoint not in ENDPOINTS and endpoint != "all":
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {endpoint}, expected one of {ENDPOINTS}")
+        for name in ENDPOINTS if endpoint == "all" else [endpoint]:
+            parsed[name] = float(number) * scale
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--cert-dir", type=Path, default=Path("/tmp/fake-b2c"))
+    parser.add_argument("--tenant-id", default="03f16fb5-12d8-4a0b-a65e-d325ea25ed2a")
+    parser.add_argument("--password", default="benchmark", help="Accepted by the resource owner password grant")
+    parser.add_argument("--token-lifetime", type=int, default=3600)
+    parser.add_argument("--latency", action="append", default=[], help="ENDPOINT=MILLISECONDS, or all=MILLISECONDS")
+    parser.add_argument("--jitter", type=float, default=0, help="Random extra latency, up to these milliseconds")
+    parser.add_argument("--error-rate", action="append", default=[], help="ENDPOINT=FRACTION, or all=FRACTION")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    faults = FaultInjection(
+        latency=_per_endpoint(args.latency, scale=1 / 1000),
+        jitter=args.jitter / 1000,
+        error_rates=_per_endpoint(args.error_rate),
+        error_status=args.error_status,
+    )
+    b2c = FakeB2C(f"https://{args.host}:{args.port}", args.tenant_id, args.password, args.token_lifetime, faults)
+    server = build_server(args.host, args.port, args.cert_dir, b2c)
+    print(json.dumps({"base_url": b2c.base_url, "ca_file": str(args.cert_dir / "cert.pem")}), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Cost of answering GET / by rendering the home page template versus filling in its cached skeleton
+(B2C_HOME_PAGE_RENDERING), for an anonymous and a signed-in visitor: first the render alone, in this process, then
+requests per second against a server started with each mode.
+
+    python -m benchmarks.home_page_render --iterations 2000 --stack sync --workers 2 --concurrency 50 --duration 10
+
+`--duration 0` only measures the render. The signed-in visitor is a session created in the app's database.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import timeit
+
+from benchmarks.view_stack_throughput import SERVERS
+from benchmarks.view_stack_throughput import _drive
+from benchmarks.view_stack_throughput import _wait_until_up
+
+MODES = ["template", "cached"]
+CLAIMS = {"given_name": "Benchmark", "family_name": "User", "emails": ["benchmark@example.com"]}
+
+
+def _render_times(args) -> list:
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.shortcuts import render
+    from django.test import RequestFactory
+
+    from b2c_auth_playground.apps.core.services.page_cache import render_home_page
+
+    renderers = {
+        "template": lambda request: render(request, "core/pages/home.html"),
+        "cached": render_home_page,
+    }
+    results = []
+    for state in ("anonymous", "signed_in"):
+        request = RequestFactory().get("/")
+        request.session = SessionStore()
+        if state == "signed_in":
+            request.session["user"] = CLAIMS
+        for mode in MODES:
+            renderer = renderers[mode]
+            # The first call fills Django's template cache and builds the skeleton
+            renderer(request)
+            per_call = timeit.timeit(lambda: renderer(request), number=args.iterations) / args.iterations
+            results.append({"mode": mode, "state": state, "render_us": round(per_call * 1_000_000, 2)})
+    return results
+
+
+def _signed_in_session() -> str:
+    from django.contrib.sessions.backends.db import SessionStore
+
+    session = SessionStore()
+    session["user"] = CLAIMS
+    session.create()
+    return session.session_key
+
+
+def _throughput(args, session_key: str) -> list:
+    results = []
+    base_url = f"http://127.0.0.1:{args.port}"
+    for mode in MODES:
+        environment = dict(os.environ, B2C_VIEW_STACK=args.stack, B2C_HOME_PAGE_RENDERING=mode)
+        server = subprocess.Popen(SERVERS[args.stack](args.port, args.workers), env=environment)
+        try:
+            asyncio.run(_wait_until_up(base_url))
+            for state, cookies in (("anonymous", {}), ("signed_in", {"sessionid": session_key})):
+                result = asyncio.run(_drive(f"{base_url}/", args.concurrency, args.duration, cookies))
+                results.append(dict(mode=mode, state=state, stack=args.stack, **result))
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--stack", default="sync", choices=list(SERVERS))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "b2c_auth_playground.settings")
+    os.environ.setdefault("B2C_DISCOVERY_CACHE_WARM_UP", "false")
+    import django
+
+    django.setup()
+    # The app's logging config would log every request the benchmark makes
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = {"render": _render_times(args)}
+    if args.duration:
+        results["throughput"] = _throughput(args, _signed_in_session())
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Bytes a browser transfers to load a page and the static files it links to, on a first visit and on a repeat visit
+with a warm cache, for each `Accept-Encoding`. The `unhashed` row is the page as the dev server links it (no content
+hashes, so the browser has to ask again for each file on every visit), which is how static files used to be served.
+
+    python -m benchmarks.static_transfer --path /
+
+Static files are collected into a temporary directory first; the JS bundle must have been built (`npm run build`).
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import Client
+
+ENCODINGS = ["identity", "gzip", "gzip, deflate, br"]
+
+
+def _wire_size(response) -> int:
+    body = b"".join(response.streaming_content) if response.streaming else response.content
+    return len(response.serialize_headers()) + len(body)
+
+
+def _asset_urls(page: bytes) -> list:
+    return sorted(set(re.findall(rf'(?:src|href)="({re.escape(settings.STATIC_URL)}[^"]+)"', page.decode())))
+
+
+def measure(client: Client, path: str, label: str, accept_encoding: str) -> dict:
+    page = client.get(path, HTTP_ACCEPT_ENCODING=accept_encoding)
+    urls = _asset_urls(page.content)
+    first_visit, repeat_visit, repeat_requests = _wire_size(page), _wire_size(page), 1
+    for url in urls:
+        response = client.get(url, HTTP_ACCEPT_ENCODING=accept_encoding)
+        if response.status_code != 200:
+            raise SystemExit(f"{url} answered {response.status_code}")
+        first_visit += _wire_size(response)
+        if "immutable" in response.get("Cache-Control", ""):
+            continue
+        revalidation = client.get(url, HTTP_ACCEPT_ENCODING=accept_encoding, HTTP_IF_NONE_MATCH=response["ETag"])
+        repeat_visit += _wire_size(revalidation)
+        repeat_requests += 1
+    return {
+        "urls": label,
+        "accept_encoding": accept_encoding,
+        "assets": len(urls),
+        "first_visit_bytes": first_visit,
+        "repeat_visit_bytes": repeat_visit,
+        "repeat_visit_requests": repeat_requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="/")
+    args = parser.parse_args()
+
+    static_root = tempfile.mkdtemp(prefix="static-transfer-")
+    os.environ.update(
+        DJANGO_SETTINGS_MODULE="b2c_auth_playground.settings",
+        STATIC_ROOT=static_root,
+        B2C_STATIC_SERVE="true",
+        B2C_DISCOVERY_CACHE_WARM_UP="false",
+    )
+    import django
+
+    django.setup()
+    call_command("collectstatic", interactive=False, verbosity=0)
+
+    results = []
+    client = Client()
+    for label, debug, encodings in (("unhashed", True, ENCODINGS[:1]), ("hashed", False, ENCODINGS)):
+        # `{% static %}` only gives hashed names when DEBUG is off
+        settings.DEBUG = debug
+        for accept_encoding in encodings:
+            try:
+                results.append(measure(client, args.path, label, accept_encoding))
+            except ValueError as e:
+                sys.exit(f"{e} Was the JS bundle built?")
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
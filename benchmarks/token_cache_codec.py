@@ -0,0 +1,59 @@
+"""
+Compares the compact token cache codec with the JSON MSAL produces through `cache.serialize()`.
+
+    python -m benchmarks.token_cache_codec --iterations 5000
+"""
+
+import argparse
+import json
+import timeit
+
+from pathlib import Path
+
+from msal import SerializableTokenCache
+
+from b2c_auth_playground.apps.core.services.token_cache_codec import dumps_cache
+from b2c_auth_playground.apps.core.services.token_cache_codec import loads_cache
+
+SAMPLE = Path(__file__).parent / "samples" / "token_cache.json"
+
+
+def _measure(label, iterations, encode, decode):
+    encoded = encode()
+    encode_time = timeit.timeit(encode, number=iterations) / iterations
+    decode_time = timeit.timeit(lambda: decode(encoded), number=iterations) / iterations
+    return {
+        "codec": label,
+        "bytes": len(encoded.encode("utf-8")),
+        "encode_us": round(encode_time * 1_000_000, 2),
+        "decode_us": round(decode_time * 1_000_000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    cache = SerializableTokenCache()
+    cache.deserialize(SAMPLE.read_text())
+
+    results = [
+        _measure(
+            "json",
+            args.iterations,
+            cache.serialize,
+            lambda value: SerializableTokenCache().deserialize(value),
+        ),
+        _measure(
+            "compact",
+            args.iterations,
+            lambda: dumps_cache(cache),
+            lambda value: loads_cache(SerializableTokenCache(), value),
+        ),
+    ]
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
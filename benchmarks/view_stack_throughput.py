@@ -0,0 +1,119 @@
+"""
+Throughput of the sync (gunicorn + WSGI) and async (uvicorn + ASGI) view stacks with the same number of workers.
+
+    python -m benchmarks.view_stack_throughput --workers 2 --concurrency 200 --duration 10 --path /api/v1/user-data
+
+Each stack is started as a subprocess, warmed up and then driven by `concurrency` clients for `duration` seconds.
+Pages that talk to B2C need a reachable authority, otherwise you are measuring how fast failures happen.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+SERVERS = {
+    "sync": lambda port, workers: [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "--workers",
+        str(workers),
+        "--bind",
+        f"127.0.0.1:{port}",
+        "b2c_auth_playground.wsgi:application",
+    ],
+    "async": lambda port, workers: [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "--workers",
+        str(workers),
+        "--port",
+        str(port),
+        "--log-level",
+        "warning",
+        "b2c_auth_playground.asgi:application",
+    ],
+}
+
+
+async def _wait_until_up(base_url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"{base_url}/health-check")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not come up")
+
+
+async def _drive(url: str, concurrency: int, duration: float, cookies: dict) -> dict:
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30, cookies=cookies) as client:
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    if response.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / duration, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+    }
+
+
+def run_stack(stack: str, args) -> dict:
+    environment = dict(os.environ, B2C_VIEW_STACK=stack)
+    server = subprocess.Popen(SERVERS[stack](args.port, args.workers), env=environment)
+    base_url = f"http://127.0.0.1:{args.port}"
+    cookies = {"sessionid": args.session_id} if args.session_id else {}
+    try:
+        asyncio.run(_wait_until_up(base_url))
+        result = asyncio.run(_drive(f"{base_url}{args.path}", args.concurrency, args.duration, cookies))
+    finally:
+        server.terminate()
+        server.wait()
+    return dict(stack=stack, workers=args.workers, concurrency=args.concurrency, path=args.path, **result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--session-id", help="Value of the sessionid cookie, to measure pages of a logged user")
+    parser.add_argument("--stacks", nargs="+", default=["sync", "async"], choices=list(SERVERS))
+    args = parser.parse_args()
+
+    results = [run_stack(stack, args) for stack in args.stacks]
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
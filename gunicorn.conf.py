@@ -0,0 +1,35 @@
+import os
+import shutil
+
+from pathlib import Path
+
+# Must be set before anything imports prometheus_client, which only then decides whether workers write their metrics
+# to files; workers inherit it
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", str(Path(__file__).resolve().parent / "metrics"))
+
+from prometheus_client import multiprocess  # noqa: E402
+
+from b2c_auth_playground.settings import B2C_METRICS_DIR  # noqa: E402
+from b2c_auth_playground.settings import B2C_STARTUP_MODE  # noqa: E402
+
+
+def on_starting(server):
+    # Files left by a previous run would be added to the metrics of this one
+    shutil.rmtree(B2C_METRICS_DIR, ignore_errors=True)
+    os.makedirs(B2C_METRICS_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid, path=B2C_METRICS_DIR)
+
+
+# Load the app once in the parent, so forked workers share MSAL and friends instead of importing them each
+preload_app = B2C_STARTUP_MODE == "preload"
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # Connections and threads must not be shared with the parent, so warming up waits until the worker exists
+        from b2c_auth_playground.apps.core.startup import start_background_work
+
+        start_background_work()